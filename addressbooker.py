@@ -21,7 +21,10 @@ import logging
 import pprint
 import random
 import re
+import StringIO
+import time
 import urllib
+import zlib
 
 # Core/AppEngine stuff
 import wsgiref.handlers
@@ -30,10 +33,13 @@ from google.appengine.ext import webapp
 from google.appengine.ext import db
 from google.appengine.ext.webapp import template
 from google.appengine.api import urlfetch
+from google.appengine.api import memcache
 
 # Libraries included w/ app
 import atom
 import atom.http_interface
+import atom.rate_limit
+import atom.retry
 import atom.token_store
 import atom.url
 import gdata.alt.appengine
@@ -48,6 +54,64 @@ import models
 
 VALID_HANDLE = re.compile(r"^\w+$")
 
+CONTACTS_URL = "http://www.google.com/m8/feeds/contacts/default/full"
+GROUPS_URL = "http://www.google.com/m8/feeds/groups/default/full"
+
+# The members of a Google contact entry which the merge reads or changes.
+# The rest of each entry is kept as unconverted XML and sent back as is.
+MERGE_ENTRY_FIELDS = ("id", "title", "link", "phone_number",
+                      "group_membership_info")
+
+# How long a user's group name -> id map stays in memcache.
+GROUPS_CACHE_SECONDS = 10 * 60
+
+# Batches a commit request keeps on the wire at once, as asynchronous
+# urlfetch calls.
+BATCHES_IN_FLIGHT = 2
+
+# Batch sizes adapt between 1 and MAX_BATCH_SIZE (the API maximum) to
+# the latency seen, starting from INITIAL_BATCH_SIZE, so that a batch is
+# expected to take at most BATCH_TIME_FRACTION of the time left.  A batch
+# slower than the average then still finishes before the deadline.
+INITIAL_BATCH_SIZE = 15
+MAX_BATCH_SIZE = 100
+BATCH_TIME_FRACTION = 0.5
+
+# App Engine kills requests after REQUEST_DEADLINE_SECONDS; a commit
+# stops sending batches DEADLINE_MARGIN_SECONDS before that to leave
+# time for the checkpoint and redirect.
+REQUEST_DEADLINE_SECONDS = 30
+DEADLINE_MARGIN_SECONDS = 8
+
+# Batch operations failing with one of these statuses are tried again,
+# up to MAX_BATCH_RETRIES times, waiting BATCH_RETRY_SECONDS and then
+# twice as long each time.
+RETRYABLE_BATCH_CODES = (500, 502, 503, 504)
+MAX_BATCH_RETRIES = 3
+BATCH_RETRY_SECONDS = 1
+
+# Single GETs, PUTs and DELETEs failing with a server error are retried
+# by this policy.  It's shared by every request this instance serves, so
+# its circuit breakers stop hammering a host that keeps failing.
+REQUEST_RETRY_POLICY = atom.retry.RetryPolicy(
+    max_delay=5,
+    retry_exceptions=(atom.retry.RetryPolicy.retry_exceptions +
+                      (urlfetch.DownloadError,)))
+
+# Errors which mean Google can't be reached at all for now, rather than
+# that a request was refused.  A merge meeting one saves its checkpoint
+# and asks the user to carry on in TRY_LATER_SECONDS or so.
+UNAVAILABLE_ERRORS = (atom.retry.CircuitOpen, urlfetch.DownloadError)
+TRY_LATER_SECONDS = 60
+
+# Requests for one user are smoothed to REQUESTS_PER_SECOND_PER_USER,
+# allowing bursts of REQUEST_BURST, to stay clear of the per-user quota;
+# waiting costs less than a quota error.  Shared like the retry policy.
+REQUESTS_PER_SECOND_PER_USER = 3
+REQUEST_BURST = 10
+REQUEST_RATE_LIMITER = atom.rate_limit.RateLimiter(
+    user_rate=(REQUESTS_PER_SECOND_PER_USER, REQUEST_BURST))
+
 def contactsFromJson(json):
   contacts = simplejson.loads(json)
   # if it's fully formed PoCo, grab the list out of 'entry', otherwise assume a list
@@ -56,17 +120,127 @@ def contactsFromJson(json):
   except:
     return contacts
 
+def NormalizeContacts(contacts):
+  """Computes the canonical form of submitted PoCo contacts.
+
+  Does all the regex work on the submitted data up front so the
+  handlers reading a PostDump later don't have to.
+
+  Args:
+    contacts: list of contact dicts, as returned by contactsFromJson.
+
+  Returns: list of dicts with 'displayName', 'img' (if given) and
+    'phoneNumbers', where each number has the submitted 'value' and
+    'type' plus its suffix 'key', GData 'rel' and 'vcardType'.
+  """
+  normalized = []
+  for contact in contacts:
+    numbers = []
+    for number_rec in contact.get("phoneNumbers", []):
+      value = number_rec.get("value", "")
+      rel = PhoneRelType(number_rec.get("type", ""))
+      numbers.append({
+        "value": value,
+        "type": number_rec.get("type", ""),
+        "key": PhoneSuffixKey(value),
+        "rel": rel,
+        "vcardType": VcardPhoneType(rel),
+        })
+    normalized_contact = {
+      "displayName": contact.get("displayName"),
+      "phoneNumbers": numbers,
+      }
+    if contact.has_key("img"):
+      normalized_contact["img"] = contact["img"]
+    normalized.append(normalized_contact)
+  return normalized
+
+
+# GData phone rels, in the order of their codes in packed contacts.
+PHONE_RELS = (
+  "http://schemas.google.com/g/2005#mobile",
+  "http://schemas.google.com/g/2005#work",
+  "http://schemas.google.com/g/2005#home",
+  "http://schemas.google.com/g/2005#other",
+  )
+
+
+def PackContacts(contacts):
+  """Returns normalized contacts compactly, for a PostDumpContacts.
+
+  Only what can't be derived without regex work is kept: each contact
+  becomes [displayName, img, numbers], and each number [value, type, rel
+  code], the code indexing PHONE_RELS.  The whole is zlib-compressed
+  JSON.
+  """
+  packed = []
+  for contact in contacts:
+    numbers = [[number["value"], number["type"],
+                PHONE_RELS.index(number["rel"])]
+               for number in contact["phoneNumbers"]]
+    packed.append([contact["displayName"], contact.get("img"), numbers])
+  return zlib.compress(simplejson.dumps(packed, separators=(",", ":")))
+
+
+def UnpackContacts(packed):
+  """Returns the normalized contacts PackContacts packed."""
+  contacts = []
+  for display_name, img, numbers in simplejson.loads(zlib.decompress(packed)):
+    phone_numbers = []
+    for value, phone_type, rel_code in numbers:
+      rel = PHONE_RELS[rel_code]
+      phone_numbers.append({
+        "value": value,
+        "type": phone_type,
+        "key": PhoneSuffixKey(value),
+        "rel": rel,
+        "vcardType": VcardPhoneType(rel),
+        })
+    contact = {
+      "displayName": display_name,
+      "phoneNumbers": phone_numbers,
+      }
+    if img is not None:
+      contact["img"] = img
+    contacts.append(contact)
+  return contacts
+
+
+def LoadContacts(post_dump):
+  """Returns the normalized contact list of a PostDump.
+
+  Dumps saved before normalization happened at submit time only have
+  the raw json, so those get normalized here instead.
+  """
+  stored = models.PostDumpContacts.get_by_key_name(post_dump.key().name())
+  if stored is not None:
+    return UnpackContacts(stored.packed)
+  return NormalizeContacts(contactsFromJson(post_dump.json))
+
+
+def PhoneSuffixKey(number):
+  """Returns the matching key for a phone number string, or None.
+
+  The key is the final 7 digits of the number, ignoring punctuation
+  and space and stuff.  Numbers with fewer than 6 digits have no key
+  and never match anything.
+  """
+  digits = re.sub(r"[^\d]", "", number)
+  if len(digits) < 6:
+    return None
+  return digits[-7:]
+
+
 def NumberSuffixesMatch(num1, num2):
   """Given two phone numbers, return bool if they match. 
 
   Numbers are strings.  A match is 7 matching final
   numbers, ignoring punctuations and space and stuff.
   """
-  num1 = re.sub(r"[^\d]", "", num1)
-  num2 = re.sub(r"[^\d]", "", num2)
-  if len(num1) < 6 or len(num2) < 6:
+  key1 = PhoneSuffixKey(num1)
+  if key1 is None:
     return False
-  return num1[-7:] == num2[-7:]
+  return key1 == PhoneSuffixKey(num2)
 
 
 def PhoneNumberListContainsNumber(number_list, number):
@@ -85,6 +259,23 @@ def PhoneNumberListContainsNumber(number_list, number):
   return False
 
 
+def PhoneNumberListContainsKey(number_list, key):
+  """Searches number_list for a number with the given suffix key.
+
+  Args:
+    number_list: list of gdata PhoneNumber
+    key: phone suffix key from PhoneSuffixKey, or None.
+
+  Returns: bool.
+  """
+  if key is None:
+    return False
+  for phone_number in number_list:
+    if phone_number.text and PhoneSuffixKey(phone_number.text) == key:
+      return True
+  return False
+
+
 def GroupListContainsGroup(group_list, group):
   """Returns true if group found in group_list.
 
@@ -103,21 +294,119 @@ def GroupListContainsGroup(group_list, group):
   return False
 
 
-def FindEntryToMergeInto(contact, feed):
-  """Finds Entry (or None) in feed to merge contact into."""
-  contact_name = contact["displayName"]
-  for entry in feed.entry:
-    if entry.title and entry.title.text and \
-       entry.title.text == contact_name:
-      return entry
-      
+def GroupsCacheKey(user):
+  return "groups:%s" % user.email()
+
+
+def GroupIdsByName(client, user):
+  """Returns a dict of group name -> group id for user's contact groups.
+
+  The map is kept in memcache for GROUPS_CACHE_SECONDS, so continuation
+  requests don't each fetch the groups feed again. After that the feed is
+  fetched conditionally, through an AppEngineResponseCache: it's small and
+  seldom changes, unlike the contacts feed, which is left uncached.
+  """
+  group_id = memcache.get(GroupsCacheKey(user))
+  if group_id is not None:
+    return group_id
+
+  response_cache = client.response_cache
+  client.response_cache = gdata.alt.appengine.AppEngineResponseCache()
+  try:
+    groups_feed = client.Get(GROUPS_URL,
+                             converter=gdata.contacts.GroupsFeedFromString)
+  finally:
+    client.response_cache = response_cache
+  group_id = {}
+  for group in groups_feed.entry:
+    group_id[group.content.text] = group.id.text
+  memcache.set(GroupsCacheKey(user), group_id, time=GROUPS_CACHE_SECONDS)
+  return group_id
+
+
+def InvalidateGroupIds(user):
+  """Drops user's cached group map, e.g. after creating a group."""
+  memcache.delete(GroupsCacheKey(user))
+
+
+class ContactMatcher(object):
+  """Index over a feed's entries for finding the entry to merge into.
+
+  Built once per fetched feed, from any iterable of entries, such as a
+  ContactsFeedStream which parses them as the index takes them.  Entries
+  are keyed by exact title text and by phone suffix key (see
+  PhoneSuffixKey); each key remembers the earliest feed position that has
+  it, so lookups return the same entry a front-to-back scan of the feed
+  would.
+  """
+
+  def __init__(self, entries):
+    self.entries = []
+    self.position = {}   # id(entry) -> position in self.entries
+    self.by_title = {}   # title text -> position
+    self.by_phone = {}   # phone suffix key -> position
+    for entry in entries:
+      self.AddEntry(entry)
+
+  def AddEntry(self, entry):
+    """Adds entry to the end of the index, or re-indexes it if present.
+
+    Call this again after modifying an indexed entry (e.g. with
+    UpdateContactEntry) so later lookups see its new title and numbers.
+    """
+    pos = self.position.get(id(entry))
+    if pos is None:
+      pos = len(self.entries)
+      self.position[id(entry)] = pos
+      self.entries.append(entry)
+
+    if entry.title and entry.title.text:
+      self._IndexKey(self.by_title, entry.title.text, pos)
+    for phone_number in entry.phone_number:
+      if phone_number.text:
+        key = PhoneSuffixKey(phone_number.text)
+        if key is not None:
+          self._IndexKey(self.by_phone, key, pos)
+
+  def _IndexKey(self, index, key, pos):
+    if key not in index or pos < index[key]:
+      index[key] = pos
+
+  def Find(self, contact):
+    """Returns the first indexed entry matching contact, or None."""
+    best = self.by_title.get(contact["displayName"])
     for number_rec in contact["phoneNumbers"]:
-      contact_number = number_rec["value"]
-      if PhoneNumberListContainsNumber(entry.phone_number,
-                                       contact_number):
-        return entry
+      key = number_rec["key"]
+      if key is None:
+        continue
+      pos = self.by_phone.get(key)
+      if pos is not None and (best is None or pos < best):
+        best = pos
+    if best is None:
+      return None
+    return self.entries[best]
+
+
+def CompactContactsFeedStreamFromString(xml_string):
+  """Returns a ContactsFeedStream over the entries of a merge's feed.
+
+  The entries are parsed as they're taken rather than building the whole
+  document's tree before converting it, into compact classes since they
+  are all held in memory for the rest of the merge.  Only the members the
+  merge uses are converted.
+  """
+  return gdata.contacts.ContactsFeedStream(StringIO.StringIO(xml_string),
+      compact=True, fields=MERGE_ENTRY_FIELDS)
 
-  return None
+
+def FindEntryToMergeInto(contact, matcher):
+  """Finds Entry (or None) in matcher's feed to merge contact into.
+
+  Args:
+    contact: Normalized contact dictionary (see NormalizeContacts)
+    matcher: ContactMatcher built from the user's contacts feed.
+  """
+  return matcher.Find(contact)
 
 
 def PhoneRelType(text):
@@ -159,7 +448,7 @@ def UpdateContactEntry(merge_entry, contact, group=None):
   Args:
     merge_entry: The gdata.contacts.ContactEntry() object to
       merge into:
-    contact: Input contact dictionary from user w/ fields
+    contact: Normalized contact dictionary (see NormalizeContacts)
     group: optional GroupMembershipInfo to put user in
 
   Returns: List of changes (terse English each).  If no changes,
@@ -176,11 +465,11 @@ def UpdateContactEntry(merge_entry, contact, group=None):
       merge_entry.title = atom.Title(text=contact["displayName"])
 
   for number_rec in contact["phoneNumbers"]:
-    if not PhoneNumberListContainsNumber(merge_entry.phone_number,
-                                         number_rec["value"]):
+    if not PhoneNumberListContainsKey(merge_entry.phone_number,
+                                      number_rec["key"]):
       changes.append("adding number: %s" % number_rec["value"])
       merge_entry.phone_number.append(gdata.contacts.PhoneNumber(
-          rel=PhoneRelType(number_rec["type"]),
+          rel=number_rec["rel"],
           text=number_rec["value"]))
 
   if group and not GroupListContainsGroup(merge_entry.group_membership_info,
@@ -192,38 +481,327 @@ def UpdateContactEntry(merge_entry, contact, group=None):
   
 
 class Updater(object):
-  """Queues up updates and flushes them to gdata batch as needed."""
+  """Queues up updates and flushes them to gdata batch as needed.
+
+  Flush starts each batch with ExecuteBatchAsync and, with
+  max_in_flight > 1, returns right away, so the caller can build the next
+  batch while up to max_in_flight batches are on the wire.  Results are
+  still collected in the order the batches were flushed.
+
+  Given a deadline (a time.time() value), the batch size adapts to the
+  measured per-entry batch latency so a batch fits in the time left,
+  and OutOfTime says when the caller should stop and continue in a new
+  request.  What was measured and decided is kept in self.metrics.
+
+  Every result feed is checked entry by entry.  Operations that failed
+  with a retryable status, or that the server never got to because the
+  batch was interrupted, go into a later batch after a backoff; other
+  failures are kept in self.failures as (entry, code, reason) tuples.
+
+  Callers may give each operation its own batch id, and before_send, if
+  given, is called before each batch is sent, so the caller can record
+  which operations (UnfinishedBatchIds) may not have been applied yet.
+
+  Flush and Collect let UNAVAILABLE_ERRORS through, keeping the batch's
+  operations unfinished.
+
+  Batch ids are kept here, not taken back from the entries, since an
+  entry may be the subject of more than one operation.  An entry has at
+  most one operation unfinished at a time: changes to an entry whose
+  operation hasn't been sent yet go with that operation, and an entry
+  whose batch is on the wire is waited for before it's queued again.
+  """
 
-  def __init__(self, client=None, noop_mode=False):
+  def __init__(self, client=None, noop_mode=False, max_in_flight=1,
+               deadline=None, before_send=None):
     self.client = client
-    self.batch_feed = gdata.contacts.ContactsFeed()
+    # of (batch id, operation, entry) for the next batch
+    self.operations = []
     self.noop_mode = noop_mode
-
-  def AddInsert(self, entry):
+    self.max_in_flight = max_in_flight
+    # of (PendingResult, pending operations, entries, start time),
+    # oldest first; see Flush for the pending operations
+    self.in_flight = []
+    self.deadline = deadline
+    self.before_send = before_send
+    self.batch_size = INITIAL_BATCH_SIZE
+    self.entry_latency = None  # moving average, seconds per entry
+    self.next_batch_id = 0
+    self.unfinished = {}  # id(entry) -> batch id of its unfinished operation
+    self.attempts = {}  # batch id -> times retried
+    self.retries = []  # of (not before time.time(), batch id, operation, entry)
+    self.failures = []  # of (entry, code, reason)
+    self.metrics = {
+      "batches_sent": 0,
+      "entries_sent": 0,
+      "batch_seconds": 0.0,
+      "entry_latency": None,
+      "batch_sizes": [],
+      "retried": 0,
+      "failed": 0,
+      "merged_operations": 0,
+      }
+
+  def NextBatchId(self):
+    self.next_batch_id += 1
+    return str(self.next_batch_id)
+
+  def AddInsert(self, entry, batch_id=None):
+    self.AddOperation(gdata.BATCH_INSERT, entry, batch_id)
+
+  def AddUpdate(self, entry, batch_id=None):
+    self.AddOperation(gdata.BATCH_UPDATE, entry, batch_id)
+
+  def AddOperation(self, operation, entry, batch_id=None):
     if self.noop_mode:
       return
-    self.batch_feed.AddInsert(entry)
-    self.FlushIfNeeded()
-
-  def AddUpdate(self, entry):
-    if self.noop_mode:
+    while self.IsInFlight(self.unfinished.get(id(entry))):
+      # The entry was serialized when its batch was sent, so later
+      # changes need an operation of their own, made with the edit link
+      # that batch's result gives it.
+      self.Collect()
+    if id(entry) in self.unfinished:
+      # Not sent yet, or waiting to be retried: the changes go with it.
+      self.metrics["merged_operations"] += 1
       return
-    self.batch_feed.AddUpdate(entry)
+    batch_id = batch_id or self.NextBatchId()
+    self.operations.append((batch_id, operation, entry))
+    self.unfinished[id(entry)] = batch_id
     self.FlushIfNeeded()
 
+  def IsInFlight(self, batch_id):
+    if batch_id is None:
+      return False
+    for result, pending, n_entries, started in self.in_flight:
+      if batch_id in pending:
+        return True
+    return False
+
   def FlushIfNeeded(self):
-    if len(self.batch_feed.entry) >= 15:   # 100 is max but too slow for App Engine
+    if len(self.operations) >= self.batch_size:
       self.Flush()
 
   def Flush(self):
-    if not len(self.batch_feed.entry):
+    self.QueueDueRetries()
+    if not self.operations:
+      return
+    while len(self.in_flight) >= max(1, self.max_in_flight):
+      self.Collect()
+    if self.before_send:
+      self.before_send()
+    operations = self.operations
+    self.operations = []
+    batch_feed = gdata.contacts.ContactsFeed()
+    pending = {}  # batch id -> (operation, entry)
+    for batch_id, operation, entry in operations:
+      batch_feed.AddBatchEntry(entry=entry, batch_id_string=batch_id,
+                               operation_string=operation)
+      pending[batch_id] = (operation, entry)
+    self.metrics["batches_sent"] += 1
+    self.metrics["entries_sent"] += len(operations)
+    self.metrics["batch_sizes"].append(len(operations))
+    started = time.time()
+    try:
+      # The batch is serialized as the request starts, so the merge loop
+      # may go on to modify entries that are in it.
+      result = self.client.ExecuteBatchAsync(
+          batch_feed, gdata.contacts.service.DEFAULT_BATCH_URL)
+    except gdata.service.RequestError, e:
+      self.RetryBatch(pending, e)
+      return
+    except UNAVAILABLE_ERRORS:
+      self.Requeue(pending)
+      raise
+    self.in_flight.append((result, pending, len(operations), started))
+    if self.max_in_flight <= 1:
+      self.Collect()
+
+  def Collect(self):
+    """Waits for the oldest in-flight batch and records its result."""
+    result, pending, n_entries, started = self.in_flight.pop(0)
+    try:
+      result = result.get_result()
+    except gdata.service.RequestError, e:
+      self.RetryBatch(pending, e)
       return
-    self.client.ExecuteBatch(self.batch_feed,
-                             gdata.contacts.service.DEFAULT_BATCH_URL)
-    self.batch_feed = gdata.contacts.ContactsFeed()
+    except UNAVAILABLE_ERRORS:
+      self.Requeue(pending)
+      raise
+    self.RecordLatency(n_entries, time.time() - started)
+    self.ProcessResult(pending, result)
+
+  def Drain(self):
+    """Waits for all in-flight batches and retries, collecting results.
+
+    Stops waiting for retries once it's out of time, or if the next one
+    isn't due until after the deadline; those are left in self.retries
+    for the caller to carry over (see UnfinishedBatchIds).
+    """
+    while self.in_flight or self.retries:
+      if self.in_flight:
+        self.Collect()
+        continue
+      if self.OutOfTime():
+        return
+      next_retry = min([retry[0] for retry in self.retries])
+      wait = max(0, next_retry - time.time())
+      time_left = self.TimeLeft()
+      if (time_left is not None and
+          wait + (self.entry_latency or 0) >= time_left):
+        return
+      time.sleep(wait)
+      self.Flush()
+
+  def ProcessResult(self, pending, result):
+    """Checks each entry of a batch result feed, retrying what failed.
+
+    Args:
+      pending: dict of batch id -> (operation, entry) sent.  Consumed.
+      result: the ContactsFeed ExecuteBatch returned.
+    """
+    for result_entry in result.entry:
+      if not result_entry.batch_id or not result_entry.batch_status:
+        continue
+      batch_id = result_entry.batch_id.text
+      if batch_id not in pending:
+        continue
+      operation, entry = pending.pop(batch_id)
+      code = int(result_entry.batch_status.code)
+      reason = result_entry.batch_status.reason
+      if code in (200, 201):
+        self.Done(entry, result_entry)
+      elif code in RETRYABLE_BATCH_CODES:
+        self.Retry(batch_id, operation, entry, code, reason)
+      else:
+        self.Fail(entry, code, reason)
+
+    # Whatever is left was never processed, e.g. the batch was interrupted.
+    reason = "not processed"
+    if result.interrupted and result.interrupted.reason:
+      reason = result.interrupted.reason
+    for batch_id, (operation, entry) in pending.items():
+      self.Retry(batch_id, operation, entry, None, reason)
+
+  def RetryBatch(self, pending, error):
+    """Retries a whole batch whose request failed, if retryable."""
+    status = error[0].get("status")
+    if status not in RETRYABLE_BATCH_CODES:
+      raise error
+    for batch_id, (operation, entry) in pending.items():
+      self.Retry(batch_id, operation, entry, status, error[0].get("reason"))
+
+  def Retry(self, batch_id, operation, entry, code, reason):
+    """Queues an operation for a later batch, backing off."""
+    attempt = self.attempts.get(batch_id, 0) + 1
+    if attempt > MAX_BATCH_RETRIES:
+      self.Fail(entry, code, reason)
+      return
+    self.attempts[batch_id] = attempt
+    not_before = time.time() + BATCH_RETRY_SECONDS * 2 ** (attempt - 1)
+    self.retries.append((not_before, batch_id, operation, entry))
+    self.metrics["retried"] += 1
+
+  def Requeue(self, pending):
+    """Puts a batch's operations back to be sent again, as they were.
+
+    For a batch which couldn't be sent or answered because the server
+    can't be reached; that isn't counted as an attempt.  The caller is
+    expected to stop, and carry on with UnfinishedBatchIds later.
+    """
+    now = time.time()
+    for batch_id, (operation, entry) in pending.items():
+      self.retries.append((now, batch_id, operation, entry))
+
+  def Done(self, entry, result_entry):
+    """Records that entry's operation was applied.
+
+    The entry takes the edit link of the entry the server returned, so
+    the next update of it is made against the new version.
+    """
+    del self.unfinished[id(entry)]
+    edit_link = result_entry.GetEditLink()
+    if edit_link is not None and entry.link is not None:
+      entry.link = [link for link in entry.link if link.rel != "edit"]
+      entry.link.append(edit_link)
+
+  def Fail(self, entry, code, reason):
+    del self.unfinished[id(entry)]
+    self.failures.append((entry, code, reason))
+    self.metrics["failed"] += 1
+
+  def QueueDueRetries(self):
+    """Moves retries whose backoff has passed into the batch being built."""
+    now = time.time()
+    waiting = []
+    for retry in self.retries:
+      not_before, batch_id, operation, entry = retry
+      if not_before > now:
+        waiting.append(retry)
+        continue
+      self.operations.append((batch_id, operation, entry))
+    self.retries = waiting
+
+  def UnfinishedBatchIds(self):
+    """Returns the batch ids of operations not known to be done.
+
+    That is the ones still to be sent, on the wire, or waiting to be
+    retried.  Failed operations are done, as far as this goes.
+    """
+    return self.unfinished.values()
+
+  def DescribeFailures(self):
+    """Returns a line of text for each failed operation."""
+    descriptions = []
+    for entry, code, reason in self.failures:
+      name = "(no name)"
+      if entry.title and entry.title.text:
+        name = entry.title.text.decode("utf-8")
+      descriptions.append(u"%s: %s %s" % (name, code, reason or ""))
+    return descriptions
+
+  def RecordLatency(self, n_entries, elapsed):
+    """Folds one batch's timing into the latency average and resizes."""
+    latency = elapsed / n_entries
+    if self.entry_latency is None:
+      self.entry_latency = latency
+    else:
+      self.entry_latency = 0.7 * self.entry_latency + 0.3 * latency
+    self.metrics["batch_seconds"] += elapsed
+    self.metrics["entry_latency"] = self.entry_latency
+    self.batch_size = self.ChooseBatchSize()
+
+  def ChooseBatchSize(self):
+    """Returns the largest batch size expected to take at most
+    BATCH_TIME_FRACTION of the time left."""
+    time_left = self.TimeLeft()
+    if time_left is None or not self.entry_latency:
+      return self.batch_size
+    size = int(time_left * BATCH_TIME_FRACTION / self.entry_latency)
+    return max(1, min(MAX_BATCH_SIZE, size))
+
+  def TimeLeft(self):
+    """Seconds until the deadline, or None without one."""
+    if self.deadline is None:
+      return None
+    return self.deadline - time.time()
+
+  def OutOfTime(self):
+    """True if not even a one-entry batch is expected to fit any more."""
+    time_left = self.TimeLeft()
+    if time_left is None:
+      return False
+    return time_left <= (self.entry_latency or 0)
 
   def FlushBufferEmpty(self):
-    return len(self.batch_feed.entry) == 0
+    return not self.operations
+
+
+def LogMergeMetrics(updater):
+  logging.info("Merge batch metrics: %r", updater.metrics)
+  logging.info("Retry metrics: %r, circuits: %r",
+               REQUEST_RETRY_POLICY.metrics,
+               REQUEST_RETRY_POLICY.breaker_states())
+  logging.info("Rate limiter metrics: %r", REQUEST_RATE_LIMITER.metrics)
 
 
 class AddressBookerBaseHandler(webapp.RequestHandler):
@@ -271,11 +849,17 @@ class Submit(webapp.RequestHandler):
     json = self.request.get('json')
     group = self.request.get('group')
     
-    post_dump = models.PostDump(key_name="handle:" + handle,
+    contacts = NormalizeContacts(contactsFromJson(json))
+
+    key_name = "handle:" + handle
+    post_dump = models.PostDump(key_name=key_name,
                                 json=json,
+                                n_contacts=len(contacts),
                                 group=group,
                                 handle=handle)
-    post_dump.put()
+    stored_contacts = models.PostDumpContacts(
+        key_name=key_name, packed=db.Blob(PackContacts(contacts)))
+    db.put([post_dump, stored_contacts])
 
     user = users.get_current_user()
     target_url = "http://%s/menu?key=%s" % (
@@ -295,10 +879,12 @@ class Menu(AddressBookerBaseHandler):
     if not post_dump:
       self.response.out.write( "State lost?  Um, do it again.")
       
-    contacts = contactsFromJson(post_dump.json)
+    n_contacts = post_dump.n_contacts
+    if n_contacts is None:
+      n_contacts = len(LoadContacts(post_dump))
 
     self.WritePage("AddressBooker Menu", "menu.html", {
-        'n_contacts': len(contacts),
+        'n_contacts': n_contacts,
         'key': str(post_dump.key()),
         })
    
@@ -314,10 +900,10 @@ class MergeView(webapp.RequestHandler):
     if not post_dump:
       raise "State lost?  Um, do it again."
 
-    contacts = contactsFromJson(post_dump.json)
+    contacts = LoadContacts(post_dump)
     self.response.out.write("<ul>")
     for contact in contacts:
-      self.response.out.write("<li class='vcard'><h2 class='fn'>%s</h2>" % contact.get("displayName",'unknown'))
+      self.response.out.write("<li class='vcard'><h2 class='fn'>%s</h2>" % (contact["displayName"] or 'unknown'))
       if contact.has_key('img'): self.response.out.write("<img class='photo' src='%s' style='float:left' />" % contact["img"])
       for number in contact.get("phoneNumbers",[]):
         # obf_number = re.sub(r"\d{3}$", "<i>xxx</i>", number["value"])
@@ -338,7 +924,7 @@ class VCard(webapp.RequestHandler):
     if not post_dump:
       raise "State lost?  Um, do it again."
 
-    contacts = contactsFromJson(post_dump.json)
+    contacts = LoadContacts(post_dump)
     self.response.headers['Content-Type'] = "text/x-vcard; charset=UTF-8"
     self.response.headers['Content-Disposition'] = "attachment; filename=\"addressbooker.vcf\""
 
@@ -348,7 +934,7 @@ class VCard(webapp.RequestHandler):
       self.response.out.write("FN:%s\n" % (contact["displayName"] or ""))
       for number in contact["phoneNumbers"]:
         self.response.out.write("TEL;type=%s:%s\n" % (
-            VcardPhoneType(PhoneRelType(number["type"])),
+            number["vcardType"],
             number["value"]))
       self.response.out.write("END:VCARD\n")
 
@@ -363,6 +949,7 @@ class MergeGoogle(AddressBookerBaseHandler):
     self.ProcessMerge(method='POST')
 
   def ProcessMerge(self, method):
+    started = time.time()
     key = self.request.get('key')
     if not key:
       raise "Missing argument 'key'"
@@ -386,10 +973,11 @@ class MergeGoogle(AddressBookerBaseHandler):
     # And the subclass of the Service for the Contacts API:
     client = contactsservice.ContactsService()
     gdata.alt.appengine.run_on_appengine(client)
+    client.retry_policy = REQUEST_RETRY_POLICY
+    client.rate_limiter = REQUEST_RATE_LIMITER
 
-    contacts = contactsFromJson(post_dump.json)
+    contacts = LoadContacts(post_dump)
 
-    contacts_url = "http://www.google.com/m8/feeds/contacts/default/full"
     auth_base_url = "http://www.google.com/m8/feeds/"
 
     session_token = client.token_store.find_token(auth_base_url)
@@ -415,35 +1003,24 @@ class MergeGoogle(AddressBookerBaseHandler):
     # Are we a GET request in auto-submit mode?
     working = (method == "GET" and self.request.get("continue"))
 
-    # Process Groups
-    groups_feed = client.Get("http://www.google.com/m8/feeds/groups/default/full")
-    groups_feed = gdata.contacts.GroupsFeedFromString(groups_feed.ToString().decode("utf-8"))
-    group_name = {}  # id -> name
-    group_id = {}    # name -> id
-    for group in groups_feed.entry:
-      group_name[group.id.text] = group.content.text
-      group_id[group.content.text] = group.id.text
-      if False:
-        out("<h3>Group</h3><ul>")
-        out("<li>id: %s</li>" % cgi.escape(group.id.text))
-        out("<li>content: %s</li>" % cgi.escape(group.content.text.decode("utf-8")))
-        out("</ul>")
+    # Pick up where the last continue=1 request stopped, if it left a
+    # checkpoint.  A POST without continue=1 is a fresh commit from the
+    # preview page and always starts over.
+    job_key_name = "merge:%s:%s" % (user.email(), key)
+    job = None
+    if self.request.get("continue"):
+      job = models.MergeJob.get_by_key_name(job_key_name)
 
-    # Initialize 'group' (or keep it None, if not using groups), creating the
-    # group if necessary.
-    group = None
-    dest_group_name = post_dump.group
-    if dest_group_name and dest_group_name not in group_id:
-      new_group = gdata.contacts.GroupEntry(title=atom.Title(
-          text=dest_group_name))
-      group = client.CreateGroup(new_group)
-      group_name[group.id] = dest_group_name
-      group_id[dest_group_name] = group.id
-    if dest_group_name:
-      group = gdata.contacts.GroupMembershipInfo(href=unicode(group_id[dest_group_name]))
-
-    full_feed_url = contacts_url + "?max-results=99999"
-    feed = client.Get(full_feed_url, converter=gdata.contacts.ContactsFeedFromString)
+    if job:
+      start = job.cursor
+    else:
+      start = 0
+      if method == "POST":
+        job = models.MergeJob(key_name=job_key_name,
+                              user=user,
+                              post_dump_key=key)
+    if job:
+      saved_failures = list(job.failures)
 
     preview_mode = True
     title = "Preview Proposed GContacts Changes"
@@ -451,81 +1028,177 @@ class MergeGoogle(AddressBookerBaseHandler):
       preview_mode = False
       title = "GContacts Updates Complete"
 
-    contact_changes = []
-
-    updater = Updater(client=client, noop_mode=preview_mode);
-
-    no_change_contacts = []
-    for contact in contacts:
-      contact_change = {
-        "contact": contact,
-        }
-
-      merge_entry = FindEntryToMergeInto(contact, feed)
-      if merge_entry:
-        entry_changes = UpdateContactEntry(merge_entry, contact, group=group)
-        if entry_changes:
-          contact_change["action"] = "merge"
-          contact_change["merge_target"] = merge_entry.title.text.decode("utf-8")
-          contact_change["changes"] = entry_changes
-          updater.AddUpdate(merge_entry)
+    updater = None
+    try:
+      # The feed is fetched afresh even when resuming, so it has whatever
+      # the batches before the checkpoint did.  Operations after the
+      # cursor may have been applied too, if a request died after sending
+      # a batch; those contacts now match their entries with nothing to
+      # change.
+      group, entries = self.FetchMergeTarget(client, user, post_dump)
+
+      contact_changes = []
+
+      # Each operation's batch id is its contact's index.  Before a batch is
+      # sent, the job is saved with the cursor at the first contact whose
+      # operation may not have been applied yet.
+      progress = {"next_index": start}
+      def SaveJob():
+        unfinished = [int(batch_id)
+                      for batch_id in updater.UnfinishedBatchIds()]
+        job.cursor = min(unfinished + [progress["next_index"]])
+        job.failures = saved_failures + updater.DescribeFailures()
+        job.put()
+
+      deadline = started + REQUEST_DEADLINE_SECONDS - DEADLINE_MARGIN_SECONDS
+      before_send = None
+      if not preview_mode:
+        before_send = SaveJob
+      updater = Updater(client=client, noop_mode=preview_mode,
+                        max_in_flight=BATCHES_IN_FLIGHT, deadline=deadline,
+                        before_send=before_send)
+
+      matcher = ContactMatcher(entries)
+      no_change_contacts = []
+      for index in range(start, len(contacts)):
+        progress["next_index"] = index
+        contact = contacts[index]
+        contact_change = {
+          "contact": contact,
+          }
+
+        merge_entry = FindEntryToMergeInto(contact, matcher)
+        if merge_entry:
+          entry_changes = UpdateContactEntry(merge_entry, contact, group=group)
+          if entry_changes:
+            matcher.AddEntry(merge_entry)
+            contact_change["action"] = "merge"
+            contact_change["merge_target"] = merge_entry.title.text.decode("utf-8")
+            contact_change["changes"] = entry_changes
+            updater.AddUpdate(merge_entry, batch_id=str(index))
+          else:
+            contact_change["action"] = "none"
         else:
-          contact_change["action"] = "none"
-      else:
-        contact_change["action"] = "new"
-        contact_change["changes"] = ["Create new contact."]
-        updater.AddInsert(NewContactEntry(contact, group=group))
+          contact_change["action"] = "new"
+          contact_change["changes"] = ["Create new contact."]
+          updater.AddInsert(NewContactEntry(contact, group=group),
+                            batch_id=str(index))
 
-      if contact_change["action"] == "none":
-        no_change_contacts.append(contact_change)
-      else:
-        contact_changes.append(contact_change)
-        if not preview_mode and updater.FlushBufferEmpty():
-          # redirect for the next batch; new HTTP request
-          # to get around App Engine long request deadlines.
+        if contact_change["action"] == "none":
+          no_change_contacts.append(contact_change)
+        else:
+          contact_changes.append(contact_change)
+          if not preview_mode and updater.OutOfTime():
+            # Checkpoint, then redirect for the next batches; new HTTP
+            # request to get around App Engine long request deadlines.
+            # Retries Drain had no time for are left unfinished, so the
+            # cursor stays at the first of them.
+            updater.Flush()
+            updater.Drain()
+            LogMergeMetrics(updater)
+            progress["next_index"] = index + 1
+            SaveJob()
+            self.redirect('http://%s/gcontacts?key=%s&continue=1' %
+                          (settings.HOST_NAME, key))
+            return
+
+      # Put the boring ones at bottom.
+      n_changes = len(contact_changes)
+      contact_changes.extend(no_change_contacts)
+
+      render_google_list = False
+      if render_google_list:
+        out("<hr />")
+        for entry in matcher.entries:
+          if entry.title and entry.title.text:
+            out('<h3>Entry Title: %s</h3>' % (
+                entry.title.text.decode('UTF-8')))
+          else:
+            out("<h3>(title-less entry)</h3>");
+      
+          for phone_number in entry.phone_number:
+            out("<p><b>Phone: (%s)</b> %s</p>" %
+                                  (phone_number.rel, phone_number.text))
+
+          for email in entry.email:
+            out("<p><b>Email: (%s)</b> %s</p>" %
+                                  (email.rel, email.address))
+
+          for group in entry.group_membership_info:
+            out("<p><b>Group: (%s)</b> %s</p>" %
+                (group.href, cgi.escape(str(group))))
+
+      progress["next_index"] = len(contacts)
+      updater.Flush()
+      updater.Drain()
+      failures = updater.DescribeFailures()
+      if not preview_mode:
+        LogMergeMetrics(updater)
+        if updater.UnfinishedBatchIds():
+          # Out of time with retries still waiting; they go in the next
+          # request.
+          SaveJob()
           self.redirect('http://%s/gcontacts?key=%s&continue=1' %
                         (settings.HOST_NAME, key))
           return
+        failures = saved_failures + failures
+        if job.is_saved():
+          job.delete()
+
+      self.WritePage(title, "google-merge.html", {
+          "preview_mode": preview_mode,
+          "body": "".join(body),
+          "session_token": str(session_token),
+          "key": key,
+          "changes": contact_changes,
+          "n_changes": n_changes,
+          "working": working,
+          "failures": failures,
+          })
+    except UNAVAILABLE_ERRORS, e:
+      # Google can't be reached for now.  Keep what's done, and let the
+      # user carry on from the checkpoint later rather than fail.
+      logging.warning("Merge stopped, Google Contacts unavailable: %s", e)
+      if updater is not None and not preview_mode:
+        LogMergeMetrics(updater)
+        SaveJob()
+      self.response.set_status(503)
+      self.response.headers['Retry-After'] = str(TRY_LATER_SECONDS)
+      self.WritePage("Google Contacts Unavailable", "try-later.html", {
+          "key": key,
+          })
+    
 
+  def FetchMergeTarget(self, client, user, post_dump):
+    """Fetches what a merge needs from the user's Google account.
 
-    # Put the boring ones at bottom.
-    n_changes = len(contact_changes)
-    contact_changes.extend(no_change_contacts)
+    Looks up (creating if necessary) the destination group named in
+    post_dump and fetches the user's full contacts feed.
+
+    Returns: (group, entries) tuple, where group is a GroupMembershipInfo
+      or None if not using groups, and entries is a ContactsFeedStream
+      which yields the feed's entries as they're parsed.
+    """
+    group_id = GroupIdsByName(client, user)  # name -> id
+
+    # Initialize 'group' (or keep it None, if not using groups), creating the
+    # group if necessary.
+    group = None
+    dest_group_name = post_dump.group
+    if dest_group_name and dest_group_name not in group_id:
+      new_group = gdata.contacts.GroupEntry(title=atom.Title(
+          text=dest_group_name))
+      group = client.CreateGroup(new_group)
+      InvalidateGroupIds(user)
+      group_id[dest_group_name] = group.id.text
+    if dest_group_name:
+      group = gdata.contacts.GroupMembershipInfo(href=unicode(group_id[dest_group_name]))
+
+    full_feed_url = CONTACTS_URL + "?max-results=99999"
+    entries = client.Get(full_feed_url,
+                         converter=CompactContactsFeedStreamFromString)
+    return group, entries
 
-    render_google_list = False
-    if render_google_list:
-      out("<hr />")
-      for entry in feed.entry:
-        if entry.title and entry.title.text:
-          out('<h3>Entry Title: %s</h3>' % (
-              entry.title.text.decode('UTF-8')))
-        else:
-          out("<h3>(title-less entry)</h3>");
-      
-        for phone_number in entry.phone_number:
-          out("<p><b>Phone: (%s)</b> %s</p>" %
-                                (phone_number.rel, phone_number.text))
-
-        for email in entry.email:
-          out("<p><b>Email: (%s)</b> %s</p>" %
-                                (email.rel, email.address))
-
-        for group in entry.group_membership_info:
-          out("<p><b>Group: (%s)</b> %s</p>" %
-              (group.href, cgi.escape(str(group))))
-
-    updater.Flush()
-
-    self.WritePage(title, "google-merge.html", {
-        "preview_mode": preview_mode,
-        "body": "".join(body),
-        "session_token": str(session_token),
-        "key": key,
-        "changes": contact_changes,
-        "n_changes": n_changes,
-        "working": working,
-        })
-    
 
 class Acker(webapp.RequestHandler):
   """Simulates an HTML page to prove ownership of this domain for AuthSub 
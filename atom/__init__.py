@@ -44,6 +44,8 @@
 
 __author__ = 'api.jscudder (Jeffrey Scudder)'
 
+import codecs
+
 try:
   from xml.etree import cElementTree as ElementTree
 except ImportError:
@@ -67,9 +69,14 @@ APP_TEMPLATE = '{http://purl.org/atom/app#}%s'
 XML_STRING_ENCODING = 'utf-8'
 # The desired string encoding for object members.
 MEMBER_STRING_ENCODING = 'utf-8'
+# The namespace of xml:lang and the like, which is never declared.
+XML_NAMESPACE = 'http://www.w3.org/XML/1998/namespace'
+# How much XML WriteXml collects before passing it on to its write function.
+XML_CHUNK_SIZE = 64 * 1024
 
 
-def CreateClassFromXMLString(target_class, xml_string, string_encoding=None):
+def CreateClassFromXMLString(target_class, xml_string, string_encoding=None,
+                             compact=False, projection=None):
   """Creates an instance of the target class from the string contents.
   
   Args:
@@ -83,6 +90,11 @@ def CreateClassFromXMLString(target_class, xml_string, string_encoding=None):
         be converted to before it is interpreted and translated into 
         objects. The default is None in which case the string encoding
         is not changed.
+    compact: bool (optional) If True, the XML is converted into instances
+        of the classes' CompactClass versions, which use less memory.
+    projection: dict (optional) Maps classes to the names of the members to
+        convert into objects, see ProjectedClass. By default every member
+        is converted.
 
   Returns:
     An instance of the target class with members assigned according to the
@@ -93,9 +105,67 @@ def CreateClassFromXMLString(target_class, xml_string, string_encoding=None):
   if encoding and isinstance(xml_string, unicode):
     xml_string = xml_string.encode(encoding)
   tree = ElementTree.fromstring(xml_string)
+  if compact:
+    target_class = CompactClass(target_class)
+  if projection:
+    target_class = ProjectedClass(target_class, projection)
   return _CreateClassFromElementTree(target_class, tree)
 
 
+class FeedStream(object):
+  """Parses a feed from a file-like object, one entry at a time.
+
+  Iterating over a FeedStream reads the XML incrementally and yields an
+  instance of the feed class's entry class for each entry, removing the
+  entry's XML from the tree as soon as it has been converted. So at most
+  one entry's XML is held in memory, instead of the whole document.
+
+  Once iteration has finished, the feed member holds an instance of the
+  feed class with all of the feed-level members (id, title, links, etc.)
+  populated and an empty entry list.
+  """
+
+  def __init__(self, feed_class, stream):
+    """Constructor for FeedStream
+
+    Args:
+      feed_class: class The feed class to parse, such as atom.Feed. Its
+          _children must map the entry tag to an 'entry' member list.
+      stream: A file-like object with a read(size) method, such as an
+          httplib.HTTPResponse, which contains the feed's XML.
+    """
+    self.feed_class = feed_class
+    self.stream = stream
+    self.feed = None
+    self.entry_tag = None
+    self.entry_class = None
+    # The parse table has the CompactClass or ProjectedClass of the entry
+    # class if the feed class is one.
+    for tag, (member_name, member_class, is_list) in (
+        ParseInfo(feed_class).table.iteritems()):
+      if member_name == 'entry':
+        self.entry_tag = tag
+        self.entry_class = member_class
+
+  def __iter__(self):
+    root = None
+    depth = 0
+    for event, element in ElementTree.iterparse(self.stream,
+                                                 events=('start', 'end')):
+      if event == 'start':
+        if root is None:
+          root = element
+        depth += 1
+        continue
+      depth -= 1
+      if depth == 1 and element.tag == self.entry_tag:
+        entry = _CreateClassFromElementTree(self.entry_class, element)
+        root.remove(element)
+        yield entry
+    if root is not None:
+      self.feed = _CreateClassFromElementTree(self.feed_class, root)
+
+
 def _CreateClassFromElementTree(target_class, tree, namespace=None, tag=None):
   """Instantiates the class and populates members according to the tree.
 
@@ -118,6 +188,16 @@ def _CreateClassFromElementTree(target_class, tree, namespace=None, tag=None):
       An instance of the target class - or None if the tag and namespace of 
       the XML tree's root node did not match the desired namespace and tag.
   """
+  if namespace is None and tag is None:
+    info = ParseInfo(target_class)
+    if tree.tag != info.tag:
+      return None
+    target = info.construct()
+    if info.default_conversion:
+      target._HarvestCompiledElementTree(tree, info)
+    else:
+      target._HarvestElementTree(tree)
+    return target
   if namespace is None:
     namespace = target_class._namespace
   if tag is None:
@@ -130,6 +210,456 @@ def _CreateClassFromElementTree(target_class, tree, namespace=None, tag=None):
     return None
 
 
+class _ParseInfo(object):
+  """A class's _children and constructor, compiled for fast parsing.
+
+  Looking up a child element's tag in the table gives a tuple of
+  (member name, member class, True if the member is a list), so parsing
+  doesn't need to index into _children tuples or check for lists. The
+  qualified '{namespace}tag' of the class is formatted once, and construct
+  creates an empty instance of the class by copying the members of one
+  made ahead of time, rather than running the chain of __init__ methods.
+
+  For a ProjectedClass, the table only has the children which are to be
+  converted and keep_raw is True: any other child is kept as a RawElement.
+
+  Use ParseInfo(target_class) instead of creating these directly: it builds
+  one per class the first time the class is parsed, and rebuilds it if
+  entries are added to the class's _children later.
+  """
+
+  def __init__(self, target_class):
+    self.children = target_class._children
+    self.n_children = len(self.children)
+    self.table = {}
+    compact = getattr(target_class, '_compact', False)
+    projection = getattr(target_class, '_projection', None)
+    fields = None
+    if projection is not None:
+      for base_class in target_class.__mro__:
+        if base_class in projection:
+          fields = projection[base_class]
+          break
+    self.keep_raw = fields is not None
+    for tag, (member_name, member_class) in self.children.iteritems():
+      if fields is not None and member_name not in fields:
+        continue
+      is_list = isinstance(member_class, list)
+      if is_list:
+        member_class = member_class[0]
+      if compact:
+        member_class = CompactClass(member_class)
+      if projection is not None:
+        member_class = ProjectedClass(member_class, projection)
+      self.table[tag] = (member_name, member_class, is_list)
+    self.attributes = target_class._attributes
+    if hasattr(target_class, '_namespace') and hasattr(target_class, '_tag'):
+      self.tag = '{%s}%s' % (target_class._namespace, target_class._tag)
+    else:
+      self.tag = None
+    self._target_class = target_class
+    self._members = None
+    self._new_lists = []
+    self._new_dicts = []
+    try:
+      prototype = target_class()
+    except TypeError:
+      # The class needs constructor arguments.
+      prototype = None
+    if prototype is not None and _CanCopyMembers(prototype):
+      self._members = prototype.__dict__
+      for name, value in self._members.iteritems():
+        if isinstance(value, list):
+          self._new_lists.append(name)
+        elif isinstance(value, dict):
+          self._new_dicts.append(name)
+    self.member_names = [member_name for member_name, member_class in 
+                         self.children.itervalues()]
+    # Only write with AtomBase._WriteXml if the class doesn't change how it
+    # is converted to an ElementTree.
+    self.default_serialization = (
+        getattr(target_class._AddMembersToElementTree, 'im_func', None) is
+            AtomBase._AddMembersToElementTree.im_func and
+        getattr(target_class._BecomeChildElement, 'im_func', None) is
+            AtomBase._BecomeChildElement.im_func and
+        getattr(target_class._ToElementTree, 'im_func', None) is
+            AtomBase._ToElementTree.im_func)
+    # Only parse with AtomBase._HarvestCompiledElementTree if the class
+    # doesn't change how it harvests trees, children and attributes.
+    self.default_conversion = (
+        getattr(target_class._HarvestElementTree, 'im_func', None) is
+            AtomBase._HarvestElementTree.im_func and
+        getattr(target_class._ConvertElementTreeToMember, 'im_func', None) is
+            AtomBase._ConvertElementTreeToMember.im_func and
+        getattr(target_class._ConvertElementAttributeToMember, 'im_func', 
+            None) is AtomBase._ConvertElementAttributeToMember.im_func)
+
+  def construct(self):
+    """Returns an instance of the class as created by target_class()."""
+    if self._members is None:
+      return self._target_class()
+    instance = object.__new__(self._target_class)
+    members = self._members.copy()
+    for name in self._new_lists:
+      members[name] = []
+    for name in self._new_dicts:
+      members[name] = {}
+    instance.__dict__ = members
+    return instance
+
+
+def _CanCopyMembers(instance):
+  """True if copying the instance's __dict__ gives an equivalent instance.
+
+  Empty lists and dicts are replaced with new ones in the copy, any other
+  member must be immutable.
+  """
+  # Members of a CompactClass are in slots rather than __dict__.
+  if hasattr(instance.__class__, '__slots__') or (
+      not hasattr(instance, '__dict__')):
+    return False
+  for value in instance.__dict__.itervalues():
+    if isinstance(value, (list, dict)):
+      if value:
+        return False
+    elif not (value is None or isinstance(value, (str, unicode, int, long,
+                                                  float, bool))):
+      return False
+  return True
+
+
+_parse_infos = {}
+
+
+def ParseInfo(target_class):
+  """Returns the _ParseInfo for the class, building it if needed."""
+  info = _parse_infos.get(target_class)
+  if info is None or info.children is not target_class._children or (
+      info.n_children != len(target_class._children)):
+    info = _ParseInfo(target_class)
+    _parse_infos[target_class] = info
+  return info
+
+
+_compact_classes = {}
+
+
+def CompactClass(target_class):
+  """Returns a version of the class which uses less memory per instance.
+
+  The compact class is a subclass of target_class which keeps the members
+  set by the class's constructor in __slots__ instead of a per-instance
+  __dict__, and only allocates the extension_elements list and the
+  extension_attributes dict when they are first used. Child elements are
+  parsed into the compact versions of the member classes, so everything
+  parsed into it is compact too. Instances have the same members and methods as those
+  of target_class and are instances of target_class, but an empty list or
+  dict assigned to extension_elements or extension_attributes is not kept:
+  a new one is made the next time the member is read.
+
+  Compact classes are made the first time they are asked for and reused
+  after that, so CompactClass(gdata.contacts.ContactsFeed) can be passed
+  anywhere a class to parse into is expected.
+
+  Args:
+    target_class: class An ExtensionContainer subclass, such as atom.Feed.
+        Its constructor must be callable without arguments.
+
+  Returns:
+    The compact version of target_class, or target_class itself if it
+    can't be made compact.
+  """
+  compact_class = _compact_classes.get(target_class)
+  if compact_class is not None:
+    return compact_class
+  try:
+    prototype = target_class()
+  except TypeError:
+    # The class needs constructor arguments.
+    _compact_classes[target_class] = target_class
+    return target_class
+  lazy_extensions = not hasattr(target_class, 'extension_elements') and (
+      not hasattr(target_class, 'extension_attributes'))
+  slots = []
+  for name in getattr(prototype, '__dict__', {}):
+    if lazy_extensions and name in ('extension_elements', 
+                                    'extension_attributes'):
+      continue
+    # Leave class attributes and properties to be looked up as before.
+    if not hasattr(target_class, name):
+      slots.append(name)
+  class_dict = {'__slots__': tuple(slots), '__doc__': target_class.__doc__,
+                '__module__': target_class.__module__, '_compact': True}
+  if lazy_extensions:
+    class_dict['__slots__'] += ('_extension_elements', '_extension_attributes')
+    class_dict['extension_elements'] = property(_GetExtensionElements, 
+                                                _SetExtensionElements)
+    class_dict['extension_attributes'] = property(_GetExtensionAttributes,
+                                                  _SetExtensionAttributes)
+    class_dict['_ExtensionsToWrite'] = _CompactExtensionsToWrite
+  compact_class = type(target_class.__name__, (target_class,), class_dict)
+  _compact_classes[target_class] = compact_class
+  _compact_classes[compact_class] = compact_class
+  return compact_class
+
+
+_projected_classes = {}
+
+
+def ProjectedClass(target_class, projection):
+  """Returns a version of the class which only converts some members.
+
+  When XML is parsed into the projected class, the child elements of each
+  class named in projection are only converted into objects if they belong
+  to one of the listed members. The rest, including unknown extensions,
+  are kept unconverted as RawElements in extension_elements, which costs
+  far less than converting them and still writes them back out when the
+  object is converted to XML. So an entry parsed with only the members it
+  needs can be updated and sent back without losing anything.
+
+  Members which are not converted are left empty, and should not be set
+  either: the RawElements would be written out alongside them. Classes
+  which override how they harvest XML are always converted in full.
+
+  Args:
+    target_class: class An AtomBase subclass, such as gdata.contacts.
+        ContactsFeed, or its CompactClass.
+    projection: dict Maps classes to the names of the members to convert
+        for them and their subclasses, for example
+        {gdata.contacts.ContactEntry: ('id', 'title', 'link')}. Classes
+        which aren't in the dict are converted in full.
+
+  Returns:
+    The projected version of target_class. Instances are instances of
+    target_class.
+  """
+  key = (target_class, frozenset([(member_class, frozenset(fields)) 
+      for member_class, fields in projection.iteritems()]))
+  projected_class = _projected_classes.get(key)
+  if projected_class is None:
+    class_dict = {'__doc__': target_class.__doc__,
+                  '__module__': target_class.__module__,
+                  '_projection': dict(key[1])}
+    projected_class = type(target_class.__name__, (target_class,), class_dict)
+    _projected_classes[key] = projected_class
+  return projected_class
+
+
+def _GetExtensionElements(self):
+  if self._extension_elements is None:
+    self._extension_elements = []
+  return self._extension_elements
+
+
+def _SetExtensionElements(self, extension_elements):
+  self._extension_elements = extension_elements or None
+
+
+def _GetExtensionAttributes(self):
+  if self._extension_attributes is None:
+    self._extension_attributes = {}
+  return self._extension_attributes
+
+
+def _SetExtensionAttributes(self, extension_attributes):
+  self._extension_attributes = extension_attributes or None
+
+
+def _CompactExtensionsToWrite(self):
+  # Unlike reading the members, this doesn't allocate them.
+  return self._extension_elements or (), self._extension_attributes or {}
+
+
+_reachable_namespaces = {}
+
+
+def _ReachableNamespaces(target_class):
+  """Returns the namespaces of the class and of all its possible children.
+
+  The class's own namespace comes first, the rest are sorted.
+  """
+  namespaces = _reachable_namespaces.get(target_class)
+  if namespaces is None:
+    found = set()
+    pending = [target_class]
+    seen = set()
+    while pending:
+      member_class = pending.pop()
+      if member_class in seen:
+        continue
+      seen.add(member_class)
+      if getattr(member_class, '_namespace', None):
+        found.add(member_class._namespace)
+      for member_name, child_class in getattr(member_class, '_children', 
+                                              {}).itervalues():
+        if isinstance(child_class, list):
+          child_class = child_class[0]
+        pending.append(child_class)
+    namespaces = []
+    own_namespace = getattr(target_class, '_namespace', None)
+    if own_namespace:
+      namespaces.append(own_namespace)
+      found.discard(own_namespace)
+    found.discard(XML_NAMESPACE)
+    namespaces.extend(sorted(found))
+    _reachable_namespaces[target_class] = namespaces
+  return namespaces
+
+
+class _XmlWriter(object):
+  """Writes the XML for AtomBase objects without building an ElementTree.
+
+  The namespaces given to the constructor are declared on the root element
+  with the prefixes ns0, ns1, etc. Any other namespace is declared on the
+  element which uses it. Text is collected into chunks of about
+  XML_CHUNK_SIZE bytes, which are passed to write in order.
+  """
+
+  def __init__(self, write, encoding, namespaces):
+    self.write = write
+    self.encoding = encoding
+    # Member strings only need re-encoding if they're not in the document's
+    # encoding already.
+    self.recode = (codecs.lookup(encoding).name != 
+                   codecs.lookup(MEMBER_STRING_ENCODING).name)
+    self.prefixes = {XML_NAMESPACE: 'xml'}
+    self.fixed_namespaces = set(namespaces)
+    self.fixed_namespaces.add(XML_NAMESPACE)
+    self.root_declarations = []
+    for namespace in namespaces:
+      self.prefixes[namespace] = 'ns%d' % len(self.root_declarations)
+      self.root_declarations.append(namespace)
+    self.n_prefixes = len(self.root_declarations)
+    # Qualified names which use the root element's prefixes.
+    self.names = {}
+    self.chunks = []
+    self.size = 0
+
+  def WriteDeclaration(self):
+    # ElementTree.tostring leaves out the declaration for these encodings.
+    if self.encoding not in ('utf-8', 'us-ascii'):
+      self._Write("<?xml version='1.0' encoding='%s'?>\n" % self.encoding)
+
+  def WriteElement(self, tag, attributes, text, children):
+    """Writes an element, then its children.
+
+    Args:
+      tag: str The element's tag, as '{namespace}tag' or a plain tag.
+      attributes: dict The element's attributes, keys as for tag.
+      text: str or unicode The text before the element's first child.
+      children: list The objects to write as children: AtomBase,
+          ExtensionElement or RawElement objects, ElementTree elements, or
+          anything which can add itself to an ElementTree with
+          _BecomeChildElement.
+    """
+    declarations = []
+    parts = ['<', self._QualifiedName(tag, declarations)]
+    qualified_tag = parts[1]
+    if self.root_declarations:
+      for namespace in self.root_declarations:
+        parts.append(' xmlns:%s="%s"' % (self.prefixes[namespace], 
+                                         self._EscapeAttribute(namespace)))
+      self.root_declarations = None
+    if attributes:
+      for name in sorted(attributes):
+        parts.append(' %s="%s"' % (self._QualifiedName(name, declarations),
+            self._EscapeAttribute(attributes[name])))
+    for namespace in declarations:
+      parts.append(' xmlns:%s="%s"' % (self.prefixes[namespace], 
+                                       self._EscapeAttribute(namespace)))
+    if text or children:
+      parts.append('>')
+      if text:
+        parts.append(self._EscapeText(text))
+      self._Write(''.join(parts))
+      for child in children:
+        if hasattr(child, '_WriteXml'):
+          child._WriteXml(self)
+        elif ElementTree.iselement(child):
+          self.WriteElementTree(child)
+        else:
+          self._WriteForeign(child)
+      self._Write('</%s>' % qualified_tag)
+    else:
+      parts.append(' />')
+      self._Write(''.join(parts))
+    for namespace in declarations:
+      del self.prefixes[namespace]
+
+  def WriteElementTree(self, element):
+    """Writes an ElementTree element, its children and its tail."""
+    self.WriteElement(element.tag, element.attrib, element.text, 
+                      element.getchildren())
+    if element.tail:
+      self._Write(self._EscapeText(element.tail))
+
+  def _WriteForeign(self, child):
+    tree = ElementTree.Element('')
+    child._BecomeChildElement(tree)
+    for element in tree:
+      self.WriteElementTree(element)
+
+  def Flush(self):
+    if self.chunks:
+      self.write(''.join(self.chunks))
+      self.chunks = []
+      self.size = 0
+
+  def _Write(self, text):
+    self.chunks.append(text)
+    self.size += len(text)
+    if self.size >= XML_CHUNK_SIZE:
+      self.Flush()
+
+  def _QualifiedName(self, name, declarations):
+    qualified_name = self.names.get(name)
+    if qualified_name is not None:
+      return qualified_name
+    if name[:1] != '{':
+      return name
+    namespace, local_name = name[1:].split('}', 1)
+    prefix = self.prefixes.get(namespace)
+    if prefix is None:
+      prefix = 'ns%d' % self.n_prefixes
+      self.n_prefixes += 1
+      self.prefixes[namespace] = prefix
+      declarations.append(namespace)
+      return '%s:%s' % (prefix, local_name)
+    qualified_name = '%s:%s' % (prefix, local_name)
+    if namespace in self.fixed_namespaces:
+      self.names[name] = qualified_name
+    return qualified_name
+
+  def _Encode(self, text):
+    if isinstance(text, unicode):
+      return text.encode(self.encoding, 'xmlcharrefreplace')
+    if self.recode:
+      return text.decode(MEMBER_STRING_ENCODING).encode(self.encoding, 
+                                                        'xmlcharrefreplace')
+    return text
+
+  def _EscapeText(self, text):
+    if '&' in text:
+      text = text.replace('&', '&amp;')
+    if '<' in text:
+      text = text.replace('<', '&lt;')
+    if '>' in text:
+      text = text.replace('>', '&gt;')
+    # Encode after escaping, so character references for characters the
+    # encoding lacks aren't escaped themselves.
+    if self.recode or isinstance(text, unicode):
+      text = self._Encode(text)
+    return text
+
+  def _EscapeAttribute(self, value):
+    value = self._EscapeText(value)
+    if '"' in value:
+      value = value.replace('"', '&quot;')
+    if '\n' in value:
+      value = value.replace('\n', '&#10;')
+    return value
+
+
 class ExtensionContainer(object):
   
   def __init__(self, extension_elements=None, extension_attributes=None,
@@ -225,35 +755,82 @@ class AtomBase(ExtensionContainer):
     self.extension_attributes = extension_attributes or {}
     self.text = text
       
+  def _HarvestElementTree(self, tree):
+    info = ParseInfo(self.__class__)
+    if info.default_conversion:
+      self._HarvestCompiledElementTree(tree, info)
+    else:
+      ExtensionContainer._HarvestElementTree(self, tree)
+
+  def _HarvestCompiledElementTree(self, tree, info):
+    # The same as ExtensionContainer._HarvestElementTree with this class's
+    # _ConvertElementTreeToMember and _ConvertElementAttributeToMember
+    # written out inline.
+    table = info.table
+    keep_raw = info.keep_raw
+    for child in tree:
+      member = table.get(child.tag)
+      if member is None:
+        if keep_raw:
+          self.extension_elements.append(RawElement(child))
+        else:
+          self.extension_elements.append(
+              _ExtensionElementFromElementTree(child))
+        continue
+      member_name, member_class, is_list = member
+      value = _CreateClassFromElementTree(member_class, child)
+      if is_list:
+        member_list = getattr(self, member_name)
+        if member_list is None:
+          member_list = []
+          setattr(self, member_name, member_list)
+        member_list.append(value)
+      else:
+        setattr(self, member_name, value)
+    attributes = info.attributes
+    for attribute, value in tree.attrib.iteritems():
+      member_name = attributes.get(attribute)
+      if member_name is None:
+        ExtensionContainer._ConvertElementAttributeToMember(self, attribute,
+            value)
+      elif value:
+        setattr(self, member_name, value.encode(MEMBER_STRING_ENCODING))
+    if tree.text:
+      self.text = tree.text.encode(MEMBER_STRING_ENCODING)
+
   def _ConvertElementTreeToMember(self, child_tree):
     # Find the element's tag in this class's list of child members
-    if self.__class__._children.has_key(child_tree.tag):
-      member_name = self.__class__._children[child_tree.tag][0]
-      member_class = self.__class__._children[child_tree.tag][1]
-      # If the class member is supposed to contain a list, make sure the
-      # matching member is set to a list, then append the new member
-      # instance to the list.
-      if isinstance(member_class, list):
-        if getattr(self, member_name) is None:
-          setattr(self, member_name, [])
-        getattr(self, member_name).append(_CreateClassFromElementTree(
-            member_class[0], child_tree))
-      else:
-        setattr(self, member_name, 
-                _CreateClassFromElementTree(member_class, child_tree))
+    member = ParseInfo(self.__class__).table.get(child_tree.tag)
+    if member is None:
+      ExtensionContainer._ConvertElementTreeToMember(self, child_tree)
+    else:
+      self._SetMemberFromElementTree(member, child_tree)
+
+  def _SetMemberFromElementTree(self, member, child_tree):
+    member_name, member_class, is_list = member
+    value = _CreateClassFromElementTree(member_class, child_tree)
+    # If the class member is supposed to contain a list, make sure the
+    # matching member is set to a list, then append the new member
+    # instance to the list.
+    if is_list:
+      member_list = getattr(self, member_name)
+      if member_list is None:
+        member_list = []
+        setattr(self, member_name, member_list)
+      member_list.append(value)
     else:
-      ExtensionContainer._ConvertElementTreeToMember(self, child_tree)      
+      setattr(self, member_name, value)
 
   def _ConvertElementAttributeToMember(self, attribute, value):
     # Find the attribute in this class's list of attributes. 
-    if self.__class__._attributes.has_key(attribute):
+    member_name = self.__class__._attributes.get(attribute)
+    if member_name is not None:
       # Find the member of this class which corresponds to the XML attribute
       # (lookup in current_class._attributes) and set this member to the
       # desired value (using self.__dict__).
       if value:
         # Encode the string to capture non-ascii characters (default UTF-8)
-        setattr(self, self.__class__._attributes[attribute], 
-                value.encode(MEMBER_STRING_ENCODING))
+        setattr(self, member_name, value.encode(MEMBER_STRING_ENCODING))
     else:
       ExtensionContainer._ConvertElementAttributeToMember(self, attribute, 
           value)
@@ -314,9 +891,61 @@ class AtomBase(ExtensionContainer):
     self._AddMembersToElementTree(new_tree)
     return new_tree
 
+  def _WriteXml(self, writer):
+    info = ParseInfo(self.__class__)
+    if not info.default_serialization:
+      writer._WriteForeign(self)
+      return
+    # The same members, in the same order, as _AddMembersToElementTree.
+    attributes = {}
+    for xml_attribute, member_name in info.attributes.iteritems():
+      member = getattr(self, member_name)
+      if member is not None:
+        attributes[xml_attribute] = member
+    extension_elements, extension_attributes = self._ExtensionsToWrite()
+    for attribute, value in extension_attributes.iteritems():
+      if value:
+        attributes[attribute] = value
+    children = []
+    for member_name in info.member_names:
+      member = getattr(self, member_name)
+      if member is None:
+        pass
+      elif isinstance(member, list):
+        children.extend(member)
+      else:
+        children.append(member)
+    children.extend(extension_elements)
+    writer.WriteElement(info.tag, attributes, self.text, children)
+
+  def _ExtensionsToWrite(self):
+    return self.extension_elements, self.extension_attributes
+
+  def WriteXml(self, write, string_encoding='UTF-8'):
+    """Writes the Atom object out as XML, a chunk at a time.
+
+    The XML is written straight from the object's members, rather than
+    by building an ElementTree and converting that to a string.
+
+    Args:
+      write: function Called with each chunk of the XML, a str of about
+          XML_CHUNK_SIZE bytes, in order. For example a file's write method.
+      string_encoding: str (optional) The encoding of the XML.
+    """
+    writer = _XmlWriter(write, string_encoding, 
+                        _ReachableNamespaces(self.__class__))
+    writer.WriteDeclaration()
+    if ParseInfo(self.__class__).default_serialization:
+      self._WriteXml(writer)
+    else:
+      writer.WriteElementTree(self._ToElementTree())
+    writer.Flush()
+
   def ToString(self, string_encoding='UTF-8'):
     """Converts the Atom object to a string containing XML."""
-    return ElementTree.tostring(self._ToElementTree(), encoding=string_encoding)
+    chunks = []
+    self.WriteXml(chunks.append, string_encoding)
+    return ''.join(chunks)
 
   def __str__(self):
     return self.ToString()
@@ -1207,8 +1836,8 @@ class Entry(FeedEntryParent):
     self.extension_attributes = extension_attributes or {}
 
 
-def EntryFromString(xml_string):
-  return CreateClassFromXMLString(Entry, xml_string)
+def EntryFromString(xml_string, compact=False):
+  return CreateClassFromXMLString(Entry, xml_string, compact=compact)
 
 
 class Feed(Source):
@@ -1269,8 +1898,8 @@ class Feed(Source):
     self.extension_attributes = extension_attributes or {}
 
 
-def FeedFromString(xml_string):
-  return CreateClassFromXMLString(Feed, xml_string)
+def FeedFromString(xml_string, compact=False):
+  return CreateClassFromXMLString(Feed, xml_string, compact=compact)
   
   
 class ExtensionElement(object):
@@ -1300,6 +1929,15 @@ class ExtensionElement(object):
   def ToString(self):
     element_tree = self._TransferToElementTree(ElementTree.Element(''))
     return ElementTree.tostring(element_tree, encoding="UTF-8")
+
+  def _WriteXml(self, writer):
+    if self.tag is None:
+      return
+    if self.namespace is not None:
+      tag = '{%s}%s' % (self.namespace, self.tag)
+    else:
+      tag = self.tag
+    writer.WriteElement(tag, self.attributes, self.text, self.children)
     
   def _TransferToElementTree(self, element_tree):
     if self.tag is None:
@@ -1393,3 +2031,44 @@ def _ExtensionElementFromElementTree(element_tree):
     extension.children.append(_ExtensionElementFromElementTree(child))
   extension.text = element_tree.text
   return extension
+
+
+class RawElement(object):
+  """An XML element kept as it was parsed, without converting it.
+
+  Holds the ElementTree node of a child element which a ProjectedClass
+  didn't convert. It has the tag and namespace of an ExtensionElement, so
+  FindExtensions works on it, and writes the element back out unchanged
+  when its parent is converted to XML.
+  """
+
+  __slots__ = ('element_tree',)
+
+  def __init__(self, element_tree):
+    self.element_tree = element_tree
+
+  def _GetNamespace(self):
+    element_tag = self.element_tree.tag
+    if '}' in element_tag:
+      return element_tag[1:element_tag.index('}')]
+    return None
+
+  def _GetTag(self):
+    element_tag = self.element_tree.tag
+    return element_tag[element_tag.find('}')+1:]
+
+  namespace = property(_GetNamespace, doc="""The element's XML namespace""")
+  tag = property(_GetTag, doc="""The element's tag, without the namespace""")
+
+  def ToString(self):
+    return ElementTree.tostring(self.element_tree, encoding="UTF-8")
+
+  def ToExtensionElement(self):
+    """Converts the element into an ExtensionElement."""
+    return _ExtensionElementFromElementTree(self.element_tree)
+
+  def _BecomeChildElement(self, element_tree):
+    element_tree.append(self.element_tree)
+
+  def _WriteXml(self, writer):
+    writer.WriteElementTree(self.element_tree)
@@ -29,6 +29,9 @@ different mechanism for making HTTP requests.
   ProxiedHttpClient: Contains a request method which connects to a proxy using
       settings stored in operating system environment variables then 
       performs an HTTP call to the endpoint server.
+
+  ConnectionPool: Keeps connections which the server left open, so later
+      requests to the same host can reuse them.
 """
 
 
@@ -42,6 +45,12 @@ import atom.url
 import atom.http_interface
 import socket
 import base64
+import mmap
+import select
+import stat
+import threading
+import time
+import zlib
 
 
 class ProxyError(atom.http_interface.Error):
@@ -50,11 +59,179 @@ class ProxyError(atom.http_interface.Error):
 
 DEFAULT_CONTENT_TYPE = 'application/atom+xml'
 
+# The most idle connections kept for each host, and how many seconds they
+# are kept for.
+DEFAULT_MAX_PER_HOST = 4
+DEFAULT_IDLE_TIMEOUT = 30
+
+# How many bytes of a gzip encoded response are read at a time to decode.
+GZIP_READ_SIZE = 64 * 1024
+
+# How many bytes of a file which can't be mapped into memory are read at a
+# time to upload, and how much of one which can is mapped at a time (a
+# multiple of mmap.ALLOCATIONGRANULARITY).
+UPLOAD_CHUNK_SIZE = 64 * 1024
+MMAP_WINDOW_SIZE = 16 * 1024 * 1024
+
+# The connection_pool default, which gets each HttpClient a pool of its own.
+_NEW_POOL = object()
+
+
+class ConnectionPool(object):
+  """Keeps idle keep-alive connections, keyed by (scheme, host, port).
+
+  A connection is put back by HttpClient once the body of its response has
+  been read to the end, unless the server said it would close it. At most
+  max_per_host idle connections are kept for each key, and none for longer
+  than idle_timeout seconds. Connections which the server has closed in
+  the meantime are noticed and dropped when they're taken out again.
+
+  How often a request could reuse a connection is counted in self.metrics.
+  The pool may be shared by HttpClients in several threads.
+  """
+
+  def __init__(self, max_per_host=DEFAULT_MAX_PER_HOST,
+               idle_timeout=DEFAULT_IDLE_TIMEOUT):
+    self.max_per_host = max_per_host
+    self.idle_timeout = idle_timeout
+    # Lists of (connection, time it was put back), most recent last.
+    self._idle = {}
+    self._lock = threading.Lock()
+    self.metrics = {
+      'hits': 0,
+      'misses': 0,
+      # Idle connections found closed, or which failed when reused.
+      'stale': 0,
+      # Idle connections closed for being kept too long, or one too many.
+      'evicted': 0,
+    }
+
+  def get(self, key):
+    """Returns an idle connection for key, or None if there's none."""
+    self._lock.acquire()
+    try:
+      idle = self._idle.get(key, [])
+      self._EvictExpired(idle)
+      while idle:
+        connection, released = idle.pop()
+        if _is_stale(connection):
+          connection.close()
+          self.metrics['stale'] += 1
+          continue
+        self.metrics['hits'] += 1
+        return connection
+      self.metrics['misses'] += 1
+      return None
+    finally:
+      self._lock.release()
+
+  def put(self, key, connection):
+    """Keeps connection for later requests to key."""
+    self._lock.acquire()
+    try:
+      idle = self._idle.setdefault(key, [])
+      self._EvictExpired(idle)
+      idle.append((connection, time.time()))
+      while len(idle) > self.max_per_host:
+        idle.pop(0)[0].close()
+        self.metrics['evicted'] += 1
+    finally:
+      self._lock.release()
+
+  def discard(self, connection):
+    """Closes a reused connection which turned out to be stale."""
+    connection.close()
+    self._lock.acquire()
+    try:
+      self.metrics['stale'] += 1
+    finally:
+      self._lock.release()
+
+  def clear(self):
+    """Closes every idle connection."""
+    self._lock.acquire()
+    try:
+      for idle in self._idle.values():
+        for connection, released in idle:
+          connection.close()
+      self._idle = {}
+    finally:
+      self._lock.release()
+
+  def _EvictExpired(self, idle):
+    expired = time.time() - self.idle_timeout
+    while idle and idle[0][1] < expired:
+      idle.pop(0)[0].close()
+      self.metrics['evicted'] += 1
+
+
+class _PooledResponse(httplib.HTTPResponse):
+  """Puts its connection back in the pool once the body has been read.
+
+  A gzip encoded body is decoded as it's read, and the Content-Encoding
+  and Content-Length headers, which describe the encoded body, are dropped.
+  """
+
+  release = None
+  _decoder = None
+
+  def begin(self):
+    httplib.HTTPResponse.begin(self)
+    encoding = self.msg.getheader('content-encoding', '')
+    if encoding.strip().lower() == 'gzip':
+      self._decoder = zlib.decompressobj(atom.http_interface.GZIP_WBITS)
+      self._decoded = ''
+      self._decoded_all = False
+      del self.msg['content-encoding']
+      del self.msg['content-length']
+
+  def read(self, amt=None):
+    if self._decoder is None:
+      return httplib.HTTPResponse.read(self, amt)
+    decoded = self._decoded
+    if amt is None:
+      if not self._decoded_all:
+        decoded += self._decoder.decompress(httplib.HTTPResponse.read(self))
+        decoded += self._decoder.flush()
+        self._decoded_all = True
+      self._decoded = ''
+      return decoded
+    while len(decoded) < amt and not self._decoded_all:
+      encoded = httplib.HTTPResponse.read(self, GZIP_READ_SIZE)
+      decoded += self._decoder.decompress(encoded)
+      if not encoded or self.isclosed():
+        decoded += self._decoder.flush()
+        self._decoded_all = True
+    self._decoded = decoded[amt:]
+    return decoded[:amt]
+
+  def close(self):
+    httplib.HTTPResponse.close(self)
+    release, self.release = self.release, None
+    if release is not None and not self.will_close:
+      release()
+
 
 class HttpClient(atom.http_interface.GenericHttpClient):
-  def __init__(self, headers=None):
+  """Makes HTTP requests with httplib.
+
+  Connections are kept alive and reused through self.connection_pool, which
+  is a new ConnectionPool unless one is given. Pass or set None to open a
+  new connection for every request.
+
+  Responses are requested gzip encoded, and decoded as they're read. If
+  gzip_request_threshold is set, POST and PUT bodies of at least that many
+  bytes are gzip encoded too, as are Atom objects streamed with chunked
+  transfer encoding, whose size isn't known in advance.
+  """
+
+  def __init__(self, headers=None, connection_pool=_NEW_POOL):
     self.debug = False
     self.headers = headers or {}
+    if connection_pool is _NEW_POOL:
+      connection_pool = ConnectionPool()
+    self.connection_pool = connection_pool
+    self.gzip_request_threshold = None
 
   def request(self, operation, url, data=None, headers=None):
     """Performs an HTTP call to the server, supports GET, POST, PUT, and 
@@ -74,11 +251,25 @@ class HttpClient(atom.http_interface.GenericHttpClient):
           read a chunk of 100K bytes at a time and send them. 
           If the data is a list of parts to be sent, each part will be 
           evaluated and sent.
+          If data is an Atom object with a WriteXml method and no
+          Content-Length header is given, its XML is sent with chunked
+          transfer encoding as it is written.
       url: The full URL to which the request should be sent. Can be a string
           or atom.url.Url.
       headers: dict of strings. HTTP headers which should be sent
           in the request. 
     """
+    return self.request_async(operation, url, data=data,
+                              headers=headers).get_result()
+
+  def request_async(self, operation, url, data=None, headers=None):
+    """Sends a request, and returns an atom.http_interface.PendingResult
+    whose get_result method reads the response.
+
+    Each request in progress has a connection of its own, so the server
+    can work on several at once, and their responses can be read in any
+    order. See request for the arguments.
+    """
     if not isinstance(url, atom.url.Url):
       if isinstance(url, types.StringType):
         url = atom.url.parse_url(url)
@@ -89,11 +280,97 @@ class HttpClient(atom.http_interface.GenericHttpClient):
     all_headers = self.headers.copy()
     if headers:
       all_headers.update(headers) 
+    atom.http_interface.accept_gzip(all_headers)
+
+    compress = (self.gzip_request_threshold is not None and
+                operation in ('POST', 'PUT') and
+                'Content-Encoding' not in all_headers)
+    if (compress and isinstance(data, types.StringType) and
+        len(data) >= self.gzip_request_threshold):
+      data = atom.http_interface.gzip_compress(data)
+      all_headers['Content-Encoding'] = 'gzip'
+      all_headers['Content-Length'] = len(data)
+
+    # If the list of headers does not include a Content-Length, attempt to
+    # calculate it based on the data object.
+    stream_xml = False
+    if data and 'Content-Length' not in all_headers:
+      if isinstance(data, types.StringType):
+        all_headers['Content-Length'] = len(data)
+      elif hasattr(data, 'WriteXml'):
+        stream_xml = True
+        all_headers['Transfer-Encoding'] = 'chunked'
+        if compress:
+          all_headers['Content-Encoding'] = 'gzip'
+      else:
+        raise atom.http_interface.ContentLengthRequired('Unable to calculate '
+            'the length of the data parameter. Specify a value for '
+            'Content-Length')
 
-    connection = self._prepare_connection(url, all_headers)
+    # Set the content type to the default value if none was set.
+    if 'Content-Type' not in all_headers:
+      all_headers['Content-Type'] = DEFAULT_CONTENT_TYPE
 
+    pool = self.connection_pool
+    key = None
+    connection = None
+    if pool is not None:
+      key = self._connection_key(url)
+      connection = pool.get(key)
+    if connection is None:
+      connection = self._prepare_connection(url, all_headers)
+      reused = False
+    else:
+      reused = True
+
+    # The server may have closed a kept-alive connection just as it was
+    # reused, which shows when the request is sent or when the response is
+    # read. Either way an idempotent request is sent once more on a new
+    # connection, unless a file was being sent; others may have been
+    # carried out, so the error is raised.
+    resend = (reused and
+              operation in atom.http_interface.IDEMPOTENT_OPERATIONS and
+              atom.http_interface.can_resend(data))
+    try:
+      self._send_request(connection, operation, url, data, all_headers,
+                         stream_xml)
+    except (socket.error, httplib.HTTPException):
+      if not resend:
+        raise
+      pool.discard(connection)
+      connection = self._prepare_connection(url, all_headers)
+      resend = False
+      self._send_request(connection, operation, url, data, all_headers,
+                         stream_xml)
+
+    def get_response():
+      used = connection
+      try:
+        response = used.getresponse()
+      except (socket.error, httplib.HTTPException):
+        if not resend:
+          raise
+        pool.discard(used)
+        used = self._prepare_connection(url, all_headers)
+        self._send_request(used, operation, url, data, all_headers,
+                           stream_xml)
+        response = used.getresponse()
+      if pool is not None:
+        response.release = lambda: pool.put(key, used)
+        if operation == 'HEAD' or response.length == 0:
+          # There's no body for the caller to read, such as for a 304, so
+          # the connection can go back now.
+          response.close()
+      return response
+
+    return atom.http_interface.PendingResult(get_response)
+
+  def _send_request(self, connection, operation, url, data, all_headers,
+                    stream_xml):
+    """Sends the request over connection."""
     if self.debug:
       connection.debuglevel = 1
+    connection.response_class = _PooledResponse
 
     connection.putrequest(operation, self._get_access_url(url), 
         skip_host=True)
@@ -115,35 +392,27 @@ class HttpClient(atom.http_interface.GenericHttpClient):
       except ValueError:  # header_line missing from connection._buffer
         pass
 
-    # If the list of headers does not include a Content-Length, attempt to
-    # calculate it based on the data object.
-    if data and 'Content-Length' not in all_headers:
-      if isinstance(data, types.StringType):
-        all_headers['Content-Length'] = len(data)
-      else:
-        raise atom.http_interface.ContentLengthRequired('Unable to calculate '
-            'the length of the data parameter. Specify a value for '
-            'Content-Length')
-
-    # Set the content type to the default value if none was set.
-    if 'Content-Type' not in all_headers:
-      all_headers['Content-Type'] = DEFAULT_CONTENT_TYPE
-
     # Send the HTTP headers.
     for header_name in all_headers:
       connection.putheader(header_name, all_headers[header_name])
     connection.endheaders()
 
     # If there is data, send it in the request.
-    if data:
+    if stream_xml:
+      _send_xml_chunked(data, connection,
+                        all_headers.get('Content-Encoding') == 'gzip')
+    elif data:
       if isinstance(data, list):
         for data_part in data:
           _send_data_part(data_part, connection)
       else:
         _send_data_part(data, connection)
 
-    # Return the HTTP Response from the server.
-    return connection.getresponse()
+  def _connection_key(self, url):
+    """Returns the key of the connection_pool entry to use for url."""
+    if url.protocol == 'https':
+      return ('https', url.host, int(url.port or 443))
+    return ('http', url.host, int(url.port or 80))
     
   def _prepare_connection(self, url, headers):
     if not isinstance(url, atom.url.Url):
@@ -176,8 +445,27 @@ class ProxiedHttpClient(HttpClient):
   'proxy-password' or 'proxy_password' variable.
   
   After connecting to the proxy server, the request is completed as in 
-  HttpClient.request.
+  HttpClient.request. Connections to an HTTP proxy are pooled under the
+  proxy's address, so they're reused for any destination.
   """
+  def _connection_key(self, url):
+    proxy = url.protocol != 'https' and os.environ.get('http_proxy')
+    if proxy:
+      proxy_url = atom.url.parse_url(proxy)
+      return ('http', proxy_url.host, int(proxy_url.port or 80))
+    return HttpClient._connection_key(self, url)
+
+  def _send_request(self, connection, operation, url, data, all_headers,
+                    stream_xml):
+    # Each request to an HTTP proxy, over a new connection or not, carries
+    # the proxy's credentials.
+    if url.protocol != 'https' and os.environ.get('http_proxy'):
+      proxy_auth = _get_proxy_auth()
+      if proxy_auth:
+        all_headers['Proxy-Authorization'] = proxy_auth.strip()
+    HttpClient._send_request(self, connection, operation, url, data,
+                             all_headers, stream_xml)
+
   def _prepare_connection(self, url, headers):
     proxy_auth = _get_proxy_auth()
     if url.protocol == 'https':
@@ -239,9 +527,6 @@ class ProxiedHttpClient(HttpClient):
         proxy_url = atom.url.parse_url(proxy)
         if not proxy_url.port:
           proxy_url.port = '80'
-        
-        if proxy_auth:
-          headers['Proxy-Authorization'] = proxy_auth.strip()
 
         return httplib.HTTPConnection(proxy_url.host, int(proxy_url.port))
       else:
@@ -267,15 +552,41 @@ def _get_proxy_auth():
     return ''
 
 
+def _is_stale(connection):
+  """Checks whether the server has closed an idle connection.
+
+  An idle keep-alive connection has nothing to read; if its socket is
+  readable, the server has closed it or sent something unexpected.
+  """
+  sock = connection.sock
+  if sock is None:
+    return True
+  try:
+    return bool(select.select([sock], [], [], 0)[0])
+  except (select.error, socket.error, TypeError, ValueError):
+    return True
+
+
 def _send_data_part(data, connection):
   if isinstance(data, types.StringType):
     connection.send(data)
     return
   # Check to see if data is a file-like object that has a read method.
   elif hasattr(data, 'read'):
-    # Read the file and send it a chunk at a time.
+    if _send_file(data, connection):
+      return
+    # Read the file and send it a chunk at a time, reusing one buffer if
+    # the file can read into it.
+    if hasattr(data, 'readinto'):
+      chunk = bytearray(UPLOAD_CHUNK_SIZE)
+      view = memoryview(chunk)
+      while 1:
+        size = data.readinto(chunk)
+        if not size: break
+        connection.send(view[:size])
+      return
     while 1:
-      binarydata = data.read(100000)
+      binarydata = data.read(UPLOAD_CHUNK_SIZE)
       if binarydata == '': break
       connection.send(binarydata)
     return
@@ -284,3 +595,60 @@ def _send_data_part(data, connection):
     # Try to convert to a string and send the data.
     connection.send(str(data))
     return
+
+
+def _send_file(data, connection):
+  """Sends the rest of a regular file without reading it into strings.
+
+  The file is mapped into memory a window at a time, and the socket sends
+  straight from the mapped pages. Afterwards the file is at its end, as if
+  it had been read.
+
+  Returns:
+    False if data isn't a regular file, so it has to be read instead.
+  """
+  try:
+    fileno = data.fileno()
+    position = data.tell()
+    file_stat = os.fstat(fileno)
+  except (AttributeError, IOError, OSError, ValueError):
+    return False
+  if not stat.S_ISREG(file_stat.st_mode):
+    return False
+  size = file_stat.st_size
+  # Windows have to start at a multiple of the allocation granularity.
+  offset = position - position % mmap.ALLOCATIONGRANULARITY
+  while offset < size:
+    length = min(MMAP_WINDOW_SIZE, size - offset)
+    window = mmap.mmap(fileno, length, access=mmap.ACCESS_READ,
+                       offset=offset)
+    try:
+      start = max(position - offset, 0)
+      if start < length:
+        connection.send(buffer(window, start))
+    finally:
+      window.close()
+    offset += length
+  data.seek(max(size, position))
+  return True
+
+
+def _send_xml_chunked(data, connection, compress=False):
+  """Sends the XML of an Atom object as chunks of the request body.
+
+  Each chunk is sent as soon as data.WriteXml produces it (and, if compress
+  is True, gzip encodes it), so the whole document is never held in memory
+  as one string.
+  """
+  def send_chunk(chunk):
+    # An empty chunk would end the body.
+    if chunk:
+      connection.send('%x\r\n%s\r\n' % (len(chunk), chunk))
+  if compress:
+    compressor = zlib.compressobj(6, zlib.DEFLATED,
+                                  atom.http_interface.GZIP_WBITS)
+    data.WriteXml(lambda chunk: send_chunk(compressor.compress(chunk)))
+    send_chunk(compressor.flush())
+  else:
+    data.WriteXml(send_chunk)
+  connection.send('0\r\n\r\n')
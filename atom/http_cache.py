@@ -0,0 +1,131 @@
+#!/usr/bin/python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""This module provides a ResponseCache class which keeps earlier responses
+to GET requests, so they can be revalidated instead of downloaded again.
+
+A cached response remembers the ETag and Last-Modified headers the server
+sent with it. The next GET of the same URL sends them back as If-None-Match
+and If-Modified-Since, and if the server answers 304 Not Modified the cached
+body is used. gdata.service.GDataService.Get uses a response cache when its
+response_cache member is set.
+
+The ResponseCache in this module keeps response bodies in this process.
+gdata.alt.appengine.AppEngineResponseCache keeps them in the App Engine
+datastore instead.
+"""
+
+
+import threading
+
+
+DEFAULT_MAX_ENTRIES = 100
+
+
+class CachedResponse(object):
+  """The validators of a response, with its body.
+
+  Attributes:
+    etag: str or None The response's ETag header.
+    last_modified: str or None The response's Last-Modified header.
+    body: str or None The response body.
+  """
+  def __init__(self, etag=None, last_modified=None, body=None):
+    self.etag = etag
+    self.last_modified = last_modified
+    self.body = body
+
+  def validator_headers(self):
+    """Returns the headers which make a GET conditional on this response."""
+    headers = {}
+    if self.etag:
+      headers['If-None-Match'] = self.etag
+    if self.last_modified:
+      headers['If-Modified-Since'] = self.last_modified
+    return headers
+
+
+class ResponseCache(object):
+  """Keeps CachedResponses in memory, dropping the least recently used.
+
+  Bodies are kept rather than converted results, so each GET answered from
+  the cache converts the body again, and callers can modify what they get.
+  """
+  def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+    self.max_entries = max_entries
+    # Maps key to its [previous, next, key, cached response] link in a
+    # circular list, most recently used last.
+    self._links = {}
+    self._root = [None, None, None, None]
+    self._root[0] = self._root[1] = self._root
+    self._lock = threading.Lock()
+
+  def get(self, key):
+    """Returns the CachedResponse for key, or None."""
+    self._lock.acquire()
+    try:
+      link = self._links.get(key)
+      if link is None:
+        return None
+      self._unlink(link)
+      self._append(link)
+      return link[3]
+    finally:
+      self._lock.release()
+
+  def put(self, key, cached):
+    """Keeps cached, a CachedResponse, as the response for key."""
+    cached = CachedResponse(cached.etag, cached.last_modified, cached.body)
+    self._lock.acquire()
+    try:
+      link = self._links.pop(key, None)
+      if link is not None:
+        self._unlink(link)
+      link = [None, None, key, cached]
+      self._links[key] = link
+      self._append(link)
+      while len(self._links) > self.max_entries:
+        oldest = self._root[1]
+        self._unlink(oldest)
+        del self._links[oldest[2]]
+    finally:
+      self._lock.release()
+
+  def remove(self, key):
+    """Forgets the response for key, if there is one."""
+    self._lock.acquire()
+    try:
+      link = self._links.pop(key, None)
+      if link is not None:
+        self._unlink(link)
+    finally:
+      self._lock.release()
+
+  def clear(self):
+    self._lock.acquire()
+    try:
+      self._links = {}
+      self._root[0] = self._root[1] = self._root
+    finally:
+      self._lock.release()
+
+  def _append(self, link):
+    last = self._root[0]
+    link[0] = last
+    link[1] = self._root
+    last[1] = self._root[0] = link
+
+  def _unlink(self, link):
+    link[0][1] = link[1]
+    link[1][0] = link[0]
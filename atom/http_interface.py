@@ -27,6 +27,10 @@
       HTTP requests using different logic (for example, when running on 
       Google App Engine, the http_client makes requests using the App Engine
       urlfetch API). 
+
+  PendingResult: The result of a request which has been started, and may
+      still be in progress. Returned by the request_async methods of HTTP
+      clients and services.
 """
 
 
@@ -34,10 +38,58 @@ __author__ = 'api.jscudder (Jeff Scudder)'
 
 
 import StringIO
+import zlib
 
 
 USER_AGENT = '%s GData-Python/1.2.2'
 
+# zlib window bits for a stream with a gzip header and trailer.
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+# Operations which may be sent again, after an attempt which may or may not
+# have reached the server, without the risk of being carried out twice.
+IDEMPOTENT_OPERATIONS = ('GET', 'HEAD', 'PUT', 'DELETE')
+
+
+def accept_gzip(headers):
+  """Asks the server for a gzip encoded response, unless headers say
+  otherwise.
+
+  Google's servers only gzip responses for user agents which mention gzip,
+  so it's added to the User-Agent header as well.
+  """
+  if 'Accept-Encoding' in headers:
+    return
+  headers['Accept-Encoding'] = 'gzip'
+  user_agent = headers.get('User-Agent')
+  if user_agent and 'gzip' not in user_agent:
+    headers['User-Agent'] = '%s (gzip)' % user_agent
+
+
+def can_resend(data):
+  """Checks whether request data can be sent again after a failed attempt.
+
+  Strings and Atom objects can; file-like objects, alone or as parts of a
+  list, have been read from and can't.
+  """
+  if isinstance(data, list):
+    for data_part in data:
+      if hasattr(data_part, 'read'):
+        return False
+    return True
+  return not hasattr(data, 'read')
+
+
+def gzip_compress(data):
+  """Returns data, a str, gzip encoded."""
+  compressor = zlib.compressobj(6, zlib.DEFLATED, GZIP_WBITS)
+  return compressor.compress(data) + compressor.flush()
+
+
+def gzip_decompress(data):
+  """Returns the content of data, a gzip encoded str."""
+  return zlib.decompress(data, GZIP_WBITS)
+
 
 class Error(Exception):
   pass
@@ -97,6 +149,30 @@ class HttpResponse(object):
       return self._body.read(amt)
 
 
+class PendingResult(object):
+  """The result of a request which may still be in progress.
+
+  get_result waits for the request to finish, if it hasn't, and returns its
+  result or raises the error it ended in. Once it has returned, later calls
+  return the same result.
+  """
+  def __init__(self, wait):
+    """
+    
+    Args:
+      wait: A function of no arguments which waits for the request and
+          returns its result.
+    """
+    self._wait = wait
+    self._result = None
+
+  def get_result(self):
+    if self._wait is not None:
+      self._result = self._wait()
+      self._wait = None
+    return self._result
+
+
 class GenericHttpClient(object):
   debug = False
 
@@ -121,6 +197,15 @@ class GenericHttpClient(object):
     return self.http_client.request(operation, url, data=data, 
         headers=all_headers)
 
+  def request_async(self, operation, url, data=None, headers=None):
+    """Starts a request and returns a PendingResult for the response.
+
+    Clients which can have several requests in progress at once override
+    this. By default the request is completed before this returns.
+    """
+    response = self.request(operation, url, data=data, headers=headers)
+    return PendingResult(lambda: response)
+
   def get(self, url, headers=None):
     return self.request('GET', url, headers=headers)
 
@@ -0,0 +1,138 @@
+#!/usr/bin/python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""This module provides a RateLimiter class which spaces out requests so
+they stay under a server's quota.
+
+AtomService.request asks its rate_limiter, if it has one, before sending
+each request. Requests are counted in token buckets: one for the host the
+request goes to, and one for the user whose Authorization it carries. A
+bucket lets a burst of requests through at once, then refills at its rate
+in requests per second; a request which finds its bucket empty waits until
+it's refilled.
+"""
+
+
+import threading
+import time
+
+
+# Buckets kept before idle ones are dropped.
+MAX_BUCKETS = 1000
+
+
+class TokenBucket(object):
+  """Lets rate requests a second through, and up to burst at once.
+
+  reserve takes a token even when there isn't one, so requests waiting
+  for the bucket are let through in the order they came, each a 1/rate
+  second after the one before.
+  """
+  def __init__(self, rate, burst=1, now=None):
+    self.rate = float(rate)
+    self.burst = burst
+    self.tokens = float(burst)
+    if now is None:
+      now = time.time()
+    self.updated = now
+
+  def reserve(self, now):
+    """Takes a token and returns the seconds to wait until it's there."""
+    self._refill(now)
+    self.tokens -= 1
+    if self.tokens >= 0:
+      return 0
+    return -self.tokens / self.rate
+
+  def is_idle(self, now):
+    """Returns True if the bucket has refilled, so it can be forgotten."""
+    self._refill(now)
+    return self.tokens >= self.burst
+
+  def _refill(self, now):
+    self.tokens = min(self.burst,
+                      self.tokens + (now - self.updated) * self.rate)
+    self.updated = now
+
+
+class RateLimiter(object):
+  """Holds requests back to the rates set for their host and user.
+
+  Rates are given as (requests per second, burst) pairs. host_rates maps a
+  host to its rate, and default_host_rate applies to the other hosts;
+  user_rate applies to each user separately. A request waits for the
+  slower of its host's and its user's bucket. Leave a rate None to not
+  limit by it.
+
+  The waits are added up in self.metrics. A limiter may be shared by
+  services in several threads.
+  """
+  def __init__(self, host_rates=None, default_host_rate=None,
+               user_rate=None):
+    self.host_rates = host_rates or {}
+    self.default_host_rate = default_host_rate
+    self.user_rate = user_rate
+    self._buckets = {}
+    self._lock = threading.Lock()
+    self.metrics = {
+      'requests': 0,
+      # Requests which had to wait, and how long they waited altogether.
+      'delayed': 0,
+      'wait_seconds': 0.0,
+      'max_wait_seconds': 0.0,
+    }
+
+  def wait(self, host, user=None):
+    """Waits until a request to host for user may be sent.
+
+    Args:
+      host: str The host the request goes to.
+      user: str or None Identifies the user the request is made for, such
+          as its Authorization header.
+
+    Returns:
+      The seconds waited.
+    """
+    self._lock.acquire()
+    try:
+      now = time.time()
+      delay = 0
+      rate = self.host_rates.get(host, self.default_host_rate)
+      if rate is not None:
+        delay = self._bucket(('host', host), rate, now).reserve(now)
+      if user is not None and self.user_rate is not None:
+        delay = max(delay,
+                    self._bucket(('user', user), self.user_rate,
+                                 now).reserve(now))
+      self.metrics['requests'] += 1
+      if delay:
+        self.metrics['delayed'] += 1
+        self.metrics['wait_seconds'] += delay
+        self.metrics['max_wait_seconds'] = max(
+            self.metrics['max_wait_seconds'], delay)
+    finally:
+      self._lock.release()
+    if delay:
+      time.sleep(delay)
+    return delay
+
+  def _bucket(self, key, rate, now):
+    bucket = self._buckets.get(key)
+    if bucket is None:
+      if len(self._buckets) >= MAX_BUCKETS:
+        for old_key, old_bucket in self._buckets.items():
+          if old_bucket.is_idle(now):
+            del self._buckets[old_key]
+      bucket = self._buckets[key] = TokenBucket(rate[0], rate[1], now)
+    return bucket
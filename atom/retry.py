@@ -0,0 +1,254 @@
+#!/usr/bin/python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""This module provides a RetryPolicy class which makes requests again when
+the server is briefly unavailable.
+
+AtomService.request hands each request to its retry_policy, if it has one.
+Requests which can safely be repeated are retried after a server error or
+a failed connection, waiting longer after each attempt, or as long as the
+server asks in a Retry-After header. A CircuitBreaker for each host stops
+requests to a host which keeps failing for a while, so it isn't hammered
+while it recovers.
+"""
+
+
+import httplib
+import random
+import rfc822
+import socket
+import threading
+import time
+
+import atom.http_interface
+
+
+DEFAULT_MAX_ATTEMPTS = 4
+# Seconds to wait after the first failed attempt, doubling after each one,
+# and the longest wait, including one asked for with Retry-After.
+DEFAULT_BASE_DELAY = 0.5
+DEFAULT_MAX_DELAY = 10
+
+# How many failures in a row open a host's circuit, and for how many
+# seconds it then stays open.
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_RESET_TIMEOUT = 30
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+class CircuitOpen(atom.http_interface.Error):
+  pass
+
+
+class CircuitBreaker(object):
+  """Tracks the failures of requests to one host.
+
+  The circuit opens after failure_threshold failures in a row. While it's
+  open requests are refused, until reset_timeout seconds have passed; then
+  one request is let through (half-open), and the circuit closes again if
+  it succeeds or opens again if it fails.
+  """
+  def __init__(self, failure_threshold=DEFAULT_FAILURE_THRESHOLD,
+               reset_timeout=DEFAULT_RESET_TIMEOUT):
+    self.failure_threshold = failure_threshold
+    self.reset_timeout = reset_timeout
+    self.state = CLOSED
+    self.failures = 0
+    self.opened_at = None
+
+  def allow(self):
+    """Returns True if a request may be made now."""
+    if self.state == CLOSED:
+      return True
+    # Only one trial request is let through each reset_timeout, in case
+    # the last one never finished.
+    if time.time() - self.opened_at < self.reset_timeout:
+      return False
+    self.state = HALF_OPEN
+    self.opened_at = time.time()
+    return True
+
+  def record_success(self):
+    self.state = CLOSED
+    self.failures = 0
+
+  def record_failure(self):
+    """Returns True if this failure opened the circuit."""
+    self.failures += 1
+    if self.state == HALF_OPEN or (self.state == CLOSED and
+                                   self.failures >= self.failure_threshold):
+      self.state = OPEN
+      self.opened_at = time.time()
+      return True
+    return False
+
+
+class RetryPolicy(object):
+  """Retries requests which fail for reasons worth waiting out.
+
+  A request is retried if its operation is in idempotent_operations and its
+  data can be sent again, and the attempt either raised one of
+  retry_exceptions or got a response with one of retry_statuses. Attempts
+  are spaced by a random time up to base_delay * 2 ** (attempt - 1)
+  seconds, or by the Retry-After the server sent; if that's more than
+  max_delay, the response is returned as it is.
+
+  What happened is counted in self.metrics, and breaker_states() gives
+  the state of each host's CircuitBreaker. A policy may be shared by
+  services in several threads.
+  """
+  idempotent_operations = atom.http_interface.IDEMPOTENT_OPERATIONS
+  retry_statuses = (500, 502, 503, 504)
+  retry_exceptions = (socket.error, httplib.HTTPException)
+
+  def __init__(self, max_attempts=DEFAULT_MAX_ATTEMPTS,
+               base_delay=DEFAULT_BASE_DELAY, max_delay=DEFAULT_MAX_DELAY,
+               failure_threshold=DEFAULT_FAILURE_THRESHOLD,
+               reset_timeout=DEFAULT_RESET_TIMEOUT, retry_exceptions=None):
+    self.max_attempts = max_attempts
+    self.base_delay = base_delay
+    self.max_delay = max_delay
+    self.failure_threshold = failure_threshold
+    self.reset_timeout = reset_timeout
+    if retry_exceptions is not None:
+      self.retry_exceptions = retry_exceptions
+    self._breakers = {}
+    self._lock = threading.Lock()
+    self.metrics = {
+      'requests': 0,
+      'retries': 0,
+      # Requests which failed on their last attempt.
+      'gave_up': 0,
+      'circuit_opened': 0,
+      'circuit_refused': 0,
+    }
+
+  def check(self, host):
+    """Raises CircuitOpen if requests to host are being refused."""
+    self._lock.acquire()
+    try:
+      if self._breaker(host).allow():
+        return
+      self.metrics['circuit_refused'] += 1
+    finally:
+      self._lock.release()
+    raise CircuitOpen('Requests to %s are failing, not retrying for now'
+                      % host)
+
+  def perform(self, operation, host, data, send, first_attempt=None):
+    """Returns the response to a request, making it again if need be.
+
+    Args:
+      operation: str The HTTP operation, such as 'GET'.
+      host: str The host the request goes to, whose circuit it counts for.
+      data: The data of the request, to see whether it can be resent.
+      send: A function of no arguments which makes one attempt and returns
+          the response.
+      first_attempt: A function of no arguments which returns the response
+          to a first attempt which was started before (and checked for
+          with check), or None.
+
+    Returns:
+      The last response, which may still be an error.
+    """
+    retry = (operation in self.idempotent_operations and
+             atom.http_interface.can_resend(data))
+    self._count('requests')
+    attempt = 1
+    while True:
+      if attempt > 1 or first_attempt is None:
+        self.check(host)
+        first_attempt = send
+      try:
+        response = first_attempt()
+      except self.retry_exceptions:
+        self._record(host, False)
+        if not retry or attempt >= self.max_attempts:
+          self._count('gave_up')
+          raise
+        delay = self._Backoff(attempt)
+      else:
+        if response.status not in self.retry_statuses:
+          self._record(host, True)
+          return response
+        self._record(host, False)
+        delay = _retry_after(response)
+        if delay is None:
+          delay = self._Backoff(attempt)
+        if (not retry or attempt >= self.max_attempts or
+            delay > self.max_delay):
+          self._count('gave_up')
+          return response
+        # Read the error so its connection can be reused.
+        response.read()
+      self._count('retries')
+      time.sleep(delay)
+      attempt += 1
+
+  def breaker_states(self):
+    """Returns a dict of each host's circuit state."""
+    self._lock.acquire()
+    try:
+      states = {}
+      for host, breaker in self._breakers.iteritems():
+        states[host] = breaker.state
+      return states
+    finally:
+      self._lock.release()
+
+  def _Backoff(self, attempt):
+    return random.uniform(0, min(self.max_delay,
+                                 self.base_delay * 2 ** (attempt - 1)))
+
+  def _breaker(self, host):
+    breaker = self._breakers.get(host)
+    if breaker is None:
+      breaker = self._breakers[host] = CircuitBreaker(self.failure_threshold,
+                                                      self.reset_timeout)
+    return breaker
+
+  def _record(self, host, succeeded):
+    self._lock.acquire()
+    try:
+      breaker = self._breaker(host)
+      if succeeded:
+        breaker.record_success()
+      elif breaker.record_failure():
+        self.metrics['circuit_opened'] += 1
+    finally:
+      self._lock.release()
+
+  def _count(self, name):
+    self._lock.acquire()
+    try:
+      self.metrics[name] += 1
+    finally:
+      self._lock.release()
+
+
+def _retry_after(response):
+  """Returns the seconds a response's Retry-After header asks to wait."""
+  value = response.getheader('Retry-After')
+  if not value:
+    return None
+  value = value.strip()
+  if value.isdigit():
+    return int(value)
+  when = rfc822.parsedate_tz(value)
+  if when is None:
+    return None
+  return max(0, rfc822.mktime_tz(when) - time.time())
@@ -68,6 +68,11 @@ class AtomService(object):
   current_token = None
   auto_store_tokens = True
   auto_set_current_token = True
+  # Set to an atom.retry.RetryPolicy to retry requests which fail because
+  # the server is briefly unavailable.
+  retry_policy = None
+  # Set to an atom.rate_limit.RateLimiter to space out requests.
+  rate_limiter = None
 
   def _get_override_token(self):
     return self.current_token
@@ -144,6 +149,22 @@ class AtomService(object):
 
   def request(self, operation, url, data=None, headers=None, 
       url_params=None):
+    return self._perform_request(self.http_client, operation, url, data,
+                                 headers, url_params)
+
+  def request_async(self, operation, url, data=None, headers=None,
+      url_params=None):
+    """Starts a request like request does, but returns as soon as it's sent.
+
+    Returns:
+      An atom.http_interface.PendingResult whose get_result method waits
+      for the server's response and returns it.
+    """
+    return self._perform_request(_AsyncHttpClient(self.http_client),
+                                 operation, url, data, headers, url_params)
+
+  def _perform_request(self, http_client, operation, url, data, headers,
+      url_params):
     if isinstance(url, str):
       if not url.startswith('http') and self.ssl:
         url = atom.url.parse_url('https://%s%s' % (self.server, url))
@@ -161,8 +182,11 @@ class AtomService(object):
       all_headers.update(headers)
 
     # If the list of headers does not include a Content-Length, attempt to
-    # calculate it based on the data object.
-    if data and 'Content-Length' not in all_headers:
+    # calculate it based on the data object. Atom objects are left for the
+    # HTTP client, which either streams them or works out the length when
+    # it converts them to a string, so they're only serialized once.
+    if (data and 'Content-Length' not in all_headers and 
+        not hasattr(data, 'WriteXml')):
       content_length = CalculateDataLength(data)
       if content_length:
         all_headers['Content-Length'] = str(content_length)
@@ -172,8 +196,26 @@ class AtomService(object):
       auth_token = self.override_token
     else:
       auth_token = self.token_store.find_token(url)
-    return auth_token.perform_request(self.http_client, operation, url, 
-        data=data, headers=all_headers)
+
+    def send(client=self.http_client):
+      if self.rate_limiter is not None:
+        self.rate_limiter.wait(url.host,
+                               getattr(auth_token, 'auth_header', None))
+      return auth_token.perform_request(client, operation, url,
+          data=data, headers=all_headers)
+
+    # Each attempt goes through the rate limiter and the token again, so
+    # retries are held back and signed afresh.
+    policy = self.retry_policy
+    if policy is None:
+      return send(http_client)
+    if isinstance(http_client, _AsyncHttpClient):
+      policy.check(url.host)
+      pending = send(http_client)
+      return atom.http_interface.PendingResult(
+          lambda: policy.perform(operation, url.host, data, send,
+                                 first_attempt=pending.get_result))
+    return policy.perform(operation, url.host, data, send)
 
   # CRUD operations
   def Get(self, uri, extra_headers=None, url_params=None, escape_params=True):
@@ -303,6 +345,24 @@ class AtomService(object):
                         url_params=url_params)
 
 
+class _AsyncHttpClient(object):
+  """Has tokens start requests with request_async instead of request.
+
+  A token's perform_request signs the request and passes it on to the HTTP
+  client's request method, which here starts it and returns a PendingResult.
+  """
+  def __init__(self, http_client):
+    self.http_client = http_client
+
+  def request(self, operation, url, data=None, headers=None):
+    if hasattr(self.http_client, 'request_async'):
+      return self.http_client.request_async(operation, url, data=data,
+                                            headers=headers)
+    response = self.http_client.request(operation, url, data=data,
+                                         headers=headers)
+    return atom.http_interface.PendingResult(lambda: response)
+
+
 class BasicAuthToken(atom.http_interface.GenericToken):
   def __init__(self, auth_header, scopes=None):
     """Creates a token used to add Basic Auth headers to HTTP requests.
@@ -334,12 +394,12 @@ class BasicAuthToken(atom.http_interface.GenericToken):
     """Tells the caller if the token authorizes access to the desired URL.
     """
     if isinstance(url, (str, unicode)):
-      url = atom.url.parse_url(url)
+      url = atom.url.parse_url_cached(url)
     for scope in self.scopes:
       if scope == atom.token_store.SCOPE_ALL:
         return True
       if isinstance(scope, (str, unicode)):
-        scope = atom.url.parse_url(scope)
+        scope = atom.url.parse_url_cached(scope)
       if scope == url:
         return True
       # Check the host and the path, but ignore the port and protocol.
@@ -686,11 +746,7 @@ def __SendDataPart(data, connection):
     return
   # Check to see if data is a file-like object that has a read method.
   elif hasattr(data, 'read'):
-    # Read the file and send it a chunk at a time.
-    while 1:
-      binarydata = data.read(100000)
-      if binarydata == '': break
-      connection.send(binarydata)
+    atom.http._send_data_part(data, connection)
     return
   else:
     # The data object was not a file.
@@ -35,10 +35,78 @@ import atom.url
 SCOPE_ALL = 'http'
 
 
+class ScopeIndex(object):
+  """Finds the scopes which may cover a URL without checking every scope.
+
+  A scope covers a URL if it is SCOPE_ALL, or if it has the same host and
+  either no path or a path which begins the URL's path (the port and
+  protocol are ignored), which is how tokens' valid_for_scope methods
+  decide. Scope paths are kept in a character trie for each host, so a
+  lookup takes time proportional to the length of the URL's path.
+  """
+  def __init__(self, scopes=None):
+    self._all = set()
+    self._hosts = {}
+    for scope in scopes or []:
+      self.add(scope)
+
+  def _node(self, scope, create):
+    if not isinstance(scope, atom.url.Url):
+      scope = atom.url.parse_url_cached(scope)
+    node = self._hosts.get(scope.host)
+    if node is None:
+      if not create:
+        return None
+      node = self._hosts[scope.host] = {}
+    for char in scope.path or '':
+      child = node.get(char)
+      if child is None:
+        if not create:
+          return None
+        child = node[char] = {}
+      node = child
+    return node
+
+  def add(self, scope):
+    if scope == SCOPE_ALL:
+      self._all.add(scope)
+    else:
+      self._node(scope, True).setdefault(None, set()).add(scope)
+
+  def remove(self, scope):
+    if scope == SCOPE_ALL:
+      self._all.discard(scope)
+      return
+    node = self._node(scope, False)
+    if node is not None and None in node:
+      node[None].discard(scope)
+
+  def find(self, url):
+    """Returns the scopes which may cover url, most specific first.
+
+    Args:
+      url: atom.url.Url
+    """
+    found = []
+    node = self._hosts.get(url.host)
+    if node is not None:
+      found.extend(node.get(None, ()))
+      # A scope with a path never covers a URL without one.
+      for char in url.path or '':
+        node = node.get(char)
+        if node is None:
+          break
+        found.extend(node.get(None, ()))
+    found.reverse()
+    found.extend(self._all)
+    return found
+
+
 class TokenStore(object):
   """Manages Authorization tokens which will be sent in HTTP headers."""
   def __init__(self, scoped_tokens=None):
     self._tokens = scoped_tokens or {}
+    self._index = ScopeIndex(self._tokens.keys())
 
   def add_token(self, token):
     """Adds a new token to the store (replaces tokens with the same scope).
@@ -58,6 +126,7 @@ class TokenStore(object):
 
     for scope in token.scopes:
       self._tokens[str(scope)] = token
+      self._index.add(str(scope))
     return True  
 
   def find_token(self, url):
@@ -79,15 +148,17 @@ class TokenStore(object):
     if url is None:
       return None
     if isinstance(url, (str, unicode)):
-      url = atom.url.parse_url(url)
+      url = atom.url.parse_url_cached(url)
     if url in self._tokens:
       token = self._tokens[url]
       if token.valid_for_scope(url):
         return token
       else:
         del self._tokens[url]
-    for scope, token in self._tokens.iteritems():
-      if token.valid_for_scope(url):
+        self._index.remove(url)
+    for scope in self._index.find(url):
+      token = self._tokens.get(scope)
+      if token is not None and token.valid_for_scope(url):
         return token
     return atom.http_interface.GenericToken()
 
@@ -111,7 +182,9 @@ class TokenStore(object):
         token_found = True
     for scope in scopes_to_delete:
       del self._tokens[scope]
+      self._index.remove(scope)
     return token_found
 
   def remove_all_tokens(self):
     self._tokens = {} 
+    self._index = ScopeIndex()
@@ -25,6 +25,11 @@ import urllib
 DEFAULT_PROTOCOL = 'http'
 DEFAULT_PORT = 80
 
+# The most URL strings parse_url_cached remembers before starting over.
+MAX_CACHED_URLS = 1000
+
+_parsed_urls = {}
+
 
 def parse_url(url_string):
   """Creates a Url object which corresponds to the URL string.
@@ -54,6 +59,22 @@ def parse_url(url_string):
       elif len(pair_parts) == 1:
         url.params[urllib.unquote_plus(pair_parts[0])] = None
   return url
+
+
+def parse_url_cached(url_string):
+  """Like parse_url, but parses each distinct URL string only once.
+
+  The same Url object is returned for repeated calls with the same string,
+  so callers must not modify it.
+  """
+  url = _parsed_urls.get(url_string)
+  if url is None:
+    if len(_parsed_urls) >= MAX_CACHED_URLS:
+      _parsed_urls.clear()
+    url = parse_url(url_string)
+    _parsed_urls[url_string] = url
+  return url
+
    
 class Url(object):
   """Represents a URL and implements comparison logic.
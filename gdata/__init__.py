@@ -366,9 +366,17 @@ class GDataEntry(atom.Entry, LinkFinder):
       return self.content.src
 
 
-def GDataEntryFromString(xml_string):
-  """Creates a new GDataEntry instance given a string of XML."""
-  return atom.CreateClassFromXMLString(GDataEntry, xml_string)
+def GDataEntryFromString(xml_string, compact=False, fields=None):
+  """Creates a new GDataEntry instance given a string of XML.
+
+  If fields is given, only those members of each GDataEntry are converted
+  into objects, see atom.ProjectedClass.
+  """
+  projection = None
+  if fields:
+    projection = {GDataEntry: fields}
+  return atom.CreateClassFromXMLString(GDataEntry, xml_string, compact=compact,
+                                       projection=projection)
 
 
 class GDataFeed(atom.Feed, LinkFinder):
@@ -461,8 +469,17 @@ class GDataFeed(atom.Feed, LinkFinder):
     self.extension_attributes = extension_attributes or {}
 
 
-def GDataFeedFromString(xml_string):
-  return atom.CreateClassFromXMLString(GDataFeed, xml_string)
+def GDataFeedFromString(xml_string, compact=False, fields=None):
+  """Creates a new GDataFeed instance given a string of XML.
+
+  If fields is given, only those members of each GDataEntry are converted
+  into objects, see atom.ProjectedClass.
+  """
+  projection = None
+  if fields:
+    projection = {GDataEntry: fields}
+  return atom.CreateClassFromXMLString(GDataFeed, xml_string, compact=compact,
+                                       projection=projection)
 
 
 class BatchId(atom.AtomBase):
@@ -564,8 +581,17 @@ class BatchEntry(GDataEntry):
         extension_attributes=extension_attributes, text=text)
 
 
-def BatchEntryFromString(xml_string):
-  return atom.CreateClassFromXMLString(BatchEntry, xml_string)
+def BatchEntryFromString(xml_string, compact=False, fields=None):
+  """Creates a new BatchEntry instance given a string of XML.
+
+  If fields is given, only those members of each BatchEntry are converted
+  into objects, see atom.ProjectedClass.
+  """
+  projection = None
+  if fields:
+    projection = {BatchEntry: fields}
+  return atom.CreateClassFromXMLString(BatchEntry, xml_string, compact=compact,
+                                       projection=projection)
 
 
 class BatchInterrupted(atom.AtomBase):
@@ -772,8 +798,17 @@ class BatchFeed(GDataFeed):
     return None
  
 
-def BatchFeedFromString(xml_string):
-  return atom.CreateClassFromXMLString(BatchFeed, xml_string)
+def BatchFeedFromString(xml_string, compact=False, fields=None):
+  """Creates a new BatchFeed instance given a string of XML.
+
+  If fields is given, only those members of each BatchEntry are converted
+  into objects, see atom.ProjectedClass.
+  """
+  projection = None
+  if fields:
+    projection = {BatchEntry: fields}
+  return atom.CreateClassFromXMLString(BatchFeed, xml_string, compact=compact,
+                                       projection=projection)
   
 
 class EntryLink(atom.AtomBase):
@@ -26,6 +26,10 @@ run_on_appengine: Function which will modify an existing GDataService object
    to allow it to run on App Engine. It works by creating a new instance of
    the AppEngineHttpClient and replacing the GDataService object's
    http_client.
+
+AppEngineResponseCache: Keeps the bodies and validators of GET responses in
+   the datastore. Set the response_cache member of a GDataService object to
+   an instance of it to make repeated GETs conditional.
 """
 
 
@@ -33,7 +37,11 @@ __author__ = 'api.jscudder (Jeff Scudder)'
 
 
 import StringIO
+import hashlib
 import pickle
+import time
+import zlib
+import atom.http_cache
 import atom.http_interface
 import atom.token_store
 from google.appengine.api import urlfetch
@@ -77,9 +85,16 @@ def run_on_appengine(gdata_service, store_tokens=True,
 
 
 class AppEngineHttpClient(atom.http_interface.GenericHttpClient):
+  """Makes HTTP requests with App Engine's urlfetch API.
+
+  Responses are requested gzip encoded and decoded on arrival. If
+  gzip_request_threshold is set, POST and PUT bodies of at least that many
+  bytes are gzip encoded too.
+  """
   def __init__(self, headers=None):
     self.debug = False
     self.headers = headers or {}
+    self.gzip_request_threshold = None
 
   def request(self, operation, url, data=None, headers=None):
     """Performs an HTTP call to the server, supports GET, POST, PUT, and
@@ -104,9 +119,33 @@ class AppEngineHttpClient(atom.http_interface.GenericHttpClient):
       headers: dict of strings. HTTP headers which should be sent
           in the request.
     """
+    return HttpResponse(urlfetch.Fetch(follow_redirects=False,
+        **self._fetch_arguments(operation, url, data, headers)))
+
+  def request_async(self, operation, url, data=None, headers=None):
+    """Starts a urlfetch RPC for the request, and returns an
+    atom.http_interface.PendingResult whose get_result method waits for
+    the response.
+
+    Many requests can be in progress at once this way, without a thread
+    for each. See request for the arguments.
+    """
+    if not hasattr(urlfetch, 'create_rpc'):
+      # This SDK can't fetch asynchronously.
+      return atom.http_interface.GenericHttpClient.request_async(self,
+          operation, url, data=data, headers=headers)
+    rpc = urlfetch.create_rpc()
+    urlfetch.make_fetch_call(rpc, follow_redirects=False,
+        **self._fetch_arguments(operation, url, data, headers))
+    return atom.http_interface.PendingResult(
+        lambda: HttpResponse(rpc.get_result()))
+
+  def _fetch_arguments(self, operation, url, data, headers):
+    """Returns the urlfetch keyword arguments for a request."""
     all_headers = self.headers.copy()
     if headers:
       all_headers.update(headers)
+    atom.http_interface.accept_gzip(all_headers)
 
     # Construct the full payload.
     # Assume that data is None or a string.
@@ -120,6 +159,14 @@ class AppEngineHttpClient(atom.http_interface.GenericHttpClient):
       else:
         data_str = _convert_data_part(data)
 
+    if (data_str and self.gzip_request_threshold is not None and
+        operation in ('POST', 'PUT') and
+        len(data_str) >= self.gzip_request_threshold and
+        'Content-Encoding' not in all_headers):
+      data_str = atom.http_interface.gzip_compress(data_str)
+      all_headers['Content-Encoding'] = 'gzip'
+      all_headers['Content-Length'] = str(len(data_str))
+
     # If the list of headers does not include a Content-Length, attempt to
     # calculate it based on the data object.
     if data and 'Content-Length' not in all_headers:
@@ -140,8 +187,8 @@ class AppEngineHttpClient(atom.http_interface.GenericHttpClient):
       method = urlfetch.DELETE
     else:
       method = None
-    return HttpResponse(urlfetch.Fetch(url=str(url), payload=data_str,
-        method=method, headers=all_headers, follow_redirects=False))
+    return {'url': str(url), 'payload': data_str, 'method': method,
+            'headers': all_headers}
 
 
 def _convert_data_part(data):
@@ -163,8 +210,14 @@ class HttpResponse(object):
   """
 
   def __init__(self, urlfetch_response):
-    self.body = StringIO.StringIO(urlfetch_response.content)
+    content = urlfetch_response.content
     self.headers = urlfetch_response.headers
+    # urlfetch may already have decoded the body, leaving the header.
+    encoding = self.getheader('Content-Encoding') or ''
+    if (encoding.strip().lower() == 'gzip' and content and
+        content.startswith('\x1f\x8b')):
+      content = atom.http_interface.gzip_decompress(content)
+    self.body = StringIO.StringIO(content)
     self.status = urlfetch_response.status_code
     self.reason = ''
 
@@ -174,9 +227,9 @@ class HttpResponse(object):
     else:
       return self.body.read(length)
 
-  def getheader(self, name):
+  def getheader(self, name, default=None):
     if not self.headers.has_key(name):
-      return self.headers[name.lower()]
+      return self.headers.get(name.lower(), default)
     return self.headers[name]
 
 
@@ -225,17 +278,19 @@ class AppEngineTokenStore(atom.token_store.TokenStore):
     if url is None:
       return None
     if isinstance(url, (str, unicode)):
-      url = atom.url.parse_url(url)
-    tokens = load_auth_tokens()
+      url = atom.url.parse_url_cached(url)
+    tokens, index = load_auth_tokens_and_index()
     if url in tokens:
       token = tokens[url]
       if token.valid_for_scope(url):
         return token
       else:
+        tokens = dict(tokens)
         del tokens[url]
         save_auth_tokens(tokens)
-    for scope, token in tokens.iteritems():
-      if token.valid_for_scope(url):
+    for scope in index.find(url):
+      token = tokens.get(scope)
+      if token is not None and token.valid_for_scope(url):
         return token
     return atom.http_interface.GenericToken()
 
@@ -264,27 +319,117 @@ class AppEngineTokenStore(atom.token_store.TokenStore):
     save_auth_tokens({})
 
 
+class CachedResponseEntity(db.Model):
+  """Datastore Model for a response kept by an AppEngineResponseCache."""
+  etag = db.StringProperty()
+  last_modified = db.StringProperty()
+  compressed_body = db.BlobProperty()
+  cached = db.DateTimeProperty(auto_now=True)
+
+
+# Larger compressed bodies would not fit in an entity, and are not cached.
+MAX_CACHED_BODY_BYTES = 900000
+
+
+class AppEngineResponseCache(object):
+  """Keeps GET responses in the App Engine datastore.
+
+  Only the validators and the compressed body of each response are stored,
+  so after a 304 Not Modified the body is converted again; what's saved is
+  the download. Keys may contain auth headers, so entities are named by a
+  hash of the key.
+  """
+  def get(self, key):
+    entity = CachedResponseEntity.get_by_key_name(_response_key_name(key))
+    if entity is None:
+      return None
+    return atom.http_cache.CachedResponse(entity.etag, entity.last_modified,
+        body=zlib.decompress(entity.compressed_body))
+
+  def put(self, key, cached):
+    if cached.body is None:
+      return
+    compressed_body = zlib.compress(cached.body)
+    if len(compressed_body) > MAX_CACHED_BODY_BYTES:
+      self.remove(key)
+      return
+    CachedResponseEntity(key_name=_response_key_name(key), etag=cached.etag,
+        last_modified=cached.last_modified,
+        compressed_body=db.Blob(compressed_body)).put()
+
+  def remove(self, key):
+    entity = CachedResponseEntity.get_by_key_name(_response_key_name(key))
+    if entity is not None:
+      entity.delete()
+
+  def clear(self):
+    while True:
+      entities = CachedResponseEntity.all().fetch(500)
+      if not entities:
+        break
+      db.delete(entities)
+
+
+def _response_key_name(key):
+  return 'r' + hashlib.sha1(key).hexdigest()
+
+
+# How long a user's tokens, once read from the datastore, may be used from
+# this process's cache. Changes are normally seen at once, through the
+# version kept in memcache; this bounds how long they can be missed if
+# memcache loses the version or can't be written.
+TOKEN_CACHE_SECONDS = 60
+
+# Maps user email to (token dict, atom.token_store.ScopeIndex, version,
+# time cached). Only users with tokens are cached, so a token added by
+# another instance is found on the next request.
+_token_cache = {}
+
+# Counts of load_auth_tokens calls served from, and missing, the cache.
+token_cache_stats = {'hits': 0, 'misses': 0}
+
+
+def clear_token_cache():
+  """Empties the process-wide token cache and resets its counters."""
+  _token_cache.clear()
+  token_cache_stats['hits'] = 0
+  token_cache_stats['misses'] = 0
+
+
+def _token_version_key(current_user):
+  return 'tokens-version:' + current_user.email()
+
+
 def save_auth_tokens(token_dict):
   """Associates the tokens with the current user and writes to the datastore.
   
   If there us no current user, the tokens are not written and this function
-  returns None.
+  returns None. The user's token version in memcache is bumped, so every
+  instance reads the tokens again.
 
   Returns:
     The key of the datastore entity containing the user's tokens, or None if
     there was no current user.
   """
-  if users.get_current_user() is None:
+  current_user = users.get_current_user()
+  if current_user is None:
     return None
-  user_tokens = TokenCollection.all().filter('user =', users.get_current_user()).get()
+  _token_cache.pop(current_user.email(), None)
+  user_tokens = TokenCollection.all().filter('user =', current_user).get()
   if user_tokens:
     user_tokens.pickled_tokens = pickle.dumps(token_dict)
-    return user_tokens.put()
   else:
     user_tokens = TokenCollection(
-        user=users.get_current_user(), 
+        user=current_user, 
         pickled_tokens=pickle.dumps(token_dict))
-    return user_tokens.put()
+  key = user_tokens.put()
+  version = memcache.incr(_token_version_key(current_user), initial_value=0)
+  if version is not None and token_dict:
+    token_dict = dict(token_dict)
+    _token_cache[current_user.email()] = (
+        token_dict, atom.token_store.ScopeIndex(token_dict.keys()), version,
+        time.time())
+  return key
      
 
 def load_auth_tokens():
@@ -292,11 +437,45 @@ def load_auth_tokens():
   
   If there is no current user (a user is not signed in to the app) or the user
   does not have any tokens, an empty dictionary is returned.
+
+  The tokens are cached in this process while their version in memcache is
+  unchanged, for up to TOKEN_CACHE_SECONDS, so the datastore is only queried
+  on a cache miss. The caller gets its own copy of the dictionary and may
+  modify it.
   """
-  if users.get_current_user() is None:
-    return {}
-  user_tokens = TokenCollection.all().filter('user =', users.get_current_user()).get()
-  if user_tokens:
-    return pickle.loads(user_tokens.pickled_tokens)
-  return {}
+  tokens, index = load_auth_tokens_and_index()
+  return dict(tokens)
+
 
+def load_auth_tokens_and_index():
+  """Returns the current user's tokens and a ScopeIndex of their scopes.
+
+  Both come from the token cache and are shared, so the caller must not
+  modify them.
+  """
+  current_user = users.get_current_user()
+  if current_user is None:
+    return {}, atom.token_store.ScopeIndex()
+  version_key = _token_version_key(current_user)
+  version = memcache.get(version_key)
+  cached = _token_cache.get(current_user.email())
+  if (cached and version is not None and cached[2] == version and
+      time.time() - cached[3] < TOKEN_CACHE_SECONDS):
+    token_cache_stats['hits'] += 1
+    return cached[0], cached[1]
+  token_cache_stats['misses'] += 1
+  if version is None:
+    # Lost from memcache, or never saved. The version read back is the one
+    # the datastore read below is at least as new as.
+    memcache.add(version_key, 0)
+    version = memcache.get(version_key)
+  user_tokens = TokenCollection.all().filter('user =', current_user).get()
+  tokens = {}
+  if user_tokens:
+    tokens = pickle.loads(user_tokens.pickled_tokens)
+  index = atom.token_store.ScopeIndex(tokens.keys())
+  if tokens and version is not None:
+    _token_cache[current_user.email()] = (tokens, index, version, time.time())
+  else:
+    _token_cache.pop(current_user.email(), None)
+  return tokens, index
@@ -102,12 +102,7 @@ class AppsService(gdata.service.GDataService):
 
   def AddAllElementsFromAllPages(self, link_finder, func):
     """retrieve all pages and add all elements"""
-    next = link_finder.GetNextLink()
-    while next is not None:
-      next_feed = func(str(self.Get(next.href)))
-      for a_entry in next_feed.entry:
-        link_finder.entry.append(a_entry)
-      next = next_feed.GetNextLink()
+    link_finder.entry.extend(list(self.GetEntriesAfter(link_finder, func)))
     return link_finder
 
   def RetrievePageOfEmailLists(self, start_email_list_name=None):
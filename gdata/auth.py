@@ -466,12 +466,12 @@ class ClientLoginToken(atom.http_interface.GenericToken):
     """Tells the caller if the token authorizes access to the desired URL.
     """
     if isinstance(url, (str, unicode)):
-      url = atom.url.parse_url(url)
+      url = atom.url.parse_url_cached(url)
     for scope in self.scopes:
       if scope == atom.token_store.SCOPE_ALL:
         return True
       if isinstance(scope, (str, unicode)):
-        scope = atom.url.parse_url(scope)
+        scope = atom.url.parse_url_cached(scope)
       if scope == url:
         return True
       # Check the host and the path, but ignore the port and protocol.
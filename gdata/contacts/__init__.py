@@ -264,8 +264,17 @@ class ContactEntry(gdata.BatchEntry):
     return None
 
 
-def ContactEntryFromString(xml_string):
-  return atom.CreateClassFromXMLString(ContactEntry, xml_string)
+def ContactEntryFromString(xml_string, compact=False, fields=None):
+  """Creates a new ContactEntry instance given a string of XML.
+
+  If fields is given, only those members of each ContactEntry are converted
+  into objects, see atom.ProjectedClass.
+  """
+  projection = None
+  if fields:
+    projection = {ContactEntry: fields}
+  return atom.CreateClassFromXMLString(ContactEntry, xml_string,
+                                       compact=compact, projection=projection)
 
 
 class ContactsFeed(gdata.BatchFeed, gdata.LinkFinder):
@@ -294,8 +303,32 @@ class ContactsFeed(gdata.BatchFeed, gdata.LinkFinder):
                              text=text)
                              
 
-def ContactsFeedFromString(xml_string):
-  return atom.CreateClassFromXMLString(ContactsFeed, xml_string)
+def ContactsFeedFromString(xml_string, compact=False, fields=None):
+  """Creates a new ContactsFeed instance given a string of XML.
+
+  If fields is given, only those members of each ContactEntry are converted
+  into objects, see atom.ProjectedClass.
+  """
+  projection = None
+  if fields:
+    projection = {ContactEntry: fields}
+  return atom.CreateClassFromXMLString(ContactsFeed, xml_string,
+                                       compact=compact, projection=projection)
+
+
+def ContactsFeedStream(stream, compact=False, fields=None):
+  """Returns an atom.FeedStream which yields the ContactEntry objects in the
+  ContactsFeed read from stream.
+
+  The entries are atom.CompactClass versions if compact, and only the
+  members of them listed in fields are converted if fields is given.
+  """
+  feed_class = ContactsFeed
+  if compact:
+    feed_class = atom.CompactClass(feed_class)
+  if fields:
+    feed_class = atom.ProjectedClass(feed_class, {ContactEntry: fields})
+  return atom.FeedStream(feed_class, stream)
 
 
 class GroupEntry(gdata.BatchEntry):
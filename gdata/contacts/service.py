@@ -264,6 +264,18 @@ class ContactsService(gdata.service.GDataService):
     """
     return self.Post(batch_feed, url, converter=converter)
 
+  def ExecuteBatchAsync(self, batch_feed, url,
+                        converter=gdata.contacts.ContactsFeedFromString):
+    """Sends a batch request feed to the server without waiting for it.
+
+    See ExecuteBatch for the arguments.
+
+    Returns:
+      An atom.http_interface.PendingResult whose get_result method returns
+      what ExecuteBatch would have.
+    """
+    return self.PostAsync(batch_feed, url, converter=converter)
+
 class ContactsQuery(gdata.service.Query):
 
   def __init__(self, feed=None, text_query=None, params=None,
@@ -0,0 +1,358 @@
+#!/usr/bin/python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Uploads media in chunks with the GData resumable upload protocol, so an
+upload which fails partway can carry on where it stopped.
+
+An upload starts with a POST of the entry's metadata, whose response gives
+the URI of an upload session. The media is then PUT to the session URI a
+chunk at a time, with a Content-Range header; the server answers 308 with
+a Range header saying how much it has, until the last chunk, which is
+answered with the new entry. After a failure, an empty PUT asks the server
+how much it has, and the upload resumes from there.
+
+ResumableUploader does this for a GDataService. If it has a session store,
+the session URI and the confirmed offset are kept in it after every
+chunk, so a later upload of the same file, even from another process,
+resumes the same session. FileUploadSessionStore keeps them in files.
+"""
+
+
+import hashlib
+import httplib
+import os
+import socket
+import threading
+import time
+
+import gdata.service
+
+
+# Chunks are sized in multiples of CHUNK_GRANULARITY, starting at
+# DEFAULT_CHUNK_SIZE, and sized to take about TARGET_CHUNK_SECONDS to send.
+CHUNK_GRANULARITY = 256 * 1024
+DEFAULT_CHUNK_SIZE = 4 * CHUNK_GRANULARITY
+MIN_CHUNK_SIZE = CHUNK_GRANULARITY
+MAX_CHUNK_SIZE = 256 * CHUNK_GRANULARITY
+TARGET_CHUNK_SECONDS = 10
+
+# Failures in a row, without the server getting more of the media, before
+# an upload gives up; the wait after each one doubles from RETRY_SECONDS.
+MAX_FAILURES = 5
+RETRY_SECONDS = 1
+
+RESUME_INCOMPLETE = 308
+
+
+class UploadSession(object):
+  """The state of a resumable upload.
+
+  Attributes:
+    uri: str The session URI the media is PUT to.
+    length: int The size of the media.
+    offset: int or None How many bytes of the media the server has
+        confirmed, or None if that has to be asked.
+  """
+  def __init__(self, uri, length, offset=None):
+    self.uri = uri
+    self.length = length
+    self.offset = offset
+
+
+class UploadSessionStore(object):
+  """Keeps UploadSessions in memory, for uploads resumed by this process."""
+  def __init__(self):
+    self._sessions = {}
+    self._lock = threading.Lock()
+
+  def get(self, key):
+    """Returns a copy of the UploadSession for key, or None."""
+    self._lock.acquire()
+    try:
+      session = self._sessions.get(key)
+      if session is None:
+        return None
+      return UploadSession(session.uri, session.length, session.offset)
+    finally:
+      self._lock.release()
+
+  def put(self, key, session):
+    self._lock.acquire()
+    try:
+      self._sessions[key] = UploadSession(session.uri, session.length,
+                                          session.offset)
+    finally:
+      self._lock.release()
+
+  def remove(self, key):
+    self._lock.acquire()
+    try:
+      self._sessions.pop(key, None)
+    finally:
+      self._lock.release()
+
+
+class FileUploadSessionStore(object):
+  """Keeps UploadSessions in files in a directory, one file per key.
+
+  The files are replaced by renaming, so a crash leaves either the old
+  session or the new one.
+  """
+  def __init__(self, directory):
+    self.directory = directory
+
+  def get(self, key):
+    try:
+      session_file = open(self._Path(key))
+      try:
+        uri, length, offset = session_file.read().split('\n')[:3]
+      finally:
+        session_file.close()
+      if offset:
+        offset = int(offset)
+      else:
+        offset = None
+      return UploadSession(uri, int(length), offset)
+    except (IOError, ValueError):
+      return None
+
+  def put(self, key, session):
+    path = self._Path(key)
+    temp_path = '%s.%d.tmp' % (path, os.getpid())
+    offset = ''
+    if session.offset is not None:
+      offset = str(session.offset)
+    session_file = open(temp_path, 'w')
+    try:
+      session_file.write('%s\n%d\n%s\n' % (session.uri, session.length,
+                                             offset))
+    finally:
+      session_file.close()
+    os.rename(temp_path, path)
+
+  def remove(self, key):
+    try:
+      os.remove(self._Path(key))
+    except OSError:
+      pass
+
+  def _Path(self, key):
+    if isinstance(key, unicode):
+      key = key.encode('utf-8')
+    return os.path.join(self.directory,
+                        hashlib.sha1(key).hexdigest() + '.upload')
+
+
+class ResumableUploader(object):
+  """Uploads media for a GDataService with the resumable upload protocol.
+
+  The chunk size follows the measured throughput, so each chunk takes
+  about target_chunk_seconds to send: long enough not to waste time on
+  round trips, short enough that little is sent again after a failure.
+  """
+  retry_exceptions = (socket.error, httplib.HTTPException)
+
+  def __init__(self, service, session_store=None,
+               chunk_size=DEFAULT_CHUNK_SIZE,
+               target_chunk_seconds=TARGET_CHUNK_SECONDS,
+               max_failures=MAX_FAILURES, retry_seconds=RETRY_SECONDS):
+    """
+    Args:
+      service: The GDataService whose request method sends the requests.
+      session_store: An object with get, put and remove methods, such as a
+          FileUploadSessionStore, which keeps sessions between uploads, or
+          None.
+    """
+    self.service = service
+    self.session_store = session_store
+    self.chunk_size = chunk_size
+    self.target_chunk_seconds = target_chunk_seconds
+    self.max_failures = max_failures
+    self.retry_seconds = retry_seconds
+
+  def Upload(self, uri, entry, file_handle, content_type, content_length,
+             slug=None, session_key=None, extra_headers=None,
+             converter=None):
+    """Uploads the media in file_handle, with entry as its metadata.
+
+    Args:
+      uri: str The resumable upload URI to POST the entry to.
+      entry: The entry (or its XML) describing the media.
+      file_handle: A seekable file to read the media from.
+      content_type: str The MIME type of the media.
+      content_length: int The size of the media.
+      slug: str (optional) The file name to send in the Slug header.
+      session_key: str (optional) Identifies the upload in the session
+          store. An upload with the key of an unfinished one resumes it.
+      extra_headers: dict (optional) Headers to add to each request.
+      converter: func (optional) Converts the body of the final response.
+
+    Returns:
+      The final response body, converted by converter if one was given.
+
+    Raises:
+      gdata.service.RequestError: The server refused the upload, or it
+          failed max_failures times in a row.
+    """
+    session = None
+    if session_key is not None and self.session_store is not None:
+      session = self.session_store.get(session_key)
+      if session is not None and session.length != content_length:
+        # Not the file this session was uploading.
+        session = None
+      elif session is not None:
+        # Ask the server rather than trust the stored offset.
+        session.offset = None
+
+    failures = 0
+    while True:
+      offset = None
+      sent = 0
+      response = None
+      error = None
+      try:
+        if session is None:
+          response = self._StartSession(uri, entry, content_type,
+              content_length, slug, extra_headers)
+        elif session.offset is None:
+          response = self._QueryStatus(session, extra_headers)
+        else:
+          offset = session.offset
+          started = time.time()
+          sent = min(self.chunk_size, content_length - offset)
+          response = self._SendChunk(session, file_handle, content_type,
+                                     sent, extra_headers)
+          elapsed = time.time() - started
+      except self.retry_exceptions, e:
+        error = e
+
+      if response is not None and session is None:
+        body = response.read()
+        location = response.getheader('Location')
+        if response.status in (200, 201) and location:
+          session = UploadSession(location, content_length, 0)
+          self._Save(session_key, session)
+          continue
+        if response.status < 500:
+          reason = response.reason
+          if response.status in (200, 201):
+            reason = 'No upload session given'
+          raise gdata.service.RequestError, {'status': response.status,
+              'reason': reason, 'body': body}
+      elif response is not None:
+        body = response.read()
+        if response.status in (200, 201):
+          self._Forget(session_key)
+          if converter:
+            return converter(body)
+          return body
+        if response.status == RESUME_INCOMPLETE:
+          session.offset = _ConfirmedLength(response)
+          self._Save(session_key, session)
+          if offset is None or session.offset > offset:
+            if offset is not None:
+              failures = 0
+              self._AdjustChunkSize(sent, elapsed)
+            continue
+        elif response.status in (404, 410):
+          # The session has expired, so the upload starts over.
+          self._Forget(session_key)
+          session = None
+        elif response.status < 500:
+          self._Forget(session_key)
+          raise gdata.service.RequestError, {'status': response.status,
+              'reason': response.reason, 'body': body}
+
+      failures += 1
+      if failures >= self.max_failures:
+        if response is None:
+          raise gdata.service.RequestError, {'status': 0,
+              'reason': 'Upload failed: %s' % (error,), 'body': ''}
+        raise gdata.service.RequestError, {'status': response.status,
+            'reason': response.reason, 'body': body}
+      if session is not None:
+        session.offset = None
+      time.sleep(self.retry_seconds * 2 ** (failures - 1))
+
+  def _StartSession(self, uri, entry, content_type, content_length, slug,
+                    extra_headers):
+    """POSTs the entry. The response's Location is the session URI."""
+    headers = (extra_headers or {}).copy()
+    headers['Content-Type'] = 'application/atom+xml'
+    headers['X-Upload-Content-Type'] = content_type
+    headers['X-Upload-Content-Length'] = str(content_length)
+    if slug:
+      headers['Slug'] = slug
+    return self.service.request('POST', uri, data=str(entry),
+                                headers=headers)
+
+  def _QueryStatus(self, session, extra_headers):
+    headers = (extra_headers or {}).copy()
+    headers['Content-Length'] = '0'
+    headers['Content-Range'] = 'bytes */%d' % session.length
+    return self.service.request('PUT', session.uri, headers=headers)
+
+  def _SendChunk(self, session, file_handle, content_type, length,
+                 extra_headers):
+    headers = (extra_headers or {}).copy()
+    headers['Content-Type'] = content_type
+    headers['Content-Length'] = str(length)
+    headers['Content-Range'] = 'bytes %d-%d/%d' % (
+        session.offset, session.offset + length - 1, session.length)
+    file_handle.seek(session.offset)
+    return self.service.request('PUT', session.uri,
+        data=_FileSlice(file_handle, length), headers=headers)
+
+  def _AdjustChunkSize(self, sent, elapsed):
+    """Sizes the next chunk to take about target_chunk_seconds to send."""
+    if sent < self.chunk_size or elapsed <= 0:
+      # The last chunk is cut short, which says nothing about the speed.
+      return
+    size = int(float(sent) / elapsed * self.target_chunk_seconds)
+    # Grow gradually, since one fast chunk may be luck.
+    size = max(MIN_CHUNK_SIZE, min(size, 2 * self.chunk_size, MAX_CHUNK_SIZE))
+    self.chunk_size = size - size % CHUNK_GRANULARITY
+
+  def _Save(self, session_key, session):
+    if session_key is not None and self.session_store is not None:
+      self.session_store.put(session_key, session)
+
+  def _Forget(self, session_key):
+    if session_key is not None and self.session_store is not None:
+      self.session_store.remove(session_key)
+
+
+class _FileSlice(object):
+  """Reads at most length bytes of a file, from where it's positioned."""
+  def __init__(self, file_handle, length):
+    self.file_handle = file_handle
+    self.remaining = length
+
+  def read(self, size=-1):
+    if size < 0 or size > self.remaining:
+      size = self.remaining
+    data = self.file_handle.read(size)
+    self.remaining -= len(data)
+    return data
+
+
+def _ConfirmedLength(response):
+  """Returns how many bytes a 308 response's Range header says arrived."""
+  confirmed = response.getheader('Range')
+  if not confirmed or '-' not in confirmed:
+    return 0
+  try:
+    return int(confirmed.split('-')[-1]) + 1
+  except ValueError:
+    return 0
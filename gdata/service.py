@@ -57,7 +57,12 @@
 __author__ = 'api.jscudder (Jeffrey Scudder)'
 
 
+import collections
+import httplib
+import os
 import re
+import socket
+import time
 import urllib
 import urlparse
 try:
@@ -73,8 +78,10 @@ except ImportError:
 import atom.service
 import gdata
 import atom
+import atom.http_cache
 import atom.http_interface
 import atom.token_store
+import atom.url
 import gdata.auth
 
 
@@ -189,6 +196,18 @@ class TokenHadNoScope(Error):
   pass
 
 
+# How many pages GetAllEntries and GetEntriesAfter request at once.
+DEFAULT_PAGES_IN_FLIGHT = 4
+
+# How many bytes DownloadMedia reads and writes at a time, and how many
+# times in a row it resumes a download without getting further before it
+# gives up; the wait after each of those doubles from
+# DOWNLOAD_RETRY_SECONDS.
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+MAX_DOWNLOAD_FAILURES = 5
+DOWNLOAD_RETRY_SECONDS = 1
+
+
 class GDataService(atom.service.AtomService):
   """Contains elements needed for GData login and CRUD request headers.
 
@@ -201,6 +220,9 @@ class GDataService(atom.service.AtomService):
   auth_token = None
   # The tokens dict is deprecated in favor of the token_store.
   tokens = None
+  # The highest start-index the service will return results from, if it
+  # has a limit. GetEntriesAfter doesn't request pages beyond it.
+  max_start_index = None
 
   def __init__(self, email=None, password=None, account_type='HOSTED_OR_GOOGLE',
                service=None, auth_service_url=None, source=None, server=None, 
@@ -251,6 +273,9 @@ class GDataService(atom.service.AtomService):
     self.__captcha_token = None
     self.__captcha_url = None
     self.__gsessionid = None
+    # An atom.http_cache.ResponseCache, or similar, makes Get send
+    # conditional requests and reuse results the server says are unchanged.
+    self.response_cache = None
 
     if http_request_handler.__name__ == 'gdata.urlfetch':
       import gdata.alt.appengine
@@ -678,6 +703,12 @@ class GDataService(atom.service.AtomService):
           GDataFeedFromString to parse the server response as if it
           were a GDataFeed.
 
+    If the service has a response_cache, a response with an ETag or a
+    Last-Modified header is cached, and the next Get of the same URI by
+    the same user is made conditional on it. If the server then answers
+    304 Not Modified, the cached body is converted again, so every caller
+    gets a result of its own.
+
     Returns:
       If there is no ResultsTransformer specified in the call, a GDataFeed 
       or GDataEntry depending on which is sent from the server. If the 
@@ -686,6 +717,41 @@ class GDataService(atom.service.AtomService):
       will be that of the ResultsTransformer function.
     """
 
+    uri, extra_headers, cache_key, cached, server_response = self._SendGet(
+        self.request, uri, extra_headers)
+    return self._GetResult(server_response, uri, extra_headers, cache_key,
+        cached, redirects_remaining, encoding, converter)
+
+  def GetAsync(self, uri, extra_headers=None, redirects_remaining=4, 
+      encoding='UTF-8', converter=None):
+    """Starts a Get, and returns as soon as the request has been sent.
+
+    With an http_client which can have several requests in progress, such
+    as atom.http.HttpClient or gdata.alt.appengine.AppEngineHttpClient,
+    many GETs can be started before waiting for any of them. Redirects are
+    followed when the result is asked for.
+
+    See Get for the arguments.
+
+    Returns:
+      An atom.http_interface.PendingResult whose get_result method returns
+      what Get would have, or raises the same errors.
+    """
+    uri, extra_headers, cache_key, cached, pending = self._SendGet(
+        self.request_async, uri, extra_headers)
+    return atom.http_interface.PendingResult(lambda: self._GetResult(
+        pending.get_result(), uri, extra_headers, cache_key, cached,
+        redirects_remaining, encoding, converter))
+
+  def _SendGet(self, request, uri, extra_headers):
+    """Sends the request for Get with request, self.request or
+    self.request_async.
+
+    Returns:
+      A tuple of the URI and extra headers as sent, the response_cache key
+      and CachedResponse the request was made conditional on (or None),
+      and what request returned.
+    """
     if extra_headers is None:
       extra_headers = {}
 
@@ -696,26 +762,40 @@ class GDataService(atom.service.AtomService):
         else:
           uri += '?gsessionid=%s' % (self.__gsessionid,)
 
-    server_response = self.request('GET', uri, 
-        headers=extra_headers)
+    request_headers = extra_headers
+    cache = self.response_cache
+    cache_key = None
+    cached = None
+    if cache is not None:
+      cache_key = self._ResponseCacheKey(uri)
+    if (cache is not None and 'If-None-Match' not in extra_headers and
+        'If-Modified-Since' not in extra_headers):
+      cached = cache.get(cache_key)
+      if cached is not None and cached.body is not None:
+        request_headers = extra_headers.copy()
+        request_headers.update(cached.validator_headers())
+      else:
+        cached = None
+
+    server_response = request('GET', uri, headers=request_headers)
+    return uri, extra_headers, cache_key, cached, server_response
+
+  def _GetResult(self, server_response, uri, extra_headers, cache_key,
+      cached, redirects_remaining, encoding, converter):
+    """Returns what Get returns for server_response, or raises."""
     result_body = server_response.read()
 
-    if server_response.status == 200:
-      if converter:
-        return converter(result_body)
-      # There was no ResultsTransformer specified, so try to convert the
-      # server's response into a GDataFeed.
-      feed = gdata.GDataFeedFromString(result_body)
-      if not feed:
-        # If conversion to a GDataFeed failed, try to convert the server's
-        # response to a GDataEntry.
-        entry = gdata.GDataEntryFromString(result_body)
-        if not entry:
-          # The server's response wasn't a feed, or an entry, so return the
-          # response body as a string.
-          return result_body
-        return entry
-      return feed
+    if server_response.status == 304 and cached is not None:
+      return _ConvertResponseBody(cached.body, converter)
+    elif server_response.status == 200:
+      result = _ConvertResponseBody(result_body, converter)
+      if cache_key is not None:
+        etag = server_response.getheader('ETag')
+        last_modified = server_response.getheader('Last-Modified')
+        if etag or last_modified:
+          self.response_cache.put(cache_key, atom.http_cache.CachedResponse(
+              etag, last_modified, body=result_body))
+      return result
     elif server_response.status == 302:
       if redirects_remaining > 0:
         location = server_response.getheader('Location')
@@ -737,6 +817,24 @@ class GDataService(atom.service.AtomService):
       raise RequestError, {'status': server_response.status,
           'reason': server_response.reason, 'body': result_body}
 
+  def _ResponseCacheKey(self, uri):
+    """Returns the response_cache key for a GET of uri.
+
+    The key includes the Authorization header the request will carry, so
+    users never get each other's cached responses.
+    """
+    url = uri
+    if not url.startswith('http'):
+      if self.ssl:
+        url = 'https://%s%s' % (self.server, uri)
+      else:
+        url = 'http://%s%s' % (self.server, uri)
+    if self.override_token:
+      token = self.override_token
+    else:
+      token = self.token_store.find_token(url)
+    return '%s %s' % (getattr(token, 'auth_header', ''), url)
+
   def GetMedia(self, uri, extra_headers=None):
     """Returns a MediaSource containing media and its metadata from the given
     URI string.
@@ -747,6 +845,129 @@ class GDataService(atom.service.AtomService):
             'Content-Type'),
         response_handle.getheader('Content-Length'))
 
+  def DownloadMedia(self, uri, path_or_file, extra_headers=None,
+                    progress=None, chunk_size=DOWNLOAD_CHUNK_SIZE,
+                    max_failures=MAX_DOWNLOAD_FAILURES):
+    """Downloads the media at uri into a file, chunk_size bytes at a time.
+
+    Unlike reading the MediaSource from GetMedia, this never holds more
+    than a chunk of the media in memory. If the connection drops, the rest
+    is requested with a Range header, on condition (If-Range) that the
+    media hasn't changed; if it has, the download starts over. The number
+    of bytes downloaded is checked against the Content-Length.
+
+    Args:
+      uri: string The URI of the media.
+      path_or_file: The name of a file to write the media to, or a file-like
+          object with a write method. A file object has to be seekable if
+          the download may have to start over.
+      extra_headers: dictionary (optional) Extra HTTP headers to be included
+                     in the GET requests.
+      progress: func (optional) Called after each chunk with the number of
+          bytes downloaded so far and the size of the media, or None if the
+          server didn't give it.
+      chunk_size: int (optional) How many bytes to read at a time.
+      max_failures: int (optional) How many times in a row the download
+          may be resumed without getting any further.
+
+    Returns:
+      A MediaSource with the content type and length of the media, and the
+      file name if a name was given.
+
+    Raises:
+      RequestError if the server answered with an error, or the download
+      failed max_failures times in a row.
+    """
+    if isinstance(path_or_file, (str, unicode)):
+      out = open(path_or_file, 'wb')
+    else:
+      out = path_or_file
+    received = 0
+    total = None
+    # The ETag or Last-Modified date the rest of the media is asked for
+    # with, so a changed file isn't patched together.
+    validator = None
+    content_type = None
+    failures = 0
+    try:
+      while True:
+        headers = (extra_headers or {}).copy()
+        # A Range counts bytes of the media, not of a gzip encoding of it.
+        headers['Accept-Encoding'] = 'identity'
+        if received:
+          headers['Range'] = 'bytes=%d-' % received
+          if validator:
+            headers['If-Range'] = validator
+        before = received
+        try:
+          response = self.request('GET', uri, headers=headers)
+          if response.status == 416 and received and received == total:
+            response.read()
+            break
+          if response.status == 206 and received:
+            start, length = _ParseContentRange(
+                response.getheader('Content-Range'))
+            if start != received:
+              response.read()
+              raise RequestError, {'status': response.status,
+                  'reason': 'Range starting at %s, not %d' % (start, received),
+                  'body': ''}
+            if length is not None:
+              total = length
+          elif response.status == 200:
+            if received:
+              # The media changed, or the server ignored the Range.
+              out.seek(0)
+              out.truncate()
+              received = before = 0
+            total = response.getheader('Content-Length')
+            if total is not None:
+              total = int(total)
+            validator = (response.getheader('ETag') or
+                         response.getheader('Last-Modified'))
+            content_type = response.getheader('Content-Type')
+          else:
+            raise RequestError, {'status': response.status,
+                'reason': response.reason, 'body': response.read()}
+
+          while True:
+            chunk = response.read(chunk_size)
+            if not chunk:
+              break
+            out.write(chunk)
+            received += len(chunk)
+            if progress is not None:
+              progress(received, total)
+          if total is None or received == total:
+            break
+        except (socket.error, httplib.HTTPException):
+          # The response is dropped rather than closed, so its connection
+          # isn't reused.
+          pass
+
+        if total is not None and received > total:
+          raise RequestError, {'status': 0,
+              'reason': 'Got %d bytes, more than the %d expected' % (
+                  received, total), 'body': ''}
+        if received > before:
+          failures = 0
+        else:
+          failures += 1
+          if failures >= max_failures:
+            raise RequestError, {'status': 0,
+                'reason': 'Download stopped after %d of %s bytes' % (
+                    received, total), 'body': ''}
+          time.sleep(DOWNLOAD_RETRY_SECONDS * 2 ** (failures - 1))
+    finally:
+      if out is not path_or_file:
+        out.close()
+
+    media = gdata.MediaSource(content_type=content_type,
+                              content_length=received)
+    if out is not path_or_file:
+      media.file_name = os.path.basename(path_or_file)
+    return media
+
   def GetEntry(self, uri, extra_headers=None):
     """Query the GData API with the given URI and receive an Entry.
     
@@ -826,6 +1047,102 @@ class GDataService(atom.service.AtomService):
     else:
       return None
 
+  def GetAllEntries(self, uri, converter=gdata.GDataFeedFromString,
+                    max_in_flight=DEFAULT_PAGES_IN_FLIGHT):
+    """Yields the entries of every page of the feed at uri, in order.
+
+    The first page is fetched with GetFeed, and the rest as described in
+    GetEntriesAfter.
+
+    Args:
+      uri: string The query in the form of a URI, as for GetFeed.
+      converter: func (optional) Converts the XML of each page to a feed.
+      max_in_flight: int (optional) The most pages requested at once.
+    """
+    feed = GDataService.GetFeed(self, uri, converter=converter)
+    for entry in feed.entry:
+      yield entry
+    for entry in self.GetEntriesAfter(feed, converter=converter,
+                                      max_in_flight=max_in_flight):
+      yield entry
+
+  def GetEntriesAfter(self, feed, converter=None,
+                      max_in_flight=DEFAULT_PAGES_IN_FLIGHT):
+    """Yields the entries of the pages which follow feed, in order.
+
+    If feed's next link pages by start-index, and feed gives the total
+    number of results, the start-index of every remaining page is known.
+    They are requested with GetAsync, up to max_in_flight at a time, and
+    each page's entries are yielded once it and the pages before it have
+    arrived. Pages past max_start_index are not requested.
+
+    Otherwise, as for Google Apps provisioning feeds which page by name,
+    and after the last of those pages in case results were added since
+    feed was fetched, next links are followed one page at a time.
+
+    Args:
+      feed: gdata.GDataFeed or a subclass, usually the first page.
+      converter: func (optional) Converts the XML of each page to a feed.
+          By default pages are parsed into the class of feed, as in
+          GetNext.
+      max_in_flight: int (optional) The most pages requested at once.
+    """
+    if converter is None:
+      def converter(xml_string):
+        return atom.CreateClassFromXMLString(feed.__class__, xml_string)
+    page_uris = collections.deque(self._RemainingPageUris(feed))
+    pending = collections.deque()
+    page = feed
+    while page_uris or pending:
+      while page_uris and len(pending) < max_in_flight:
+        pending.append(self.GetAsync(page_uris.popleft(),
+                                     converter=converter))
+      page = pending.popleft().get_result()
+      for entry in page.entry:
+        yield entry
+
+    next_link = page.GetNextLink()
+    while (next_link is not None and next_link.href and
+           self._WithinMaxStartIndex(next_link.href)):
+      page = GDataService.GetFeed(self, next_link.href, converter=converter)
+      for entry in page.entry:
+        yield entry
+      next_link = page.GetNextLink()
+
+  def _RemainingPageUris(self, feed):
+    """Returns the URIs of the pages after feed, if they can be worked out
+    from its totalResults and its next link's start-index."""
+    next_link = feed.GetNextLink()
+    total_results = getattr(feed, 'total_results', None)
+    if (next_link is None or not next_link.href or total_results is None or
+        not total_results.text):
+      return []
+    next_url = atom.url.parse_url(next_link.href)
+    if 'start-index' not in next_url.params:
+      return []
+    next_start = int(next_url.params['start-index'])
+    start_index = getattr(feed, 'start_index', None)
+    if start_index is not None and start_index.text:
+      page_size = next_start - int(start_index.text)
+    else:
+      page_size = len(feed.entry)
+    if page_size <= 0:
+      return []
+    last_start = int(total_results.text)
+    if self.max_start_index is not None:
+      last_start = min(last_start, self.max_start_index)
+    uris = []
+    for start in xrange(next_start, last_start + 1, page_size):
+      next_url.params['start-index'] = str(start)
+      uris.append(next_url.to_string())
+    return uris
+
+  def _WithinMaxStartIndex(self, uri):
+    if self.max_start_index is None:
+      return True
+    start = atom.url.parse_url(uri).params.get('start-index')
+    return start is None or int(start) <= self.max_start_index
+
   def Post(self, data, uri, extra_headers=None, url_params=None,
            escape_params=True, redirects_remaining=4, media_source=None,
            converter=None):
@@ -865,6 +1182,18 @@ class GDataService(atom.service.AtomService):
         escape_params=escape_params, redirects_remaining=redirects_remaining,
         media_source=media_source, converter=converter)
 
+  def PostAsync(self, data, uri, extra_headers=None, url_params=None,
+           escape_params=True, redirects_remaining=4, media_source=None,
+           converter=None):
+    """Starts a Post, and returns an atom.http_interface.PendingResult.
+
+    See PostOrPutAsync.
+    """
+    return GDataService.PostOrPutAsync(self, 'POST', data, uri, 
+        extra_headers=extra_headers, url_params=url_params, 
+        escape_params=escape_params, redirects_remaining=redirects_remaining,
+        media_source=media_source, converter=converter)
+
   def PostOrPut(self, verb, data, uri, extra_headers=None, url_params=None, 
            escape_params=True, redirects_remaining=4, media_source=None, 
            converter=None):
@@ -900,6 +1229,39 @@ class GDataService(atom.service.AtomService):
       or the results of running converter on the server's result body (if
       converter was specified).
     """
+    uri, extra_headers, server_response = self._SendPostOrPut(self.request,
+        verb, data, uri, extra_headers, media_source)
+    return self._PostOrPutResult(server_response, verb, data, uri,
+        extra_headers, url_params, escape_params, redirects_remaining,
+        media_source, converter)
+
+  def PostOrPutAsync(self, verb, data, uri, extra_headers=None,
+      url_params=None, escape_params=True, redirects_remaining=4,
+      media_source=None, converter=None):
+    """Starts a PostOrPut, and returns as soon as the request has been sent.
+
+    See GetAsync for when requests can overlap, and PostOrPut for the
+    arguments.
+
+    Returns:
+      An atom.http_interface.PendingResult whose get_result method returns
+      what PostOrPut would have, or raises the same errors.
+    """
+    uri, extra_headers, pending = self._SendPostOrPut(self.request_async,
+        verb, data, uri, extra_headers, media_source)
+    return atom.http_interface.PendingResult(lambda: self._PostOrPutResult(
+        pending.get_result(), verb, data, uri, extra_headers, url_params,
+        escape_params, redirects_remaining, media_source, converter))
+
+  def _SendPostOrPut(self, request, verb, data, uri, extra_headers,
+      media_source):
+    """Sends the request for PostOrPut with request, self.request or
+    self.request_async.
+
+    Returns:
+      A tuple of the URI and extra headers as sent, and what request
+      returned.
+    """
     if extra_headers is None:
       extra_headers = {}
 
@@ -929,27 +1291,31 @@ class GDataService(atom.service.AtomService):
           len(data_str) + media_source.content_length)
 
       extra_headers['Content-Type'] = 'multipart/related; boundary=END_OF_PART'
-      server_response = self.request(verb, uri, 
+      server_response = request(verb, uri, 
           data=[multipart[0], data_str, multipart[1], media_source.file_handle,
               multipart[2]], headers=extra_headers)
-      result_body = server_response.read()
       
     elif media_source or isinstance(data, gdata.MediaSource):
       if isinstance(data, gdata.MediaSource):
         media_source = data
       extra_headers['Content-Length'] = str(media_source.content_length)
       extra_headers['Content-Type'] = media_source.content_type
-      server_response = self.request(verb, uri, 
+      server_response = request(verb, uri, 
           data=media_source.file_handle, headers=extra_headers)
-      result_body = server_response.read()
 
     else:
       http_data = data
       content_type = 'application/atom+xml'
       extra_headers['Content-Type'] = content_type
-      server_response = self.request(verb, uri, data=http_data,
+      server_response = request(verb, uri, data=http_data,
           headers=extra_headers)
-      result_body = server_response.read()
+    return uri, extra_headers, server_response
+
+  def _PostOrPutResult(self, server_response, verb, data, uri, extra_headers,
+      url_params, escape_params, redirects_remaining, media_source,
+      converter):
+    """Returns what PostOrPut returns for server_response, or raises."""
+    result_body = server_response.read()
 
     # Server returns 201 for most post requests, but when performing a batch
     # request the server responds with a 200 on success.
@@ -1083,6 +1449,41 @@ class GDataService(atom.service.AtomService):
           'reason': server_response.reason, 'body': result_body}
 
 
+def _ConvertResponseBody(result_body, converter):
+  """Converts the body of a response to Get as described there."""
+  if converter:
+    return converter(result_body)
+  # There was no ResultsTransformer specified, so try to convert the
+  # server's response into a GDataFeed.
+  feed = gdata.GDataFeedFromString(result_body)
+  if not feed:
+    # If conversion to a GDataFeed failed, try to convert the server's
+    # response to a GDataEntry.
+    entry = gdata.GDataEntryFromString(result_body)
+    if not entry:
+      # The server's response wasn't a feed, or an entry, so return the
+      # response body as a string.
+      return result_body
+    return entry
+  return feed
+
+
+def _ParseContentRange(content_range):
+  """Returns the first byte and the total length from a Content-Range
+  header such as 'bytes 100-199/1000'. Either may be None if unknown."""
+  try:
+    byte_range, length = content_range.split(' ', 1)[1].split('/')
+    start = int(byte_range.split('-')[0])
+  except (AttributeError, IndexError, ValueError):
+    return None, None
+  if length.strip() == '*':
+    return start, None
+  try:
+    return start, int(length)
+  except ValueError:
+    return start, None
+
+
 def ExtractToken(url, scopes_included_in_next=True):
   """Gets the AuthSub token from the current page's URL.
 
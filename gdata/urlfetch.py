@@ -240,8 +240,8 @@ class HttpResponse(object):
     else:
       return self.body.read(length)
 
-  def getheader(self, name):
+  def getheader(self, name, default=None):
     if not self.headers.has_key(name):
-      return self.headers[name.lower()]
+      return self.headers.get(name.lower(), default)
     return self.headers[name]
     
@@ -30,6 +30,7 @@ except ImportError:
 import os
 import atom
 import gdata
+import gdata.resumable
 import gdata.service
 import gdata.youtube
 
@@ -47,6 +48,8 @@ YOUTUBE_QUERY_VALID_FORMAT_PARAMETERS = ('1', '5', '6')
 YOUTUBE_STANDARDFEEDS = ('most_recent', 'recently_featured',
                          'top_rated', 'most_viewed','watch_on_mobile')
 YOUTUBE_UPLOAD_URI = 'http://uploads.gdata.youtube.com/feeds/api/users'
+YOUTUBE_RESUMABLE_UPLOAD_URI = ('http://uploads.gdata.youtube.com/resumable/'
+                                'feeds/api/users')
 YOUTUBE_UPLOAD_TOKEN_URI = 'http://gdata.youtube.com/action/GetUploadToken'
 YOUTUBE_VIDEO_URI = 'http://gdata.youtube.com/feeds/api/videos'
 YOUTUBE_USER_FEED_URI = 'http://gdata.youtube.com/feeds/api/users'
@@ -130,6 +133,12 @@ class YouTubeService(gdata.service.GDataService):
         http://code.google.com/apis/youtube/dashboard to obtain a (free) key.
   """
 
+  # YouTube returns at most 1000 results for a query.
+  max_start_index = 1000
+  # Where InsertVideoEntryResumable keeps its upload sessions, such as a
+  # gdata.resumable.FileUploadSessionStore, so they outlive the process.
+  upload_session_store = None
+
   def __init__(self, email=None, password=None, source=None,
                server=YOUTUBE_SERVER, additional_headers=None, client_id=None,
                developer_key=None):
@@ -585,23 +594,7 @@ class YouTubeService(gdata.service.GDataService):
     # file that we plan to upload, such as checking whether we have a valid
     # video_entry and that the file is the correct type and readable, prior
     # to performing the actual POST request.
-
-    try:
-      assert(isinstance(video_entry, gdata.youtube.YouTubeVideoEntry))
-    except AssertionError:
-      raise YouTubeError({'status':YOUTUBE_INVALID_ARGUMENT,
-          'body':'`video_entry` must be a gdata.youtube.VideoEntry instance',
-          'reason':'Found %s, not VideoEntry' % type(video_entry)
-          })
-    majtype, mintype = content_type.split('/')
-
-    try:
-      assert(mintype in YOUTUBE_SUPPORTED_UPLOAD_TYPES)
-    except (ValueError, AssertionError):
-      raise YouTubeError({'status':YOUTUBE_INVALID_CONTENT_TYPE,
-          'body':'This is not a valid content type: %s' % content_type,
-          'reason':'Accepted content types: %s' %
-              ['video/%s' % (t) for t in YOUTUBE_SUPPORTED_UPLOAD_TYPES]})
+    self._CheckUploadArguments(video_entry, content_type)
 
     if (isinstance(filename_or_handle, (str, unicode)) 
         and os.path.exists(filename_or_handle)):
@@ -636,6 +629,98 @@ class YouTubeService(gdata.service.GDataService):
     finally:
       del(self.additional_headers['Slug'])
 
+  def InsertVideoEntryResumable(self, video_entry, filename_or_handle,
+                                youtube_username='default',
+                                content_type='video/quicktime',
+                                session_key=None):
+    """Upload a new video to YouTube in chunks, resuming after failures.
+
+    Needs authentication.
+
+    The video is sent a chunk at a time with the resumable upload protocol
+    (see gdata.resumable), so a dropped connection only costs the chunk it
+    dropped. The upload session is kept in upload_session_store, if the
+    service has one, so a later call for the same file resumes it.
+
+    Args:
+      video_entry: The YouTubeVideoEntry to upload.
+      filename_or_handle: A file name, or a seekable file-like object, where
+          the video will be read from.
+      youtube_username: An optional string representing the username into
+          whose account this video is to be uploaded to. Defaults to the
+          currently authenticated user.
+      content_type: An optional string representing internet media type
+          (a.k.a. mime type) of the media object, as for InsertVideoEntry.
+      session_key: An optional string identifying the upload in the
+          upload_session_store. Defaults to the absolute path, size and
+          modification time of the file, if a file name was given, so a
+          file changed since its upload started is uploaded afresh.
+
+    Returns:
+      The newly created YouTubeVideoEntry if successful.
+
+    Raises:
+      YouTubeError: The arguments were invalid, or the upload failed.
+    """
+    self._CheckUploadArguments(video_entry, content_type)
+
+    if (isinstance(filename_or_handle, (str, unicode))
+        and os.path.exists(filename_or_handle)):
+      file_handle = open(filename_or_handle, 'rb')
+      name = os.path.basename(filename_or_handle)
+      if session_key is None:
+        file_stat = os.stat(filename_or_handle)
+        session_key = '%s:%d:%r' % (os.path.abspath(filename_or_handle),
+                                    file_stat.st_size, file_stat.st_mtime)
+    elif (hasattr(filename_or_handle, 'read') and
+          hasattr(filename_or_handle, 'seek')):
+      file_handle = filename_or_handle
+      name = getattr(file_handle, 'name', 'video')
+    else:
+      raise YouTubeError({'status':YOUTUBE_INVALID_ARGUMENT, 'body':
+          '`filename_or_handle` must be a path name or a seekable file-like '
+          'object',
+          'reason': ('Found %s, not path name or object with .read() and '
+                     '.seek() methods' % type(filename_or_handle))})
+    file_handle.seek(0, 2)
+    content_length = file_handle.tell()
+    upload_uri = '%s/%s/%s' % (YOUTUBE_RESUMABLE_UPLOAD_URI, youtube_username,
+                               'uploads')
+    uploader = gdata.resumable.ResumableUploader(
+        self, session_store=self.upload_session_store)
+
+    try:
+      try:
+        return uploader.Upload(upload_uri, video_entry, file_handle,
+            content_type, content_length, slug=os.path.basename(name),
+            session_key=session_key,
+            converter=gdata.youtube.YouTubeVideoEntryFromString)
+      except gdata.service.RequestError, e:
+        raise YouTubeError(e.args[0])
+    finally:
+      if file_handle is not filename_or_handle:
+        file_handle.close()
+
+  def _CheckUploadArguments(self, video_entry, content_type):
+    """Raises YouTubeError unless video_entry and content_type can be
+    uploaded."""
+    try:
+      assert(isinstance(video_entry, gdata.youtube.YouTubeVideoEntry))
+    except AssertionError:
+      raise YouTubeError({'status':YOUTUBE_INVALID_ARGUMENT,
+          'body':'`video_entry` must be a gdata.youtube.VideoEntry instance',
+          'reason':'Found %s, not VideoEntry' % type(video_entry)
+          })
+
+    try:
+      majtype, mintype = content_type.split('/')
+      assert(mintype in YOUTUBE_SUPPORTED_UPLOAD_TYPES)
+    except (ValueError, AssertionError):
+      raise YouTubeError({'status':YOUTUBE_INVALID_CONTENT_TYPE,
+          'body':'This is not a valid content type: %s' % content_type,
+          'reason':'Accepted content types: %s' %
+              ['video/%s' % (t) for t in YOUTUBE_SUPPORTED_UPLOAD_TYPES]})
+
   def CheckUploadStatus(self, video_entry=None, video_id=None):
     """Check upload status on a recently uploaded video entry.
 
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Measures the memory used by a parsed Google ContactsFeed.
+
+Parses the synthetic feeds from merge_benchmark into the usual
+gdata.contacts classes, into their atom.CompactClass versions, and into
+compact classes which only convert the MERGE_ENTRY_FIELDS of each entry,
+as the merge does. Then adds up the size of every object reachable from
+the feed, including unconverted XML.
+
+Needs the App Engine SDK on PYTHONPATH, like merge_benchmark. Prints one
+JSON object per feed size, e.g.:
+
+  python memory_benchmark.py --sizes=1000,10000
+"""
+
+
+import gc
+import optparse
+import sys
+import time
+import types
+
+import gdata.contacts
+import simplejson
+
+import addressbooker
+import merge_benchmark
+
+
+DEFAULT_SIZES = (1000, 10000, 50000)
+
+# (name, compact, fields) for each way of parsing the feed.
+MODES = (
+    ('default', False, None),
+    ('compact', True, None),
+    ('projected', True, addressbooker.MERGE_ENTRY_FIELDS),
+    )
+
+SHARED_TYPES = (type, types.ClassType, types.FunctionType, types.ModuleType)
+
+
+def ObjectSize(root):
+  """Returns the bytes used by root and every object reachable from it.
+
+  Each object is counted once. Classes, functions and modules are not
+  counted, as they are shared by every feed.
+  """
+  seen = set()
+  pending = [root]
+  total = 0
+  while pending:
+    obj = pending.pop()
+    if id(obj) in seen or isinstance(obj, SHARED_TYPES):
+      continue
+    seen.add(id(obj))
+    total += sys.getsizeof(obj)
+    # Unlike reading obj.__dict__, this doesn't create an empty __dict__
+    # for instances of compact classes.
+    pending.extend(gc.get_referents(obj))
+  return total
+
+
+def MeasureFeed(n_contacts, overlap):
+  """Returns a dict of the memory used by the feed in each mode."""
+  xml = merge_benchmark.MakeContactsFeedXml(n_contacts, overlap)
+  results = {'contacts': n_contacts}
+  for mode, compact, fields in MODES:
+    started = time.time()
+    feed = gdata.contacts.ContactsFeedFromString(xml, compact=compact,
+                                                 fields=fields)
+    results['%s_parse' % mode] = time.time() - started
+    results['%s_bytes' % mode] = ObjectSize(feed)
+    del feed
+  return results
+
+
+def main():
+  parser = optparse.OptionParser(usage='%prog [options]')
+  parser.add_option('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                    help='comma-separated contact counts to measure')
+  parser.add_option('--overlap', type='float', default=0.5,
+                    help='passed on to merge_benchmark.MakeContactsFeedXml')
+  options, args = parser.parse_args()
+
+  for size in options.sizes.split(','):
+    results = MeasureFeed(int(size), options.overlap)
+    print simplejson.dumps(results, sort_keys=True)
+    sys.stdout.flush()
+
+
+if __name__ == '__main__':
+  main()
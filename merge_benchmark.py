@@ -0,0 +1,270 @@
+#!/usr/bin/env python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Benchmarks the Google Contacts merge against synthetic data.
+
+Generates a PoCo submission and a Google ContactsFeed of the same size,
+where a given fraction of the submitted contacts already exist in the
+feed (half matching by name, half by phone number only).  The feed and
+the batch endpoint are served by an atom.mock_http.MockHttpClient, and
+the merge steps of MergeGoogle.ProcessMerge are run and timed phase by
+phase.
+
+Needs the App Engine SDK on PYTHONPATH, like addressbooker itself.
+Prints one JSON object per run, e.g.:
+
+  python merge_benchmark.py --sizes=100,1000 --overlap=0.5
+"""
+
+
+import optparse
+import os
+import sys
+import time
+
+# settings.py wants to know where it's being served from.
+os.environ.setdefault('SERVER_NAME', 'localhost')
+os.environ.setdefault('SERVER_PORT', '8080')
+
+import atom.mock_http
+import gdata.contacts
+import gdata.contacts.service
+import simplejson
+
+import addressbooker
+
+
+DEFAULT_SIZES = (100, 1000, 10000, 50000)
+
+FEED_HEAD = ('<?xml version="1.0" encoding="UTF-8"?>'
+    '<feed xmlns="http://www.w3.org/2005/Atom"'
+    ' xmlns:openSearch="http://a9.com/-/spec/opensearchrss/1.0/"'
+    ' xmlns:gd="http://schemas.google.com/g/2005"'
+    ' xmlns:gContact="http://schemas.google.com/contact/2008"'
+    ' xmlns:batch="http://schemas.google.com/gdata/batch">'
+    '<id>bench@example.com</id><title type="text">Bench Contacts</title>'
+    '<openSearch:totalResults>%d</openSearch:totalResults>'
+    '<openSearch:startIndex>1</openSearch:startIndex>'
+    '<openSearch:itemsPerPage>%d</openSearch:itemsPerPage>')
+
+# Besides what the merge looks at, entries have the other kinds of member
+# a real contact often has.
+FEED_ENTRY = ('<entry>'
+    '<id>http://www.google.com/m8/feeds/contacts/bench%%40example.com/base/%x</id>'
+    '<updated>2008-12-10T04:45:03.331Z</updated>'
+    '<category scheme="http://schemas.google.com/g/2005#kind"'
+    ' term="http://schemas.google.com/contact/2008#contact"/>'
+    '<title type="text">%s</title>'
+    '<link rel="edit" type="application/atom+xml" href="'
+    'http://www.google.com/m8/feeds/contacts/bench%%40example.com/full/%x/1"/>'
+    '<gd:email rel="http://schemas.google.com/g/2005#other"'
+    ' address="person%d@example.com"/>'
+    '<gd:email rel="http://schemas.google.com/g/2005#home"'
+    ' address="someone@home.example.com"/>'
+    '<gd:im rel="http://schemas.google.com/g/2005#home"'
+    ' protocol="http://schemas.google.com/g/2005#GOOGLE_TALK"'
+    ' address="someone@example.com"/>'
+    '<gd:phoneNumber rel="http://schemas.google.com/g/2005#mobile">%s'
+    '</gd:phoneNumber>'
+    '<gd:postalAddress rel="http://schemas.google.com/g/2005#work">'
+    '1600 Amphitheatre Pkwy\nMountain View, CA</gd:postalAddress>'
+    '<gd:organization rel="http://schemas.google.com/g/2005#work">'
+    '<gd:orgName>Example Corp</gd:orgName><gd:orgTitle>Engineer</gd:orgTitle>'
+    '</gd:organization>'
+    '<gContact:website href="http://example.com/" rel="home-page"/>'
+    '<gContact:birthday when="1970-01-01"/>'
+    '<gd:extendedProperty name="pet" value="hamster"/>'
+    '</entry>')
+
+BATCH_RESULT_ENTRY = ('<entry>'
+    '<batch:id>%s</batch:id>'
+    '<batch:status code="200" reason="Success"/>'
+    '</entry>')
+
+
+def PhoneNumber(i):
+  return '+1 415 %03d %04d' % (i / 10000 % 1000, i % 10000)
+
+
+def MakeSubmission(n_contacts, overlap):
+  """Returns the JSON of a PoCo submission of n_contacts contacts.
+
+  The first overlap * n_contacts of them also appear in the feed from
+  MakeContactsFeedXml: even ones by name, odd ones by phone number.
+  """
+  n_overlap = int(n_contacts * overlap)
+  contacts = []
+  for i in range(n_contacts):
+    if i < n_overlap and i % 2:
+      name = 'Renamed Person %d' % i
+    else:
+      name = 'Person %d' % i
+    if i < n_overlap:
+      number = PhoneNumber(i)
+    else:
+      number = PhoneNumber(n_contacts + i)
+    contacts.append({
+      'displayName': name,
+      'phoneNumbers': [
+        {'type': 'mobile', 'value': number},
+        {'type': 'home', 'value': PhoneNumber(3 * n_contacts + i)},
+        ],
+      })
+  return simplejson.dumps({'entry': contacts})
+
+
+def MakeContactsFeedXml(n_contacts, overlap):
+  """Returns the XML of a ContactsFeed of n_contacts entries.
+
+  See MakeSubmission for which of them the submission overlaps with.
+  """
+  n_overlap = int(n_contacts * overlap)
+  parts = [FEED_HEAD % (n_contacts, n_contacts)]
+  for i in range(n_contacts):
+    if i < n_overlap:
+      name, number = 'Person %d' % i, PhoneNumber(i)
+    else:
+      name, number = 'Stranger %d' % i, PhoneNumber(2 * n_contacts + i)
+    parts.append(FEED_ENTRY % (i, name, i, i, number))
+  parts.append('</feed>')
+  return ''.join(parts)
+
+
+class BenchmarkHttpClient(atom.mock_http.MockHttpClient):
+  """Serves recorded feeds, and answers batch POSTs with success.
+
+  Time spent answering batches is added up in server_seconds, so it can
+  be told apart from the merge's own work.
+  """
+
+  def __init__(self, recordings=None):
+    atom.mock_http.MockHttpClient.__init__(self, recordings=recordings)
+    self.server_seconds = 0.0
+
+  def request(self, operation, url, data=None, headers=None):
+    if operation != 'POST':
+      return atom.mock_http.MockHttpClient.request(self, operation, url,
+          data=data, headers=headers)
+    started = time.time()
+    body = [FEED_HEAD % (0, 0)]
+    for entry in gdata.contacts.ContactsFeedFromString(str(data)).entry:
+      body.append(BATCH_RESULT_ENTRY % entry.batch_id.text)
+    body.append('</feed>')
+    response = atom.mock_http.MockResponse(body=''.join(body), status=200,
+                                           reason='OK')
+    self.server_seconds += time.time() - started
+    return response
+
+
+def CompactContactsFeedFromString(xml_string):
+  """Parses the feed into the classes MergeGoogle.FetchMergeTarget does."""
+  return gdata.contacts.ContactsFeedFromString(
+      xml_string, compact=True, fields=addressbooker.MERGE_ENTRY_FIELDS)
+
+
+def RunMerge(n_contacts, overlap):
+  """Runs one merge commit and returns a dict of its phase timings."""
+  json = MakeSubmission(n_contacts, overlap)
+  full_feed_url = addressbooker.CONTACTS_URL + '?max-results=99999'
+  http_client = BenchmarkHttpClient()
+  http_client.add_response(
+      atom.mock_http.MockResponse(body=MakeContactsFeedXml(n_contacts, overlap),
+                                  status=200, reason='OK'),
+      'GET', full_feed_url)
+  client = gdata.contacts.service.ContactsService()
+  client.http_client = http_client
+
+  timings = {'contacts': n_contacts, 'overlap': overlap}
+
+  # What Submit does once per upload.
+  started = time.time()
+  packed = addressbooker.PackContacts(addressbooker.NormalizeContacts(
+      addressbooker.contactsFromJson(json)))
+  timings['normalize'] = time.time() - started
+
+  # What LoadContacts does with the PostDumpContacts once per request.
+  started = time.time()
+  contacts = addressbooker.UnpackContacts(packed)
+  timings['unpack'] = time.time() - started
+
+  started = time.time()
+  feed = client.Get(full_feed_url, converter=CompactContactsFeedFromString)
+  timings['feed_parse'] = time.time() - started
+
+  started = time.time()
+  matcher = addressbooker.ContactMatcher(feed.entry)
+  match_seconds = time.time() - started
+  mutate_seconds = 0.0
+  batch_seconds = 0.0
+  updater = addressbooker.Updater(client=client)
+  n_merged = n_new = 0
+  for contact in contacts:
+    started = time.time()
+    merge_entry = addressbooker.FindEntryToMergeInto(contact, matcher)
+    match_seconds += time.time() - started
+
+    started = time.time()
+    if merge_entry:
+      changes = addressbooker.UpdateContactEntry(merge_entry, contact)
+      if changes:
+        matcher.AddEntry(merge_entry)
+    else:
+      new_entry = addressbooker.NewContactEntry(contact)
+    mutate_seconds += time.time() - started
+
+    started = time.time()
+    if merge_entry:
+      if changes:
+        n_merged += 1
+        updater.AddUpdate(merge_entry)
+    else:
+      n_new += 1
+      updater.AddInsert(new_entry)
+    batch_seconds += time.time() - started
+
+  started = time.time()
+  updater.Flush()
+  updater.Drain()
+  batch_seconds += time.time() - started
+
+  timings['match'] = match_seconds
+  timings['mutate'] = mutate_seconds
+  timings['batch_serialize'] = batch_seconds - http_client.server_seconds
+  timings['merged'] = n_merged
+  timings['new'] = n_new
+  timings['batches'] = updater.metrics['batches_sent']
+  timings['failed'] = updater.metrics['failed']
+  return timings
+
+
+def main():
+  parser = optparse.OptionParser(usage='%prog [options]')
+  parser.add_option('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                    help='comma-separated contact counts to run')
+  parser.add_option('--overlap', type='float', default=0.5,
+                    help='fraction of submitted contacts already in the feed')
+  parser.add_option('--repeat', type='int', default=1,
+                    help='runs per size')
+  options, args = parser.parse_args()
+
+  for size in options.sizes.split(','):
+    for run in range(options.repeat):
+      timings = RunMerge(int(size), options.overlap)
+      timings['run'] = run
+      print simplejson.dumps(timings, sort_keys=True)
+      sys.stdout.flush()
+
+
+if __name__ == '__main__':
+  main()
@@ -3,8 +3,29 @@ from google.appengine.ext import db
 class PostDump(db.Model):
     handle = db.StringProperty(required=True)
     json = db.TextProperty()
+    n_contacts = db.IntegerProperty()
     group = db.StringProperty()
     touch_time = db.DateTimeProperty(auto_now_add=True,
                                      auto_now=True)
 
 
+class PostDumpContacts(db.Model):
+    """The normalized contacts of a PostDump, with the same key name.
+
+    Kept apart from the PostDump so the raw json alone counts against its
+    entity size limit.  packed is made by addressbooker.PackContacts.
+    """
+    packed = db.BlobProperty()
+
+
+class MergeJob(db.Model):
+    """Checkpoint of a Google Contacts merge spread over continue=1 requests."""
+    user = db.UserProperty(required=True)
+    post_dump_key = db.StringProperty(required=True)
+    # Index into the PostDump's contacts of the first contact whose
+    # operation may not have been applied yet.
+    cursor = db.IntegerProperty(default=0)
+    # One line per batch operation that could not be applied.
+    failures = db.StringListProperty()
+    touch_time = db.DateTimeProperty(auto_now_add=True,
+                                     auto_now=True)
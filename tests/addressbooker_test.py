@@ -0,0 +1,429 @@
+#!/usr/bin/python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for addressbooker's merge logic. They need the App Engine SDK on
+the path, since addressbooker imports it, and are skipped without it."""
+
+
+import random
+import time
+import unittest
+
+import atom
+import atom.http_interface
+import atom.retry
+import gdata
+import gdata.contacts
+import gdata.service
+from gdata import test_data
+
+try:
+  import addressbooker
+  import gdata.alt.appengine
+except ImportError:
+  addressbooker = None
+
+
+def Entry(title=None, numbers=()):
+  entry = gdata.contacts.ContactEntry()
+  if title is not None:
+    entry.title = atom.Title(text=title)
+  for number in numbers:
+    entry.phone_number.append(gdata.contacts.PhoneNumber(text=number))
+  return entry
+
+
+def Contact(name, numbers=()):
+  return addressbooker.NormalizeContacts([{
+      'displayName': name,
+      'phoneNumbers': [{'value': number, 'type': 'mobile'}
+                       for number in numbers]}])[0]
+
+
+def ExistingEntry(n, title=None):
+  """Returns an entry as if fetched from the feed, at version 0."""
+  entry = Entry(title)
+  entry.id = atom.Id(text='http://contacts.example.com/%d' % n)
+  entry.link.append(atom.Link(rel='edit', href=entry.id.text + '/0'))
+  return entry
+
+
+class FakeBatchServer(object):
+  """Plays the contacts batch endpoint for an Updater.
+
+  Each contact has a version, and an update whose edit link names an
+  older version gets a 409, as from the real server.  codes maps a batch
+  id to the statuses to answer its next attempts with, instead of
+  applying them; interrupt_after, if set, stops each batch after that
+  many operations.  send_errors and result_errors are exceptions to raise
+  instead of sending the next batches, or instead of their results.
+  """
+  def __init__(self, codes=None, interrupt_after=None):
+    self.codes = codes or {}
+    self.interrupt_after = interrupt_after
+    self.send_errors = []
+    self.result_errors = []
+    self.versions = {}  # contact id -> version
+    self.inserted = 0
+    self.batches = []  # of [(batch id, operation, title)] per batch
+
+  def ExecuteBatchAsync(self, batch_feed, url):
+    if self.send_errors:
+      raise self.send_errors.pop(0)
+    if self.result_errors:
+      error = self.result_errors.pop(0)
+      def Raise():
+        raise error
+      return atom.http_interface.PendingResult(Raise)
+    # Serialized now, as the real client does when the request starts.
+    sent = gdata.contacts.ContactsFeedFromString(batch_feed.ToString())
+    result = gdata.contacts.ContactsFeed()
+    batch = []
+    for entry in sent.entry:
+      if (self.interrupt_after is not None and
+          len(batch) == self.interrupt_after):
+        result.interrupted = gdata.BatchInterrupted(reason='Too slow')
+        break
+      batch_id = entry.batch_id.text
+      batch.append((batch_id, entry.batch_operation.type,
+                    entry.title and entry.title.text))
+      result.entry.append(self.Apply(batch_id, entry))
+    self.batches.append(batch)
+    return atom.http_interface.PendingResult(lambda: result)
+
+  def Apply(self, batch_id, entry):
+    result_entry = gdata.contacts.ContactEntry(
+        batch_id=gdata.BatchId(text=batch_id))
+    codes = self.codes.get(batch_id)
+    if codes:
+      code = codes.pop(0)
+    elif entry.batch_operation.type == gdata.BATCH_INSERT:
+      self.inserted += 1
+      result_entry.id = atom.Id(text='http://contacts.example.com/new%d' %
+                                     self.inserted)
+      self.versions[result_entry.id.text] = 0
+      code = 201
+    else:
+      contact_id = entry.id.text
+      version = self.versions.get(contact_id, 0)
+      if entry.GetEditLink().href != '%s/%d' % (contact_id, version):
+        code = 409
+      else:
+        code = 200
+        self.versions[contact_id] = version + 1
+        result_entry.id = atom.Id(text=contact_id)
+    if code in (200, 201):
+      result_entry.link.append(atom.Link(rel='edit', href='%s/%d' % (
+          result_entry.id.text, self.versions[result_entry.id.text])))
+    result_entry.batch_status = gdata.BatchStatus(code=str(code),
+                                                  reason='Reason %d' % code)
+    return result_entry
+
+
+def ScanForEntry(contact, entries):
+  """The linear search ContactMatcher replaced, as the reference."""
+  for entry in entries:
+    if entry.title and entry.title.text == contact['displayName']:
+      return entry
+    for number in contact['phoneNumbers']:
+      if addressbooker.PhoneNumberListContainsNumber(entry.phone_number,
+                                                     number['value']):
+        return entry
+  return None
+
+
+class ContactMatcherTest(unittest.TestCase):
+
+  def setUp(self):
+    if addressbooker is None:
+      self.skipTest('The App Engine SDK is not installed')
+
+  def testFindsByTitleOrPhoneSuffix(self):
+    alice = Entry('Alice', ['+1 (650) 555-1234'])
+    bob = Entry('Bob', ['415.555.9876'])
+    matcher = addressbooker.ContactMatcher([alice, bob])
+    self.assert_(matcher.Find(Contact('Bob')) is bob)
+    self.assert_(matcher.Find(Contact('Robert', ['5559876'])) is bob)
+    self.assert_(matcher.Find(Contact('Al', ['650-555-1234'])) is alice)
+    self.assertEquals(matcher.Find(Contact('Carol', ['555-0000'])), None)
+    # Numbers too short to have a key never match.
+    short = addressbooker.ContactMatcher([Entry('Dan', ['12345'])])
+    self.assertEquals(short.Find(Contact('Eve', ['12345'])), None)
+
+  def testReturnsFirstMatchInFeedOrder(self):
+    by_phone = Entry('Someone', ['555-1234'])
+    by_title = Entry('Alice')
+    matcher = addressbooker.ContactMatcher([by_phone, by_title])
+    # Both match; the earlier entry wins, whichever key matched it.
+    self.assert_(matcher.Find(Contact('Alice', ['555-1234'])) is by_phone)
+    matcher = addressbooker.ContactMatcher([by_title, by_phone])
+    self.assert_(matcher.Find(Contact('Alice', ['555-1234'])) is by_title)
+    # Of two entries with the same title, the first.
+    first, second = Entry('Alice'), Entry('Alice')
+    matcher = addressbooker.ContactMatcher([first, second])
+    self.assert_(matcher.Find(Contact('Alice')) is first)
+
+  def testAddEntryReindexesAndAppends(self):
+    alice = Entry('Alice')
+    matcher = addressbooker.ContactMatcher([alice])
+    alice.phone_number.append(gdata.contacts.PhoneNumber(text='555-1234'))
+    matcher.AddEntry(alice)
+    self.assert_(matcher.Find(Contact('Al', ['555-1234'])) is alice)
+    new = Entry('Zed', ['555-9999'])
+    matcher.AddEntry(new)
+    self.assert_(matcher.Find(Contact('Zed')) is new)
+    self.assertEquals(len(matcher.entries), 2)
+
+  def testAgreesWithLinearScan(self):
+    chooser = random.Random(1)
+    names = ['Name %d' % i for i in range(30)]
+    def Number():
+      return '(%03d) 555-%04d' % (chooser.randint(200, 999),
+                                  chooser.randint(0, 20))
+    entries = [Entry(chooser.choice(names + [None]),
+                     [Number() for i in range(chooser.randint(0, 3))])
+               for i in range(200)]
+    matcher = addressbooker.ContactMatcher(iter(entries))
+    for i in range(500):
+      contact = Contact(chooser.choice(names + ['Nobody']),
+                        [Number() for i in range(chooser.randint(0, 3))])
+      self.assert_(matcher.Find(contact) is ScanForEntry(contact, entries))
+
+  def testIndexesParsedFeed(self):
+    feed = gdata.contacts.ContactsFeedFromString(test_data.CONTACTS_FEED)
+    matcher = addressbooker.ContactMatcher(feed.entry)
+    self.assert_(matcher.Find(Contact('Fitzgerald')) is feed.entry[0])
+
+
+class UpdaterTest(unittest.TestCase):
+
+  def setUp(self):
+    if addressbooker is None:
+      self.skipTest('The App Engine SDK is not installed')
+    self.retry_seconds = addressbooker.BATCH_RETRY_SECONDS
+    addressbooker.BATCH_RETRY_SECONDS = 0
+
+  def tearDown(self):
+    if addressbooker is not None:
+      addressbooker.BATCH_RETRY_SECONDS = self.retry_seconds
+
+  def testMergesOperationsOnQueuedEntry(self):
+    server = FakeBatchServer()
+    updater = addressbooker.Updater(client=server)
+    entry = ExistingEntry(1, 'Alice')
+    updater.AddUpdate(entry, batch_id='3')
+    entry.phone_number.append(gdata.contacts.PhoneNumber(text='555-1234'))
+    updater.AddUpdate(entry, batch_id='7')
+    # The first contact's operation is unfinished, so a checkpoint can't
+    # pass it.
+    self.assertEquals(updater.UnfinishedBatchIds(), ['3'])
+    updater.Flush()
+    updater.Drain()
+    self.assertEquals(server.batches, [[('3', 'update', 'Alice')]])
+    self.assertEquals(updater.failures, [])
+    self.assertEquals(updater.UnfinishedBatchIds(), [])
+    self.assertEquals(updater.metrics['merged_operations'], 1)
+
+  def testWaitsForEntryInFlight(self):
+    server = FakeBatchServer()
+    updater = addressbooker.Updater(client=server, max_in_flight=2)
+    entry = ExistingEntry(1, 'Alice')
+    updater.AddUpdate(entry, batch_id='3')
+    updater.Flush()
+    self.assertEquals(len(updater.in_flight), 1)
+    entry.phone_number.append(gdata.contacts.PhoneNumber(text='555-1234'))
+    updater.AddUpdate(entry, batch_id='7')
+    self.assertEquals(updater.in_flight, [])
+    self.assertEquals(updater.UnfinishedBatchIds(), ['7'])
+    updater.Flush()
+    updater.Drain()
+    # The second update was made against the version the first made.
+    self.assertEquals(updater.failures, [])
+    self.assertEquals(server.versions['http://contacts.example.com/1'], 2)
+    self.assertEquals([batch[0][0] for batch in server.batches], ['3', '7'])
+
+  def testKeepsOperationsWhenUnavailable(self):
+    for errors in ('send_errors', 'result_errors'):
+      server = FakeBatchServer()
+      getattr(server, errors).append(atom.retry.CircuitOpen('open'))
+      updater = addressbooker.Updater(client=server)
+      updater.AddInsert(Entry('Alice'), batch_id='4')
+      updater.AddInsert(Entry('Bob'), batch_id='5')
+      self.assertRaises(atom.retry.CircuitOpen, updater.Flush)
+      self.assertEquals(sorted(updater.UnfinishedBatchIds()), ['4', '5'])
+      self.assertEquals(updater.attempts, {})
+      # Carrying on sends them.
+      updater.Flush()
+      updater.Drain()
+      self.assertEquals(updater.UnfinishedBatchIds(), [])
+      self.assertEquals(server.inserted, 2)
+    self.assert_(atom.retry.CircuitOpen in addressbooker.UNAVAILABLE_ERRORS)
+
+  def testProcessesMixedStatuses(self):
+    server = FakeBatchServer(codes={'2': [503], '4': [400]})
+    # Carol was changed since the feed was fetched.
+    server.versions['http://contacts.example.com/3'] = 1
+    updater = addressbooker.Updater(client=server)
+    bob = ExistingEntry(2, 'Bob')
+    updater.AddInsert(Entry('Alice'), batch_id='1')
+    updater.AddUpdate(bob, batch_id='2')
+    updater.AddUpdate(ExistingEntry(3, 'Carol'), batch_id='3')
+    updater.AddInsert(Entry('Dave'), batch_id='4')
+    updater.Flush()
+    updater.Drain()
+    self.assertEquals([[op[0] for op in batch] for batch in server.batches],
+                      [['1', '2', '3', '4'], ['2']])
+    self.assertEquals(sorted([(entry.title.text, code)
+                              for entry, code, reason in updater.failures]),
+                      [('Carol', 409), ('Dave', 400)])
+    self.assertEquals(updater.metrics['retried'], 1)
+    self.assertEquals(updater.metrics['failed'], 2)
+    self.assertEquals(updater.UnfinishedBatchIds(), [])
+    # Bob's entry has the edit link of the version the update made.
+    self.assertEquals(bob.GetEditLink().href,
+                      'http://contacts.example.com/2/1')
+
+  def testRetriesRestOfInterruptedBatch(self):
+    server = FakeBatchServer(interrupt_after=2)
+    updater = addressbooker.Updater(client=server)
+    for i in range(5):
+      updater.AddInsert(Entry('Name %d' % i), batch_id=str(i))
+    updater.Flush()
+    updater.Drain()
+    self.assertEquals([len(batch) for batch in server.batches], [2, 2, 1])
+    self.assertEquals(server.inserted, 5)
+    self.assertEquals(updater.failures, [])
+    self.assertEquals(updater.UnfinishedBatchIds(), [])
+
+  def testGivesUpAfterMaxRetries(self):
+    server = FakeBatchServer(codes={'1': [503] * 10})
+    updater = addressbooker.Updater(client=server)
+    updater.AddInsert(Entry('Alice'), batch_id='1')
+    updater.Flush()
+    updater.Drain()
+    self.assertEquals(len(server.batches),
+                      addressbooker.MAX_BATCH_RETRIES + 1)
+    self.assertEquals([code for entry, code, reason in updater.failures],
+                      [503])
+    self.assertEquals(updater.UnfinishedBatchIds(), [])
+
+  def testRetriesBatchAfterRequestError(self):
+    server = FakeBatchServer()
+    server.send_errors.append(gdata.service.RequestError(
+        {'status': 503, 'reason': 'Busy', 'body': ''}))
+    updater = addressbooker.Updater(client=server)
+    updater.AddInsert(Entry('Alice'), batch_id='1')
+    updater.AddInsert(Entry('Bob'), batch_id='2')
+    updater.Flush()
+    self.assertEquals(sorted(updater.UnfinishedBatchIds()), ['1', '2'])
+    updater.Drain()
+    self.assertEquals(server.inserted, 2)
+    self.assertEquals(updater.metrics['retried'], 2)
+    # Other request errors are raised.
+    server.send_errors.append(gdata.service.RequestError(
+        {'status': 400, 'reason': 'Bad', 'body': ''}))
+    updater.AddInsert(Entry('Carol'), batch_id='3')
+    self.assertRaises(gdata.service.RequestError, updater.Flush)
+
+  def testDrainCollectsBatchesInFlight(self):
+    server = FakeBatchServer()
+    updater = addressbooker.Updater(client=server, max_in_flight=3)
+    for i in range(3):
+      updater.AddInsert(Entry('Name %d' % i), batch_id=str(i))
+      updater.Flush()
+    self.assertEquals(len(updater.in_flight), 3)
+    updater.Drain()
+    self.assertEquals(updater.in_flight, [])
+    self.assertEquals(updater.UnfinishedBatchIds(), [])
+    self.assertEquals(updater.metrics['batches_sent'], 3)
+
+  def testDrainLeavesRetriesDueAfterDeadline(self):
+    addressbooker.BATCH_RETRY_SECONDS = 60
+    server = FakeBatchServer(codes={'2': [503]})
+    updater = addressbooker.Updater(client=server,
+                                    deadline=time.time() + 5)
+    updater.AddInsert(Entry('Alice'), batch_id='1')
+    updater.AddInsert(Entry('Bob'), batch_id='2')
+    updater.Flush()
+    started = time.time()
+    updater.Drain()
+    self.assert_(time.time() - started < 1)
+    self.assertEquals(len(server.batches), 1)
+    # Carried over to the next request.
+    self.assertEquals(updater.UnfinishedBatchIds(), ['2'])
+    self.assertEquals([retry[1] for retry in updater.retries], ['2'])
+
+
+class GroupsFeedClient(object):
+  """Answers Gets of the groups feed, noting the response_cache of each."""
+
+  def __init__(self):
+    self.response_cache = None
+    self.caches = []
+
+  def Get(self, uri, converter=None):
+    self.caches.append(self.response_cache)
+    return converter(test_data.CONTACT_GROUPS_FEED)
+
+
+class GroupIdsByNameTest(unittest.TestCase):
+
+  def setUp(self):
+    if addressbooker is None:
+      self.skipTest('The App Engine SDK is not installed')
+    self.user = addressbooker.users.User('groups@example.com')
+    addressbooker.InvalidateGroupIds(self.user)
+
+  def testOnlyGroupsFeedIsCached(self):
+    client = GroupsFeedClient()
+    group_ids = addressbooker.GroupIdsByName(client, self.user)
+    self.assertEquals(group_ids.keys(), ['joggers'])
+    cache, = client.caches
+    self.assert_(isinstance(cache,
+                            gdata.alt.appengine.AppEngineResponseCache))
+    # Other Gets, such as of the contacts feed, aren't cached.
+    self.assertEquals(client.response_cache, None)
+    # Later requests use the map kept in memcache.
+    addressbooker.GroupIdsByName(client, self.user)
+    self.assertEquals(len(client.caches), 1)
+
+
+class PackContactsTest(unittest.TestCase):
+
+  def setUp(self):
+    if addressbooker is None:
+      self.skipTest('The App Engine SDK is not installed')
+
+  def testRoundTrip(self):
+    contacts = addressbooker.NormalizeContacts([
+        {'displayName': u'Z\xfcrich Office', 'img': 'http://x/a.png',
+         'phoneNumbers': [{'value': '+41 44 555 1234', 'type': 'work'},
+                          {'value': '555', 'type': 'fax'}]},
+        {'phoneNumbers': [{'value': '650-555-9876', 'type': 'Mobile'}]},
+        {'displayName': 'Nobody'}])
+    packed = addressbooker.PackContacts(contacts)
+    self.assertEquals(addressbooker.UnpackContacts(packed), contacts)
+
+  def testPackedIsSmallerThanSubmitted(self):
+    json = addressbooker.simplejson.dumps({'entry': [
+        {'displayName': 'Name %d' % i,
+         'phoneNumbers': [{'value': '(650) 555-%04d' % i, 'type': 'home'}]}
+        for i in range(2000)]})
+    contacts = addressbooker.NormalizeContacts(
+        addressbooker.contactsFromJson(json))
+    self.assert_(len(addressbooker.PackContacts(contacts)) < len(json) / 4)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,145 @@
+#!/usr/bin/python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import unittest
+
+import atom.http_cache
+import atom.mock_http
+import gdata.contacts
+import gdata.service
+from gdata import test_data
+
+
+URL = 'http://www.google.com/m8/feeds/contacts/default/full'
+
+
+class HeaderRecordingClient(atom.mock_http.MockHttpClient):
+  """A MockHttpClient which keeps the headers of each request."""
+
+  def __init__(self):
+    atom.mock_http.MockHttpClient.__init__(self)
+    self.sent_headers = []
+
+  def request(self, operation, url, data=None, headers=None):
+    self.sent_headers.append(headers or {})
+    return atom.mock_http.MockHttpClient.request(self, operation, url,
+                                                 data=data, headers=headers)
+
+  def respond(self, status, body='', headers=None):
+    """Answers the next GETs of URL with the given response."""
+    self.recordings = []
+    self.add_response(atom.mock_http.MockResponse(body=body, status=status,
+        reason='Reason', headers=headers), 'GET', URL)
+
+
+class ResponseCacheTest(unittest.TestCase):
+
+  def testDropsLeastRecentlyUsed(self):
+    cache = atom.http_cache.ResponseCache(max_entries=2)
+    for key in ('a', 'b'):
+      cache.put(key, atom.http_cache.CachedResponse(etag=key))
+    self.assertEquals(cache.get('a').etag, 'a')
+    cache.put('c', atom.http_cache.CachedResponse(etag='c'))
+    self.assertEquals(cache.get('b'), None)
+    self.assertEquals(cache.get('a').etag, 'a')
+    self.assertEquals(cache.get('c').etag, 'c')
+    # Replacing a key doesn't drop anything else.
+    cache.put('a', atom.http_cache.CachedResponse(etag='a2'))
+    self.assertEquals(cache.get('a').etag, 'a2')
+    self.assertEquals(cache.get('c').etag, 'c')
+    cache.remove('a')
+    self.assertEquals(cache.get('a'), None)
+    cache.clear()
+    self.assertEquals(cache.get('c'), None)
+
+  def testPutKeepsOnlyValidatorsAndBody(self):
+    cache = atom.http_cache.ResponseCache()
+    cached = atom.http_cache.CachedResponse('"v1"', 'Mon, 01 Jan 2024', 'body')
+    cached.result = object()
+    cache.put('key', cached)
+    kept = cache.get('key')
+    self.assert_(kept is not cached)
+    self.assertEquals((kept.etag, kept.last_modified, kept.body),
+                      ('"v1"', 'Mon, 01 Jan 2024', 'body'))
+    self.assertFalse(hasattr(kept, 'result'))
+
+  def testValidatorHeaders(self):
+    self.assertEquals(atom.http_cache.CachedResponse().validator_headers(),
+                      {})
+    self.assertEquals(
+        atom.http_cache.CachedResponse('"v1"', 'then').validator_headers(),
+        {'If-None-Match': '"v1"', 'If-Modified-Since': 'then'})
+
+
+class GetWithCacheTest(unittest.TestCase):
+
+  def setUp(self):
+    self.http_client = HeaderRecordingClient()
+    self.client = gdata.service.GDataService(server='www.google.com',
+                                             http_client=self.http_client)
+    self.client.response_cache = atom.http_cache.ResponseCache()
+
+  def Get(self, converter=gdata.contacts.ContactsFeedFromString):
+    return self.client.Get(URL, converter=converter)
+
+  def testNotModifiedConvertsCachedBody(self):
+    self.http_client.respond(200, test_data.CONTACTS_FEED, {'ETag': '"v1"'})
+    first = self.Get()
+    self.assertFalse('If-None-Match' in self.http_client.sent_headers[0])
+
+    self.http_client.respond(304)
+    second = self.Get()
+    self.assertEquals(self.http_client.sent_headers[1]['If-None-Match'],
+                      '"v1"')
+    self.assert_(second is not first)
+    self.assertEquals(second.entry[0].title.text, 'Fitzgerald')
+    # Changing one result doesn't change the next.
+    second.entry[0].title.text = 'Changed'
+    self.assertEquals(self.Get().entry[0].title.text, 'Fitzgerald')
+
+  def testNotModifiedWithAnotherConverter(self):
+    self.http_client.respond(200, test_data.CONTACTS_FEED,
+                             {'Last-Modified': 'Mon, 01 Jan 2024'})
+    self.Get()
+    self.http_client.respond(304)
+    self.assertEquals(self.Get(converter=None).__class__,
+                      gdata.GDataFeed)
+    self.assertEquals(
+        self.http_client.sent_headers[1]['If-Modified-Since'],
+        'Mon, 01 Jan 2024')
+    self.assertEquals(self.Get(converter=lambda body: body),
+                      test_data.CONTACTS_FEED)
+
+  def testResponsesWithoutValidatorsAreNotCached(self):
+    self.http_client.respond(200, test_data.CONTACTS_FEED)
+    self.Get()
+    self.Get()
+    self.assertFalse('If-None-Match' in self.http_client.sent_headers[1])
+    self.http_client.respond(304)
+    self.assertRaises(gdata.service.RequestError, self.Get)
+
+  def testCallerValidatorsAreLeftAlone(self):
+    self.http_client.respond(200, test_data.CONTACTS_FEED, {'ETag': '"v1"'})
+    self.Get()
+    self.http_client.respond(304)
+    # A 304 for the caller's own validators isn't answered from the cache.
+    self.assertRaises(gdata.service.RequestError, self.client.Get, URL,
+                      extra_headers={'If-None-Match': '"v0"'})
+    self.assertEquals(self.http_client.sent_headers[1]['If-None-Match'],
+                      '"v0"')
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,281 @@
+#!/usr/bin/python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import httplib
+import mmap
+import os
+import socket
+import StringIO
+import tempfile
+import time
+import unittest
+
+import atom.http
+import atom.http_interface
+import stub_server
+
+
+BODY = ''.join('<entry>%d %s</entry>' % (i, os.urandom(8).encode('hex'))
+               for i in range(5000))
+
+
+class PoolServer(object):
+  """Answers each request with 'ok' over a keep-alive connection.
+
+  faults is a list of the faults to inject, in order: 'drop' drops the
+  connection without answering, 'close' answers then closes the
+  connection without saying it will, 'close_header' answers with
+  Connection: close, 'error' answers 500, and 'ok' answers as usual.
+  """
+  def __init__(self):
+    self.faults = []
+    self.server = stub_server.StubServer(self.Handle)
+
+  def close(self):
+    self.server.close()
+
+  def Commands(self):
+    return [command for command, path, headers in self.server.requests]
+
+  def Handle(self, request):
+    stub_server.read_body(request)
+    fault = self.faults and self.faults.pop(0)
+    if fault == 'drop':
+      request.connection.shutdown(socket.SHUT_RDWR)
+      request.close_connection = 1
+      return
+    if fault == 'error':
+      stub_server.respond(request, 500, 'Broken')
+    elif fault == 'close_header':
+      stub_server.respond(request, 200, 'ok', {'Connection': 'close'})
+    else:
+      stub_server.respond(request, 200, 'ok')
+    if fault == 'close':
+      request.close_connection = 1
+
+
+class ConnectionPoolTest(unittest.TestCase):
+
+  def setUp(self):
+    self.server = PoolServer()
+    self.url = self.server.server.url('/feed')
+    self.client = atom.http.HttpClient()
+    self.pool = self.client.connection_pool
+
+  def tearDown(self):
+    self.pool.clear()
+    self.server.close()
+
+  def Request(self, operation='GET', data=None):
+    response = self.client.request(operation, self.url, data=data)
+    return response.status, response.read()
+
+  def testReusesConnection(self):
+    for i in range(3):
+      self.assertEquals(self.Request(), (200, 'ok'))
+    self.assertEquals(self.pool.metrics['misses'], 1)
+    self.assertEquals(self.pool.metrics['hits'], 2)
+
+  def testDropsConnectionClosedWhileIdle(self):
+    self.server.faults = ['close']
+    self.Request()
+    # Give the server's close time to arrive.
+    time.sleep(0.1)
+    self.assertEquals(self.Request(), (200, 'ok'))
+    self.assertEquals(self.pool.metrics['stale'], 1)
+    self.assertEquals(self.pool.metrics['misses'], 2)
+    self.assertEquals(self.pool.metrics['hits'], 0)
+
+  def testResendsIdempotentRequestOnStaleConnection(self):
+    for operation, data in (('GET', None), ('PUT', 'data'), ('DELETE', None)):
+      self.Request(operation, data)
+      self.server.faults = ['drop']
+      del self.server.server.requests[:]
+      self.assertEquals(self.Request(operation, data), (200, 'ok'))
+      self.assertEquals(self.server.Commands(), [operation, operation])
+    self.assertEquals(self.pool.metrics['stale'], 3)
+
+  def testDoesNotResendPost(self):
+    self.Request('POST', 'data')
+    self.server.faults = ['drop']
+    self.assertRaises((socket.error, httplib.HTTPException), self.Request,
+                      'POST', 'data')
+    self.assertEquals(self.server.Commands(), ['POST', 'POST'])
+    # The broken connection isn't kept; the next request opens another.
+    self.assertEquals(self.Request('POST', 'data'), (200, 'ok'))
+    self.assertEquals(self.pool.metrics['misses'], 2)
+    self.assertEquals(self.pool.metrics['hits'], 1)
+
+  def testDoesNotResendOnNewConnection(self):
+    self.server.faults = ['drop']
+    self.assertRaises((socket.error, httplib.HTTPException), self.Request)
+    self.assertEquals(self.server.Commands(), ['GET'])
+
+  def testReturnsConnectionAfterErrorStatus(self):
+    self.server.faults = ['error']
+    self.assertEquals(self.Request(), (500, 'Broken'))
+    self.assertEquals(self.Request(), (200, 'ok'))
+    self.assertEquals(self.pool.metrics['hits'], 1)
+
+  def testReturnsConnectionAfterResend(self):
+    self.Request()
+    self.server.faults = ['drop']
+    self.Request()
+    self.Request()
+    self.assertEquals(self.pool.metrics['stale'], 1)
+    self.assertEquals(self.pool.metrics['hits'], 2)
+
+  def testKeepsNoConnectionServerWillClose(self):
+    self.server.faults = ['close_header']
+    self.Request()
+    self.Request()
+    self.assertEquals(self.pool.metrics['misses'], 2)
+    self.assertEquals(self.pool.metrics['hits'], 0)
+
+  def testKeepsAtMostMaxPerHost(self):
+    self.pool.max_per_host = 1
+    pending = [self.client.request_async('GET', self.url) for i in range(3)]
+    for result in pending:
+      result.get_result().read()
+    self.assertEquals(self.pool.metrics['evicted'], 2)
+    self.Request()
+    self.assertEquals(self.pool.metrics['hits'], 1)
+
+
+class GzipResponseTest(unittest.TestCase):
+
+  def setUp(self):
+    self.read_size = atom.http.GZIP_READ_SIZE
+    atom.http.GZIP_READ_SIZE = 1000
+    self.server = stub_server.StubServer(self.Handle)
+    self.client = atom.http.HttpClient()
+
+  def tearDown(self):
+    atom.http.GZIP_READ_SIZE = self.read_size
+    self.client.connection_pool.clear()
+    self.server.close()
+
+  def Handle(self, request):
+    if request.path == '/plain':
+      stub_server.respond(request, 200, BODY)
+    else:
+      stub_server.respond(request, 200,
+                          atom.http_interface.gzip_compress(BODY),
+                          {'Content-Encoding': 'gzip'})
+
+  def Get(self, path='/gzip'):
+    return self.client.request('GET', self.server.url(path))
+
+  def testAsksForGzip(self):
+    self.Get().read()
+    command, path, headers = self.server.requests[0]
+    self.assertEquals(headers['accept-encoding'], 'gzip')
+
+  def testDropsEncodingHeaders(self):
+    response = self.Get()
+    self.assertEquals(response.getheader('Content-Encoding'), None)
+    self.assertEquals(response.getheader('Content-Length'), None)
+    self.assertEquals(response.read(), BODY)
+    response = self.Get('/plain')
+    self.assertEquals(response.getheader('Content-Length'), str(len(BODY)))
+    self.assertEquals(response.read(), BODY)
+
+  def testPartialReads(self):
+    response = self.Get()
+    parts = []
+    for size in (1, 10, 999, 1000, 1001, 50000):
+      part = response.read(size)
+      self.assertEquals(len(part), size)
+      parts.append(part)
+    # The rest, in pieces which straddle the encoded reads.
+    while True:
+      part = response.read(777)
+      if not part:
+        break
+      parts.append(part)
+    self.assertEquals(''.join(parts), BODY)
+    self.assertEquals(response.read(10), '')
+
+  def testReadsRestAfterPartialRead(self):
+    response = self.Get()
+    start = response.read(12345)
+    self.assertEquals(start + response.read(), BODY)
+    self.assertEquals(response.read(), '')
+
+  def testReturnsConnectionOnceDecoded(self):
+    for i in range(3):
+      response = self.Get()
+      while response.read(4096):
+        pass
+    self.assertEquals(self.client.connection_pool.metrics['hits'], 2)
+
+
+class SendFileTest(unittest.TestCase):
+
+  def setUp(self):
+    self.window_size = atom.http.MMAP_WINDOW_SIZE
+    atom.http.MMAP_WINDOW_SIZE = 2 * mmap.ALLOCATIONGRANULARITY
+    self.bodies = []
+    self.server = stub_server.StubServer(self.Handle)
+    self.client = atom.http.HttpClient()
+    self.media = os.urandom(5 * atom.http.MMAP_WINDOW_SIZE + 123)
+    self.file = tempfile.TemporaryFile()
+    self.file.write(self.media)
+
+  def tearDown(self):
+    atom.http.MMAP_WINDOW_SIZE = self.window_size
+    self.file.close()
+    self.client.connection_pool.clear()
+    self.server.close()
+
+  def Handle(self, request):
+    self.bodies.append(stub_server.read_body(request))
+    stub_server.respond(request, 200, 'ok')
+
+  def Upload(self, data, length):
+    response = self.client.request('PUT', self.server.url('/media'),
+        data=data, headers={'Content-Length': str(length),
+                            'Content-Type': 'application/octet-stream'})
+    self.assertEquals(response.read(), 'ok')
+    return self.bodies.pop()
+
+  def testSendsWholeFile(self):
+    self.file.seek(0)
+    self.assertEquals(self.Upload(self.file, len(self.media)), self.media)
+    self.assertEquals(self.file.tell(), len(self.media))
+
+  def testSendsFromFilePosition(self):
+    # Neither on a window nor an allocation granularity boundary.
+    for position in (1, mmap.ALLOCATIONGRANULARITY + 5,
+                     3 * atom.http.MMAP_WINDOW_SIZE - 1, len(self.media)):
+      self.file.seek(position)
+      self.assertEquals(self.Upload(self.file, len(self.media) - position),
+                        self.media[position:])
+      self.assertEquals(self.file.tell(), len(self.media))
+
+  def testSendsWithParts(self):
+    self.file.seek(0)
+    body = self.Upload(['head', self.file, 'tail'], len(self.media) + 8)
+    self.assertEquals(body, 'head' + self.media + 'tail')
+
+  def testReadsOtherFiles(self):
+    self.assertEquals(atom.http._send_file(StringIO.StringIO('x'), None),
+                      False)
+    self.assertEquals(self.Upload(StringIO.StringIO(self.media),
+                                  len(self.media)), self.media)
+
+
+if __name__ == '__main__':
+  unittest.main()
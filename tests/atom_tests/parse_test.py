@@ -0,0 +1,154 @@
+#!/usr/bin/python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Checks that parsing with compiled ParseInfo tables gives the same
+objects as the general ExtensionContainer harvesting."""
+
+
+import unittest
+
+import atom
+import gdata
+import gdata.base
+import gdata.calendar
+import gdata.contacts
+import gdata.photos
+import gdata.spreadsheet
+import gdata.youtube
+from gdata import test_data
+
+
+CLASSES = (atom.Feed, atom.Entry, gdata.GDataFeed, gdata.GDataEntry,
+           gdata.base.GBaseItemFeed, gdata.base.GBaseItem,
+           gdata.calendar.CalendarEventFeed, gdata.calendar.CalendarEventEntry,
+           gdata.contacts.ContactsFeed, gdata.contacts.ContactEntry,
+           gdata.photos.AlbumFeed, gdata.spreadsheet.SpreadsheetsCellsFeed,
+           gdata.youtube.YouTubeVideoFeed, gdata.youtube.YouTubeVideoEntry)
+
+
+def Documents():
+  """Yields the name and XML of each document in gdata.test_data."""
+  for name in sorted(dir(test_data)):
+    value = getattr(test_data, name)
+    if isinstance(value, str) and value.lstrip().startswith('<'):
+      yield name, value
+
+
+def State(value):
+  """Returns everything parsing put in value, as comparable data."""
+  if isinstance(value, list):
+    return [State(item) for item in value]
+  if isinstance(value, dict):
+    return sorted((key, State(item)) for key, item in value.iteritems())
+  if hasattr(value, '__dict__'):
+    return (value.__class__.__name__, State(value.__dict__))
+  return value
+
+
+class GeneralParseInfo(atom._ParseInfo):
+  """Sends every class through the general harvesting code."""
+
+  def __init__(self, target_class):
+    super(GeneralParseInfo, self).__init__(target_class)
+    self.default_conversion = False
+    self._members = None
+
+
+class ParseInfoTest(unittest.TestCase):
+
+  def tearDown(self):
+    atom._parse_infos.clear()
+
+  def ParseAll(self, **kwargs):
+    atom._parse_infos.clear()
+    parsed = {}
+    for name, xml in Documents():
+      for target_class in CLASSES:
+        key = (name, target_class.__name__)
+        try:
+          result = atom.CreateClassFromXMLString(target_class, xml, **kwargs)
+        except Exception, e:
+          # Some classes can't parse some documents; they should fail the
+          # same way both ways.
+          parsed[key] = ('error', e.__class__.__name__)
+          continue
+        if result is not None:
+          parsed[key] = State(result)
+    return parsed
+
+  def ParseAllGenerally(self, **kwargs):
+    compiled_class = atom._ParseInfo
+    atom._ParseInfo = GeneralParseInfo
+    try:
+      return self.ParseAll(**kwargs)
+    finally:
+      atom._ParseInfo = compiled_class
+
+  def testCompiledParsingMatchesGeneral(self):
+    compiled = self.ParseAll()
+    self.assert_(len(compiled) > 50)
+    general = self.ParseAllGenerally()
+    self.assertEquals(sorted(compiled.keys()), sorted(general.keys()))
+    for key in compiled:
+      self.assertEquals(compiled[key], general[key], key)
+
+  def testCompiledCompactParsingMatchesGeneral(self):
+    compiled = self.ParseAll(compact=True)
+    general = self.ParseAllGenerally(compact=True)
+    self.assertEquals(sorted(compiled.keys()), sorted(general.keys()))
+    for key in compiled:
+      self.assertEquals(compiled[key], general[key], key)
+
+  def testConstructGivesFreshInstances(self):
+    info = atom.ParseInfo(gdata.contacts.ContactEntry)
+    first = info.construct()
+    second = info.construct()
+    self.assertEquals(State(first), State(gdata.contacts.ContactEntry()))
+    first.email.append(gdata.contacts.Email(address='a@example.com'))
+    first.extension_attributes['foo'] = 'bar'
+    self.assertEquals(second.email, [])
+    self.assertEquals(second.extension_attributes, {})
+
+  def testRebuiltWhenChildrenChange(self):
+    class Thing(atom.AtomBase):
+      _tag = 'thing'
+      _namespace = 'urn:test'
+      _children = atom.AtomBase._children.copy()
+    xml = '<thing xmlns="urn:test"><part>one</part></thing>'
+    thing = atom.CreateClassFromXMLString(Thing, xml)
+    self.assertEquals(thing.extension_elements[0].text, 'one')
+
+    class Part(atom.AtomBase):
+      _tag = 'part'
+      _namespace = 'urn:test'
+    Thing._children['{urn:test}part'] = ('part', Part)
+    thing = atom.CreateClassFromXMLString(Thing, xml)
+    self.assertEquals(thing.part.text, 'one')
+    self.assertEquals(thing.extension_elements, [])
+
+  def testOverriddenConversionIsUsed(self):
+    converted = []
+    class Thing(atom.AtomBase):
+      _tag = 'thing'
+      _namespace = 'urn:test'
+      def _ConvertElementTreeToMember(self, child_tree):
+        converted.append(child_tree.tag)
+        atom.AtomBase._ConvertElementTreeToMember(self, child_tree)
+    atom.CreateClassFromXMLString(Thing,
+        '<thing xmlns="urn:test"><a/><b/></thing>')
+    self.assertEquals(converted, ['{urn:test}a', '{urn:test}b'])
+
+
+if __name__ == '__main__':
+  unittest.main()
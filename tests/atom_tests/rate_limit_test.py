@@ -0,0 +1,111 @@
+#!/usr/bin/python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import time
+import unittest
+
+import atom.mock_http
+import atom.rate_limit
+import atom.service
+
+
+class TokenBucketTest(unittest.TestCase):
+
+  def testLetsBurstThroughThenSpacesRequests(self):
+    now = 100
+    bucket = atom.rate_limit.TokenBucket(2, burst=3, now=now)
+    self.assertEquals([bucket.reserve(now) for i in range(3)], [0, 0, 0])
+    # Requests waiting for the bucket queue up, half a second apart.
+    self.assertEquals([bucket.reserve(now) for i in range(3)],
+                      [0.5, 1.0, 1.5])
+    self.assertEquals(bucket.tokens, -3)
+
+  def testRefillsAtRate(self):
+    now = 100
+    bucket = atom.rate_limit.TokenBucket(2, burst=3, now=now)
+    for i in range(3):
+      bucket.reserve(now)
+    self.assertEquals(bucket.reserve(now + 0.5), 0)
+    self.assertEquals(bucket.reserve(now + 0.5), 0.5)
+    # Never more than burst tokens, however long it's been.
+    self.assertEquals([bucket.reserve(now + 100) for i in range(4)],
+                      [0, 0, 0, 0.5])
+
+  def testIsIdleOnceRefilled(self):
+    now = 100
+    bucket = atom.rate_limit.TokenBucket(1, burst=2, now=now)
+    self.assert_(bucket.is_idle(now))
+    bucket.reserve(now)
+    bucket.reserve(now)
+    bucket.reserve(now)
+    self.assertFalse(bucket.is_idle(now + 2))
+    self.assert_(bucket.is_idle(now + 3))
+
+
+class RateLimiterTest(unittest.TestCase):
+
+  def testWaitsForHostAndUser(self):
+    limiter = atom.rate_limit.RateLimiter(host_rates={'slow': (100, 1)},
+                                          user_rate=(50, 1))
+    self.assertEquals(limiter.wait('slow', 'alice'), 0)
+    self.assert_(0 < limiter.wait('slow') <= 0.01)
+    # The user's bucket is the slower one, though it refilled some while
+    # the host's was waited for.
+    self.assert_(0 < limiter.wait('fast', 'alice') <= 0.02)
+    self.assertEquals(limiter.wait('fast', 'bob'), 0)
+    # Hosts without a rate aren't limited.
+    self.assertEquals([limiter.wait('fast') for i in range(5)], [0] * 5)
+    self.assertEquals(limiter.metrics['requests'], 9)
+    self.assertEquals(limiter.metrics['delayed'], 2)
+    self.assert_(0 < limiter.metrics['max_wait_seconds'] <= 0.02)
+    self.assert_(limiter.metrics['wait_seconds'] <= 0.03)
+
+  def testDefaultHostRate(self):
+    limiter = atom.rate_limit.RateLimiter(default_host_rate=(100, 2))
+    waits = [limiter.wait('anywhere') for i in range(3)]
+    self.assertEquals(waits[:2], [0, 0])
+    self.assert_(waits[2] > 0)
+
+  def testDropsIdleBuckets(self):
+    max_buckets = atom.rate_limit.MAX_BUCKETS
+    atom.rate_limit.MAX_BUCKETS = 3
+    try:
+      limiter = atom.rate_limit.RateLimiter(default_host_rate=(1000, 1),
+                                            user_rate=(0.001, 1))
+      limiter.wait('a', 'busy user')
+      limiter.wait('b')
+      time.sleep(0.01)
+      limiter.wait('c')
+      self.assertEquals(sorted(limiter._buckets),
+                        [('host', 'c'), ('user', 'busy user')])
+    finally:
+      atom.rate_limit.MAX_BUCKETS = max_buckets
+
+  def testServiceRequestsWait(self):
+    http_client = atom.mock_http.MockHttpClient()
+    http_client.add_response(atom.mock_http.MockResponse(body='ok',
+        status=200), 'GET', 'http://www.example.com/feed')
+    service = atom.service.AtomService(server='www.example.com',
+                                       http_client=http_client)
+    service.rate_limiter = atom.rate_limit.RateLimiter(
+        host_rates={'www.example.com': (100, 1)})
+    for i in range(3):
+      self.assertEquals(service.Get('/feed').read(), 'ok')
+    self.assertEquals(service.rate_limiter.metrics['requests'], 3)
+    self.assertEquals(service.rate_limiter.metrics['delayed'], 2)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,181 @@
+#!/usr/bin/python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import socket
+import StringIO
+import time
+import unittest
+
+import atom.http_interface
+import atom.retry
+
+
+HOST = 'www.example.com'
+
+
+def Response(status, headers=None):
+  return atom.http_interface.HttpResponse(body='body', status=status,
+                                          reason='Reason', headers=headers)
+
+
+class Sender(object):
+  """Returns (or raises) each of outcomes in turn, counting the calls."""
+  def __init__(self, *outcomes):
+    self.outcomes = list(outcomes)
+    self.calls = 0
+
+  def __call__(self):
+    self.calls += 1
+    outcome = self.outcomes.pop(0)
+    if isinstance(outcome, Exception):
+      raise outcome
+    return outcome
+
+
+class RetryPolicyTest(unittest.TestCase):
+
+  def setUp(self):
+    self.policy = atom.retry.RetryPolicy(base_delay=0, failure_threshold=10)
+
+  def testRetriesServerErrors(self):
+    send = Sender(Response(503), Response(500), Response(200))
+    response = self.policy.perform('GET', HOST, None, send)
+    self.assertEquals(response.status, 200)
+    self.assertEquals(send.calls, 3)
+    self.assertEquals(self.policy.metrics['retries'], 2)
+    self.assertEquals(self.policy.metrics['gave_up'], 0)
+
+  def testRetriesConnectionErrors(self):
+    send = Sender(socket.error('reset'), Response(200))
+    response = self.policy.perform('PUT', HOST, 'data', send)
+    self.assertEquals(response.status, 200)
+    self.assertEquals(send.calls, 2)
+
+  def testGivesUpAfterMaxAttempts(self):
+    send = Sender(*[socket.error('reset')] * 4)
+    self.assertRaises(socket.error, self.policy.perform, 'GET', HOST, None,
+                      send)
+    self.assertEquals(send.calls, self.policy.max_attempts)
+    self.assertEquals(self.policy.metrics['gave_up'], 1)
+
+  def testReturnsOtherStatusesAtOnce(self):
+    send = Sender(Response(404))
+    self.assertEquals(self.policy.perform('GET', HOST, None, send).status,
+                      404)
+    self.assertEquals(send.calls, 1)
+
+  def testDoesNotRetryPost(self):
+    send = Sender(Response(503))
+    self.assertEquals(self.policy.perform('POST', HOST, 'data', send).status,
+                      503)
+    self.assertEquals(send.calls, 1)
+    send = Sender(socket.error('reset'))
+    self.assertRaises(socket.error, self.policy.perform, 'POST', HOST,
+                      'data', send)
+    self.assertEquals(send.calls, 1)
+
+  def testDoesNotRetryFileData(self):
+    send = Sender(Response(503))
+    data = ['part', StringIO.StringIO('file')]
+    self.assertEquals(self.policy.perform('PUT', HOST, data, send).status,
+                      503)
+    self.assertEquals(send.calls, 1)
+
+  def testHonoursRetryAfter(self):
+    send = Sender(Response(503, {'Retry-After': '0'}), Response(200))
+    self.assertEquals(self.policy.perform('GET', HOST, None, send).status,
+                      200)
+    # Asked to wait longer than max_delay, the error is returned.
+    send = Sender(Response(503, {'Retry-After': '3600'}))
+    self.assertEquals(self.policy.perform('GET', HOST, None, send).status,
+                      503)
+    self.assertEquals(send.calls, 1)
+
+  def testUsesFirstAttempt(self):
+    first_attempt = Sender(Response(502))
+    send = Sender(Response(200))
+    response = self.policy.perform('GET', HOST, None, send,
+                                   first_attempt=first_attempt)
+    self.assertEquals(response.status, 200)
+    self.assertEquals((first_attempt.calls, send.calls), (1, 1))
+
+  def testOpensCircuitAfterRepeatedFailures(self):
+    policy = atom.retry.RetryPolicy(max_attempts=1, failure_threshold=2,
+                                    reset_timeout=0.1)
+    for i in range(2):
+      policy.perform('GET', HOST, None, Sender(Response(500)))
+    self.assertEquals(policy.breaker_states(), {HOST: atom.retry.OPEN})
+    self.assertEquals(policy.metrics['circuit_opened'], 1)
+    send = Sender(Response(200))
+    self.assertRaises(atom.retry.CircuitOpen, policy.perform, 'GET', HOST,
+                      None, send)
+    self.assertEquals(send.calls, 0)
+    self.assertEquals(policy.metrics['circuit_refused'], 1)
+    # Other hosts are unaffected.
+    policy.perform('GET', 'other.example.com', None, send)
+    self.assertEquals(send.calls, 1)
+
+    time.sleep(0.15)
+    self.assertEquals(policy.perform('GET', HOST, None,
+                                     Sender(Response(200))).status, 200)
+    self.assertEquals(policy.breaker_states()[HOST], atom.retry.CLOSED)
+
+
+class CircuitBreakerTest(unittest.TestCase):
+
+  def testTripsAtThreshold(self):
+    breaker = atom.retry.CircuitBreaker(failure_threshold=3,
+                                        reset_timeout=60)
+    self.assertFalse(breaker.record_failure())
+    self.assertFalse(breaker.record_failure())
+    self.assertTrue(breaker.record_failure())
+    self.assertFalse(breaker.allow())
+
+  def testSuccessResetsFailures(self):
+    breaker = atom.retry.CircuitBreaker(failure_threshold=2,
+                                        reset_timeout=60)
+    breaker.record_failure()
+    breaker.record_success()
+    self.assertFalse(breaker.record_failure())
+    self.assert_(breaker.allow())
+
+  def testHalfOpenLetsOneTrialThrough(self):
+    breaker = atom.retry.CircuitBreaker(failure_threshold=1,
+                                        reset_timeout=0.05)
+    breaker.record_failure()
+    self.assertFalse(breaker.allow())
+    time.sleep(0.1)
+    self.assert_(breaker.allow())
+    self.assertEquals(breaker.state, atom.retry.HALF_OPEN)
+    self.assertFalse(breaker.allow())
+    # A failed trial opens the circuit again.
+    self.assert_(breaker.record_failure())
+    self.assertEquals(breaker.state, atom.retry.OPEN)
+
+
+class CanResendTest(unittest.TestCase):
+
+  def testCanResend(self):
+    self.assert_(atom.http_interface.can_resend(None))
+    self.assert_(atom.http_interface.can_resend('data'))
+    self.assert_(atom.http_interface.can_resend(['a', 'b']))
+    self.assertFalse(atom.http_interface.can_resend(
+        StringIO.StringIO('data')))
+    self.assertFalse(atom.http_interface.can_resend(
+        ['a', StringIO.StringIO('data')]))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,130 @@
+#!/usr/bin/python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Checks that WriteXml gives the same XML as converting to an ElementTree
+and serializing that."""
+
+
+import unittest
+try:
+  from xml.etree import cElementTree as ElementTree
+except ImportError:
+  from xml.etree import ElementTree
+
+import atom
+import gdata
+import gdata.contacts
+from atom_tests.parse_test import CLASSES, Documents
+
+
+PROJECTION = {gdata.GDataEntry: ('id', 'title', 'link'),
+              gdata.BatchEntry: ('id', 'batch_id', 'batch_status')}
+
+
+def Canonical(element):
+  """Returns the element as data, leaving out how it was written."""
+  return (element.tag, sorted(element.attrib.items()),
+          (element.text or '').strip(), (element.tail or '').strip(),
+          [Canonical(child) for child in element])
+
+
+def Parse(xml):
+  return Canonical(ElementTree.fromstring(xml))
+
+
+class WriteXmlTest(unittest.TestCase):
+
+  def CheckAll(self, **kwargs):
+    checked = 0
+    for name, xml in Documents():
+      for target_class in CLASSES:
+        try:
+          parsed = atom.CreateClassFromXMLString(target_class, xml, **kwargs)
+        except Exception:
+          # parse_test checks these fail the same way both ways.
+          continue
+        if parsed is None:
+          continue
+        expected = ElementTree.tostring(parsed._ToElementTree(),
+                                        encoding='UTF-8')
+        self.assertEquals(Parse(parsed.ToString()), Parse(expected),
+                          (name, target_class.__name__))
+        checked += 1
+    self.assert_(checked > 50)
+
+  def testMatchesElementTree(self):
+    self.CheckAll()
+
+  def testCompactMatchesElementTree(self):
+    self.CheckAll(compact=True)
+
+  def testProjectedMatchesElementTree(self):
+    self.CheckAll(projection=PROJECTION)
+    self.CheckAll(compact=True, projection=PROJECTION)
+
+  def testEscaping(self):
+    text = 'Tom & Jerry <cartoons> "quoted"'
+    entry = atom.Entry(title=atom.Title(text=text))
+    entry.extension_attributes['note'] = 'a "b"\nc & <d>'
+    parsed = ElementTree.fromstring(entry.ToString())
+    self.assertEquals(parsed.findtext('{%s}title' % atom.ATOM_NAMESPACE),
+                      text)
+    self.assertEquals(parsed.get('note'), 'a "b"\nc & <d>')
+
+  def testEncoding(self):
+    entry = atom.Entry(title=atom.Title(text='caf\xc3\xa9 \xe2\x82\xac'))
+    xml = entry.ToString('iso-8859-1')
+    self.assert_(xml.startswith(
+        "<?xml version='1.0' encoding='iso-8859-1'?>"))
+    # The euro sign isn't in iso-8859-1, so it becomes a reference.
+    self.assert_('caf\xe9 &#8364;' in xml)
+    parsed = ElementTree.fromstring(xml)
+    self.assertEquals(parsed.findtext('{%s}title' % atom.ATOM_NAMESPACE),
+                      u'caf\xe9 \u20ac')
+    self.assert_('caf\xc3\xa9' in entry.ToString())
+
+  def testExtensions(self):
+    entry = gdata.contacts.ContactEntry()
+    entry.extension_elements.append(atom.ExtensionElement(
+        'thing', namespace='urn:other', attributes={'{urn:more}kind': 'x'},
+        text='one', children=[atom.ExtensionElement('part', text='two')]))
+    entry.extension_attributes['{urn:other}flag'] = 'yes'
+    xml = entry.ToString()
+    expected = ElementTree.tostring(entry._ToElementTree(), encoding='UTF-8')
+    self.assertEquals(Parse(xml), Parse(expected))
+    parsed = gdata.contacts.ContactEntryFromString(xml)
+    thing = parsed.FindExtensions('thing', 'urn:other')[0]
+    self.assertEquals(thing.text, 'one')
+    self.assertEquals(thing.attributes, {'{urn:more}kind': 'x'})
+    self.assertEquals(thing.children[0].text, 'two')
+    self.assertEquals(parsed.extension_attributes['{urn:other}flag'], 'yes')
+
+  def testWritesInChunks(self):
+    feed = atom.Feed(entry=[atom.Entry(title=atom.Title(text='Entry %d' % i))
+                            for i in range(100)])
+    chunk_size = atom.XML_CHUNK_SIZE
+    atom.XML_CHUNK_SIZE = 200
+    try:
+      chunks = []
+      feed.WriteXml(chunks.append)
+    finally:
+      atom.XML_CHUNK_SIZE = chunk_size
+    self.assert_(len(chunks) > 10)
+    for chunk in chunks[:-1]:
+      self.assert_(len(chunk) >= 200)
+    self.assertEquals(''.join(chunks), feed.ToString())
+
+
+if __name__ == '__main__':
+  unittest.main()
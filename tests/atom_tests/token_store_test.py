@@ -0,0 +1,123 @@
+#!/usr/bin/python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import unittest
+
+import atom.http_interface
+import atom.token_store
+import atom.url
+import gdata.auth
+
+
+CONTACTS = 'http://www.google.com/m8/feeds/'
+CONTACTS_FULL = 'http://www.google.com/m8/feeds/contacts/default/full'
+CALENDAR = 'https://www.google.com/calendar/feeds/'
+GOOGLE = 'http://www.google.com'
+DOCS = 'http://docs.google.com/feeds/'
+
+SCOPES = [CONTACTS, CONTACTS_FULL, CALENDAR, GOOGLE, DOCS,
+          atom.token_store.SCOPE_ALL]
+
+URLS = [
+    'http://www.google.com/m8/feeds/contacts/default/full?max-results=10',
+    'https://www.google.com:443/m8/feeds/groups/default/full',
+    'http://www.google.com/m8/feedsandmore',
+    'http://www.google.com/calendar/feeds/default',
+    'http://www.google.com',
+    'http://docs.google.com/feeds',
+    'http://docs.google.com/feeds/documents',
+    'http://www.example.com/m8/feeds/',
+    ]
+
+
+def Find(index, url):
+  return index.find(atom.url.parse_url(url))
+
+
+class ScopeIndexTest(unittest.TestCase):
+
+  def testFindsMostSpecificFirst(self):
+    index = atom.token_store.ScopeIndex(SCOPES)
+    self.assertEquals(Find(index, URLS[0]),
+                      [CONTACTS_FULL, CONTACTS, GOOGLE,
+                       atom.token_store.SCOPE_ALL])
+    # The port and protocol don't matter.
+    self.assertEquals(Find(index, URLS[1]),
+                      [CONTACTS, GOOGLE, atom.token_store.SCOPE_ALL])
+    self.assertEquals(Find(index, URLS[3]),
+                      [CALENDAR, GOOGLE, atom.token_store.SCOPE_ALL])
+
+  def testOtherHostsAndPathsDontMatch(self):
+    index = atom.token_store.ScopeIndex([CONTACTS, DOCS])
+    self.assertEquals(Find(index, URLS[7]), [])
+    self.assertEquals(Find(index, 'http://www.google.com/m8/'), [])
+    # A scope with a path doesn't cover a URL without one.
+    self.assertEquals(Find(index, 'http://docs.google.com'), [])
+
+  def testAgreesWithValidForScope(self):
+    index = atom.token_store.ScopeIndex(SCOPES)
+    for url in URLS:
+      valid = [scope for scope in SCOPES
+               if gdata.auth.ClientLoginToken(
+                   scopes=[scope]).valid_for_scope(url)]
+      self.assertEquals(sorted(Find(index, url)), sorted(valid), url)
+
+  def testRemove(self):
+    index = atom.token_store.ScopeIndex(SCOPES)
+    index.remove(CONTACTS)
+    index.remove(atom.token_store.SCOPE_ALL)
+    self.assertEquals(Find(index, URLS[0]), [CONTACTS_FULL, GOOGLE])
+    self.assertEquals(Find(index, URLS[1]), [GOOGLE])
+    index.remove(CONTACTS_FULL)
+    index.remove(GOOGLE)
+    self.assertEquals(Find(index, URLS[0]), [])
+    # Removing what isn't there does nothing.
+    index.remove(CONTACTS)
+    index.remove('http://www.example.com/m8/feeds/')
+    self.assertEquals(Find(index, URLS[6]), [DOCS])
+    index.add(CONTACTS)
+    self.assertEquals(Find(index, URLS[0]), [CONTACTS])
+
+
+class TokenStoreTest(unittest.TestCase):
+
+  def testFindsTokenByPrefix(self):
+    contacts = gdata.auth.ClientLoginToken(scopes=[CONTACTS])
+    calendar = gdata.auth.ClientLoginToken(scopes=[CALENDAR, DOCS])
+    store = atom.token_store.TokenStore()
+    store.add_token(contacts)
+    store.add_token(calendar)
+    self.assert_(store.find_token(URLS[0]) is contacts)
+    self.assert_(store.find_token(URLS[6]) is calendar)
+    self.assertEquals(store.find_token(URLS[7]).__class__,
+                      atom.http_interface.GenericToken)
+
+  def testRemovedTokenIsNotFound(self):
+    contacts = gdata.auth.ClientLoginToken(scopes=[CONTACTS])
+    everything = gdata.auth.ClientLoginToken(scopes=[GOOGLE])
+    store = atom.token_store.TokenStore()
+    store.add_token(contacts)
+    store.add_token(everything)
+    self.assert_(store.find_token(URLS[0]) is contacts)
+    self.assert_(store.remove_token(contacts))
+    self.assertFalse(store.remove_token(contacts))
+    self.assert_(store.find_token(URLS[0]) is everything)
+    store.remove_all_tokens()
+    self.assertEquals(store.find_token(URLS[0]).__class__,
+                      atom.http_interface.GenericToken)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,232 @@
+#!/usr/bin/python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import os
+import shutil
+import socket
+import StringIO
+import tempfile
+import unittest
+
+import atom.mock_http
+import gdata.service
+import stub_server
+
+
+MEDIA = os.urandom(256 * 1024 + 7)
+CHUNK_SIZE = 4096
+
+
+class MediaServer(object):
+  """Serves MEDIA with Range and If-Range support, and injected faults.
+
+  faults is a list of the faults to inject, in order: 'drop' sends half of
+  the body then drops the connection, 'stall' drops it before sending any
+  of the body, 'change' replaces the media (and its ETag) with
+  new_content before answering, 'ignore_range' answers with all of the
+  media, 'wrong_start' answers a Range with bytes starting elsewhere, and
+  'ok' answers as usual.
+  """
+  def __init__(self):
+    self.faults = []
+    self.content = MEDIA
+    self.etag = '"v1"'
+    self.new_content = None
+    self.server = stub_server.StubServer(self.Handle)
+    self.url = self.server.url('/media/photo.jpg')
+
+  def close(self):
+    self.server.close()
+
+  def RequestHeaders(self):
+    return [headers for command, path, headers in self.server.requests]
+
+  def Handle(self, request):
+    if request.path != '/media/photo.jpg':
+      stub_server.respond(request, 404, 'Not here')
+      return
+    fault = self.faults and self.faults.pop(0)
+    if fault == 'change':
+      self.content = self.new_content
+      self.etag = '"v2"'
+    content = self.content
+    start = 0
+    range_header = request.headers.get('range')
+    if_range = request.headers.get('if-range')
+    if (range_header and fault != 'ignore_range' and
+        if_range in (None, self.etag)):
+      start = int(range_header.split('=')[1].rstrip('-'))
+      if start >= len(content):
+        stub_server.respond(request, 416)
+        return
+      if fault == 'wrong_start':
+        start -= 1
+      request.send_response(206)
+      request.send_header('Content-Range', 'bytes %d-%d/%d' % (
+          start, len(content) - 1, len(content)))
+    else:
+      request.send_response(200)
+    request.send_header('ETag', self.etag)
+    request.send_header('Content-Type', 'image/jpeg')
+    request.send_header('Content-Length', str(len(content) - start))
+    request.end_headers()
+    body = content[start:]
+    if fault in ('drop', 'stall'):
+      if fault == 'drop':
+        request.wfile.write(body[:len(body) // 2])
+        request.wfile.flush()
+      request.connection.shutdown(socket.SHUT_RDWR)
+      request.close_connection = 1
+      return
+    request.wfile.write(body)
+
+
+class DownloadMediaTest(unittest.TestCase):
+
+  def setUp(self):
+    self.retry_seconds = gdata.service.DOWNLOAD_RETRY_SECONDS
+    gdata.service.DOWNLOAD_RETRY_SECONDS = 0
+    self.media = MediaServer()
+    self.client = gdata.service.GDataService(server=self.media.server.host)
+    self.dir = tempfile.mkdtemp()
+    self.path = os.path.join(self.dir, 'photo.jpg')
+
+  def tearDown(self):
+    gdata.service.DOWNLOAD_RETRY_SECONDS = self.retry_seconds
+    self.media.close()
+    shutil.rmtree(self.dir)
+
+  def Download(self, out=None, **kwargs):
+    kwargs.setdefault('chunk_size', CHUNK_SIZE)
+    return self.client.DownloadMedia(self.media.url, out or self.path,
+                                     **kwargs)
+
+  def Downloaded(self):
+    return open(self.path, 'rb').read()
+
+  def testDownloadsToPath(self):
+    progress = []
+    media = self.Download(progress=lambda *args: progress.append(args))
+    self.assertEquals(self.Downloaded(), MEDIA)
+    self.assertEquals(media.content_type, 'image/jpeg')
+    self.assertEquals(media.content_length, len(MEDIA))
+    self.assertEquals(media.file_name, 'photo.jpg')
+    self.assertEquals(progress[0], (CHUNK_SIZE, len(MEDIA)))
+    self.assertEquals(progress[-1], (len(MEDIA), len(MEDIA)))
+    headers, = self.media.RequestHeaders()
+    self.assertEquals(headers['accept-encoding'], 'identity')
+    self.assertFalse('range' in headers)
+
+  def testResumesWithRangeAndIfRange(self):
+    self.media.faults = ['drop', 'drop']
+    self.Download()
+    self.assertEquals(self.Downloaded(), MEDIA)
+    sent = self.media.RequestHeaders()
+    self.assertEquals(len(sent), 3)
+    starts = []
+    for headers in sent[1:]:
+      self.assert_(headers['range'].startswith('bytes='))
+      starts.append(int(headers['range'][6:].rstrip('-')))
+      self.assertEquals(headers['if-range'], '"v1"')
+    self.assert_(0 < starts[0] < starts[1] < len(MEDIA))
+
+  def testRestartsWhenMediaChanges(self):
+    # Shorter than what was downloaded before, so the file is truncated.
+    self.media.new_content = 'changed'
+    self.media.faults = ['drop', 'change']
+    media = self.Download()
+    self.assertEquals(self.Downloaded(), 'changed')
+    self.assertEquals(media.content_length, len('changed'))
+    self.assertEquals(self.media.RequestHeaders()[1]['if-range'], '"v1"')
+
+  def testRestartsWhenRangeIsIgnored(self):
+    self.media.faults = ['drop', 'ignore_range']
+    out = StringIO.StringIO()
+    self.Download(out)
+    self.assertEquals(out.getvalue(), MEDIA)
+    self.assert_('range' in self.media.RequestHeaders()[1])
+
+  def testWrongRangeStartRaises(self):
+    self.media.faults = ['drop', 'wrong_start']
+    self.assertRaises(gdata.service.RequestError, self.Download)
+
+  def testGivesUpWithoutProgress(self):
+    self.media.faults = ['drop'] + ['stall'] * 3
+    self.assertRaises(gdata.service.RequestError, self.Download,
+                      max_failures=3)
+    self.assertEquals(len(self.media.RequestHeaders()), 4)
+    # Any progress starts the count again.
+    self.media.faults = ['stall', 'stall', 'drop', 'stall', 'stall']
+    self.Download(max_failures=3)
+    self.assertEquals(self.Downloaded(), MEDIA)
+
+  def testErrorStatusRaises(self):
+    try:
+      self.client.DownloadMedia(self.media.server.url('/missing'),
+                                StringIO.StringIO())
+      self.fail('No RequestError')
+    except gdata.service.RequestError, e:
+      self.assertEquals(e[0]['status'], 404)
+
+
+class DroppedAtEndResponse(atom.mock_http.MockResponse):
+  """Reads like an httplib response, then fails once the body is read."""
+
+  def __init__(self, body, status, headers):
+    atom.mock_http.MockResponse.__init__(self, status=status,
+                                         reason='Reason', headers=headers)
+    self.body = StringIO.StringIO(body)
+
+  def read(self, amt=None):
+    data = self.body.read(amt)
+    if amt and not data:
+      raise socket.error('Connection reset')
+    return data
+
+
+class ScriptedClient(atom.mock_http.MockHttpClient):
+  """Answers each request with the next of responses."""
+
+  def __init__(self, *responses):
+    atom.mock_http.MockHttpClient.__init__(self)
+    self.responses = list(responses)
+    self.sent_headers = []
+
+  def request(self, operation, url, data=None, headers=None):
+    self.sent_headers.append(headers)
+    return self.responses.pop(0)
+
+
+class CompleteDownloadTest(unittest.TestCase):
+
+  def testRangeNotSatisfiableWhenComplete(self):
+    # The connection drops after the last byte, so the client asks for the
+    # rest, and the server answers that there is none.
+    http_client = ScriptedClient(
+        DroppedAtEndResponse('0123456789', 200, {'Content-Length': '10',
+                                                 'ETag': '"v1"'}),
+        DroppedAtEndResponse('', 416, {}))
+    client = gdata.service.GDataService(server='www.example.com',
+                                        http_client=http_client)
+    out = StringIO.StringIO()
+    media = client.DownloadMedia('/media', out)
+    self.assertEquals(out.getvalue(), '0123456789')
+    self.assertEquals(media.content_length, 10)
+    self.assertEquals(http_client.sent_headers[1]['Range'], 'bytes=10-')
+    self.assertEquals(http_client.sent_headers[1]['If-Range'], '"v1"')
+
+
+if __name__ == '__main__':
+  unittest.main()
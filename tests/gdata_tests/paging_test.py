@@ -0,0 +1,150 @@
+#!/usr/bin/python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import threading
+import time
+import unittest
+
+import atom
+import atom.url
+import gdata
+import gdata.service
+import stub_server
+
+
+PAGE_SIZE = 10
+
+
+class PagedServer(object):
+  """Serves a feed of total entries, PAGE_SIZE at a time, by start-index.
+
+  Each page's entries have the ids of their positions in the feed. Earlier
+  pages are answered more slowly, so pages requested together arrive out
+  of order. Unless with_total is False, pages give the total number of
+  results.
+  """
+  def __init__(self, total, with_total=True):
+    self.total = total
+    self.with_total = with_total
+    self.in_flight = 0
+    self.max_in_flight = 0
+    self.lock = threading.Lock()
+    self.server = stub_server.StubServer(self.Handle)
+
+  def close(self):
+    self.server.close()
+
+  def Starts(self):
+    return [int(atom.url.parse_url(path).params.get('start-index', 1))
+            for command, path, headers in self.server.requests]
+
+  def Handle(self, request):
+    self.lock.acquire()
+    self.in_flight += 1
+    self.max_in_flight = max(self.max_in_flight, self.in_flight)
+    self.lock.release()
+    start = int(atom.url.parse_url(request.path).params.get('start-index', 1))
+    feed = gdata.GDataFeed(start_index=gdata.StartIndex(text=str(start)))
+    if self.with_total:
+      feed.total_results = gdata.TotalResults(text=str(self.total))
+    for position in range(start, min(start + PAGE_SIZE, self.total + 1)):
+      feed.entry.append(gdata.GDataEntry(atom_id=atom.Id(text=str(position))))
+    if start + PAGE_SIZE <= self.total:
+      feed.link.append(atom.Link(rel='next', href=self.server.url(
+          '/feed?max-results=%d&start-index=%d' % (PAGE_SIZE,
+                                                   start + PAGE_SIZE))))
+    time.sleep(max(0, 100 - start) * 0.0005)
+    self.lock.acquire()
+    self.in_flight -= 1
+    self.lock.release()
+    stub_server.respond(request, 200, feed.ToString())
+
+
+class GetAllEntriesTest(unittest.TestCase):
+
+  def setUp(self):
+    self.servers = []
+
+  def tearDown(self):
+    for server in self.servers:
+      server.close()
+
+  def Serve(self, total, with_total=True):
+    server = PagedServer(total, with_total)
+    self.servers.append(server)
+    self.client = gdata.service.GDataService(server=server.server.host)
+    self.url = server.server.url('/feed?max-results=%d' % PAGE_SIZE)
+    return server
+
+  def Ids(self, entries):
+    return [int(entry.id.text) for entry in entries]
+
+  def testYieldsEntriesInOrder(self):
+    server = self.Serve(95)
+    self.assertEquals(self.Ids(self.client.GetAllEntries(self.url)),
+                      range(1, 96))
+    self.assertEquals(sorted(server.Starts()), range(1, 96, PAGE_SIZE))
+    self.assert_(1 < server.max_in_flight <=
+                 gdata.service.DEFAULT_PAGES_IN_FLIGHT)
+
+  def testKeepsToMaxInFlight(self):
+    server = self.Serve(95)
+    entries = self.client.GetAllEntries(self.url, max_in_flight=2)
+    self.assertEquals(self.Ids(entries), range(1, 96))
+    self.assertEquals(server.max_in_flight, 2)
+
+  def testStopsAtLastPage(self):
+    for total in (0, 7, 10, 100):
+      server = self.Serve(total)
+      self.assertEquals(self.Ids(self.client.GetAllEntries(self.url)),
+                        range(1, total + 1))
+      self.assertEquals(sorted(server.Starts()),
+                        range(1, max(total, 1) + 1, PAGE_SIZE))
+
+  def testFollowsNextLinksWithoutTotal(self):
+    server = self.Serve(45, with_total=False)
+    self.assertEquals(self.Ids(self.client.GetAllEntries(self.url)),
+                      range(1, 46))
+    self.assertEquals(server.Starts(), [1, 11, 21, 31, 41])
+    self.assertEquals(server.max_in_flight, 1)
+
+  def testFollowsNextLinkAfterKnownPages(self):
+    server = self.Serve(30)
+    entries = self.client.GetAllEntries(self.url)
+    ids = [int(entries.next().id.text)]
+    # Results added since the first page are found through next links.
+    server.total = 42
+    ids.extend(self.Ids(entries))
+    self.assertEquals(ids, range(1, 43))
+    self.assertEquals(server.Starts()[-2:], [31, 41])
+
+  def testStopsAtMaxStartIndex(self):
+    for with_total in (True, False):
+      server = self.Serve(95, with_total)
+      self.client.max_start_index = 41
+      self.assertEquals(self.Ids(self.client.GetAllEntries(self.url)),
+                        range(1, 51))
+      self.assertEquals(sorted(server.Starts()), [1, 11, 21, 31, 41])
+
+  def testGetEntriesAfterFirstPage(self):
+    server = self.Serve(35)
+    feed = self.client.GetFeed(self.url)
+    self.assertEquals(self.Ids(self.client.GetEntriesAfter(feed)),
+                      range(11, 36))
+    self.assertEquals(sorted(server.Starts()), [1, 11, 21, 31])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,332 @@
+#!/usr/bin/python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import os
+import shutil
+import socket
+import tempfile
+import time
+import unittest
+
+import atom
+import gdata.resumable
+import gdata.service
+import gdata.youtube
+import gdata.youtube.service
+from gdata import test_data
+import stub_server
+
+
+GRANULARITY = gdata.resumable.CHUNK_GRANULARITY
+MEDIA = os.urandom(3 * GRANULARITY + 1000)
+DONE_ENTRY = test_data.YOUTUBE_ENTRY_PRIVATE
+
+
+class ResumableServer(object):
+  """Plays the server side of resumable uploads, with injected faults.
+
+  faults is a list of the faults to inject, in order: 'drop_start' drops
+  the connection of a session POST, 'start_503' answers it 503, and for a
+  chunk PUT 'drop_chunk' drops the connection halfway through the chunk,
+  'no_progress' answers 308 without keeping the chunk, 'expire' forgets
+  the session, and 'ok' takes the chunk as usual.
+  """
+  def __init__(self):
+    self.faults = []
+    self.started = 0
+    self.sessions = {}  # session path -> media received
+    self.chunk_bytes = 0  # bytes of media received in PUTs
+    self.server = stub_server.StubServer(self.Handle)
+    self.upload_uri = self.server.url('/resumable/uploads')
+
+  def close(self):
+    self.server.close()
+
+  def Requests(self, command, path=None):
+    return [(p, headers) for c, p, headers in self.server.requests
+            if c == command and (path is None or p == path)]
+
+  def Handle(self, request):
+    if request.command == 'POST':
+      stub_server.read_body(request)
+      if self._Fault('drop_start'):
+        self._Drop(request)
+      elif self._Fault('start_503'):
+        stub_server.respond(request, 503, 'Try later')
+      else:
+        self.started += 1
+        path = '/session/%d' % self.started
+        self.sessions[path] = ''
+        stub_server.respond(request, 200,
+                            headers={'Location': self.server.url(path)})
+      return
+
+    if request.path not in self.sessions:
+      stub_server.read_body(request)
+      stub_server.respond(request, 404, 'No such session')
+      return
+    content_range = request.headers['Content-Range']
+    total = int(content_range.split('/')[1])
+    if content_range.startswith('bytes */'):
+      self._RespondProgress(request, total)
+      return
+    first = int(content_range.split()[1].split('-')[0])
+    length = int(request.headers['Content-Length'])
+    if self._Fault('drop_chunk'):
+      self._Keep(request.path, first, request.rfile.read(length // 2))
+      self._Drop(request)
+      return
+    data = request.rfile.read(length)
+    if self._Fault('no_progress'):
+      self._RespondProgress(request, total)
+    elif self._Fault('expire'):
+      del self.sessions[request.path]
+      stub_server.respond(request, 410, 'Gone')
+    else:
+      self._Fault('ok')
+      self._Keep(request.path, first, data)
+      self._RespondProgress(request, total)
+
+  def _Fault(self, name):
+    if self.faults and self.faults[0] == name:
+      self.faults.pop(0)
+      return True
+    return False
+
+  def _Keep(self, path, first, data):
+    if first == len(self.sessions[path]):
+      self.sessions[path] += data
+      self.chunk_bytes += len(data)
+
+  def _Drop(self, request):
+    request.connection.shutdown(socket.SHUT_RDWR)
+    request.close_connection = 1
+
+  def _RespondProgress(self, request, total):
+    received = len(self.sessions[request.path])
+    if received == total:
+      stub_server.respond(request, 201, DONE_ENTRY)
+      return
+    headers = {}
+    if received:
+      headers['Range'] = 'bytes=0-%d' % (received - 1)
+    stub_server.respond(request, 308, headers=headers)
+
+
+class ResumableUploaderTest(unittest.TestCase):
+
+  def setUp(self):
+    self.server = ResumableServer()
+    self.service = gdata.service.GDataService()
+    self.media_file = tempfile.TemporaryFile()
+    self.media_file.write(MEDIA)
+    self.directory = tempfile.mkdtemp()
+
+  def tearDown(self):
+    self.server.close()
+    self.media_file.close()
+    shutil.rmtree(self.directory)
+
+  def Uploader(self, session_store=None, max_failures=5):
+    uploader = gdata.resumable.ResumableUploader(self.service,
+        session_store=session_store, chunk_size=GRANULARITY,
+        max_failures=max_failures, retry_seconds=0)
+    # Keep the chunks the same size, so the ranges sent are predictable.
+    uploader._AdjustChunkSize = lambda sent, elapsed: None
+    return uploader
+
+  def Upload(self, uploader, session_key=None):
+    return uploader.Upload(self.server.upload_uri,
+        gdata.youtube.YouTubeVideoEntry(title=atom.Title(text='video')),
+        self.media_file, 'video/quicktime', len(MEDIA),
+        session_key=session_key)
+
+  def assertUploaded(self, session='/session/1'):
+    self.assertEquals(self.server.sessions[session], MEDIA)
+
+  def testUploadsInChunks(self):
+    self.assertEquals(self.Upload(self.Uploader()), DONE_ENTRY)
+    self.assertUploaded()
+    self.assertEquals([headers['content-range'] for path, headers
+                       in self.server.Requests('PUT')],
+                      ['bytes 0-262143/787432', 'bytes 262144-524287/787432',
+                       'bytes 524288-786431/787432',
+                       'bytes 786432-787431/787432'])
+
+  def testResumesAfterConnectionDroppedMidChunk(self):
+    self.server.faults = ['ok', 'drop_chunk']
+    self.assertEquals(self.Upload(self.Uploader()), DONE_ENTRY)
+    self.assertUploaded()
+    # After the drop, the client asks how much arrived, and sends only the
+    # rest.
+    ranges = [headers['content-range'] for path, headers
+              in self.server.Requests('PUT')]
+    self.assertEquals(ranges[2], 'bytes */787432')
+    self.assertEquals(ranges[3],
+                      'bytes %d-%d/787432' % (GRANULARITY + GRANULARITY // 2,
+                                              GRANULARITY + GRANULARITY // 2 +
+                                              GRANULARITY - 1))
+    self.assertEquals(self.server.chunk_bytes, len(MEDIA))
+
+  def testResendsChunkAfter308WithoutProgress(self):
+    self.server.faults = ['ok', 'no_progress']
+    self.assertEquals(self.Upload(self.Uploader()), DONE_ENTRY)
+    self.assertUploaded()
+    ranges = [headers['content-range'] for path, headers
+              in self.server.Requests('PUT')]
+    self.assertEquals(ranges[1:4], ['bytes 262144-524287/787432',
+                                    'bytes */787432',
+                                    'bytes 262144-524287/787432'])
+
+  def testStartsOverWhenSessionExpires(self):
+    store = gdata.resumable.UploadSessionStore()
+    self.server.faults = ['ok', 'expire']
+    self.assertEquals(self.Upload(self.Uploader(store), 'key'), DONE_ENTRY)
+    self.assertEquals(len(self.server.Requests('POST')), 2)
+    self.assertEquals(self.server.sessions.keys(), ['/session/2'])
+    self.assertUploaded('/session/2')
+    self.assertEquals(store.get('key'), None)
+
+  def testRetriesSessionStart(self):
+    self.server.faults = ['drop_start', 'start_503']
+    self.assertEquals(self.Upload(self.Uploader()), DONE_ENTRY)
+    self.assertEquals(len(self.server.Requests('POST')), 3)
+    self.assertUploaded()
+
+  def testGivesUpStartingSession(self):
+    self.server.faults = ['start_503'] * 3
+    try:
+      self.Upload(self.Uploader(max_failures=3))
+      self.fail('No RequestError raised')
+    except gdata.service.RequestError, e:
+      self.assertEquals(e[0]['status'], 503)
+    self.server.faults = ['drop_start'] * 2
+    try:
+      self.Upload(self.Uploader(max_failures=2))
+      self.fail('No RequestError raised')
+    except gdata.service.RequestError, e:
+      self.assertEquals(e[0]['status'], 0)
+
+  def testResumesFromFileUploadSessionStore(self):
+    self.server.faults = ['ok', 'drop_chunk']
+    try:
+      self.Upload(self.Uploader(
+          gdata.resumable.FileUploadSessionStore(self.directory),
+          max_failures=1), 'key')
+      self.fail('No RequestError raised')
+    except gdata.service.RequestError:
+      pass
+    saved = gdata.resumable.FileUploadSessionStore(self.directory).get('key')
+    self.assertEquals((saved.uri, saved.length, saved.offset),
+                      (self.server.server.url('/session/1'), len(MEDIA),
+                       GRANULARITY))
+
+    # A new uploader, as in another process, picks the session up.
+    self.assertEquals(self.Upload(self.Uploader(
+        gdata.resumable.FileUploadSessionStore(self.directory)), 'key'),
+        DONE_ENTRY)
+    self.assertEquals(len(self.server.Requests('POST')), 1)
+    self.assertUploaded()
+    self.assertEquals(self.server.chunk_bytes, len(MEDIA))
+    self.assertEquals(os.listdir(self.directory), [])
+
+
+class AdjustChunkSizeTest(unittest.TestCase):
+
+  def setUp(self):
+    self.uploader = gdata.resumable.ResumableUploader(None,
+        chunk_size=4 * GRANULARITY, target_chunk_seconds=10)
+
+  def testGrowsAtMostTwofold(self):
+    self.uploader._AdjustChunkSize(4 * GRANULARITY, 0.01)
+    self.assertEquals(self.uploader.chunk_size, 8 * GRANULARITY)
+
+  def testShrinksToTargetTime(self):
+    # 4 granules in 20 seconds: 2 fit in 10 seconds.
+    self.uploader._AdjustChunkSize(4 * GRANULARITY, 20)
+    self.assertEquals(self.uploader.chunk_size, 2 * GRANULARITY)
+    self.uploader._AdjustChunkSize(2 * GRANULARITY, 1000)
+    self.assertEquals(self.uploader.chunk_size,
+                      gdata.resumable.MIN_CHUNK_SIZE)
+
+  def testRoundsToGranularity(self):
+    self.uploader._AdjustChunkSize(4 * GRANULARITY, 13)
+    self.assertEquals(self.uploader.chunk_size % GRANULARITY, 0)
+
+  def testIgnoresShortLastChunk(self):
+    self.uploader._AdjustChunkSize(1000, 100)
+    self.assertEquals(self.uploader.chunk_size, 4 * GRANULARITY)
+
+
+class RecordingSessionStore(gdata.resumable.UploadSessionStore):
+
+  def __init__(self):
+    gdata.resumable.UploadSessionStore.__init__(self)
+    self.keys = []
+
+  def put(self, key, session):
+    self.keys.append(key)
+    gdata.resumable.UploadSessionStore.put(self, key, session)
+
+
+class InsertVideoEntryResumableTest(unittest.TestCase):
+
+  def setUp(self):
+    self.server = ResumableServer()
+    self.upload_uri = gdata.youtube.service.YOUTUBE_RESUMABLE_UPLOAD_URI
+    gdata.youtube.service.YOUTUBE_RESUMABLE_UPLOAD_URI = (
+        self.server.server.url('/resumable'))
+    self.client = gdata.youtube.service.YouTubeService()
+    self.client.upload_session_store = RecordingSessionStore()
+    self.path = tempfile.mktemp()
+    self.WriteMedia(MEDIA)
+
+  def tearDown(self):
+    gdata.youtube.service.YOUTUBE_RESUMABLE_UPLOAD_URI = self.upload_uri
+    self.server.close()
+    os.remove(self.path)
+
+  def WriteMedia(self, media):
+    media_file = open(self.path, 'wb')
+    media_file.write(media)
+    media_file.close()
+
+  def Insert(self):
+    return self.client.InsertVideoEntryResumable(
+        gdata.youtube.YouTubeVideoEntry(title=atom.Title(text='video')),
+        self.path)
+
+  def testUploadsFile(self):
+    entry = self.Insert()
+    self.assert_(isinstance(entry, gdata.youtube.YouTubeVideoEntry))
+    self.assertEquals(self.server.sessions['/session/1'], MEDIA)
+
+  def testSessionKeyChangesWithFile(self):
+    self.Insert()
+    first_key = self.client.upload_session_store.keys[0]
+    self.assert_(first_key.startswith(os.path.abspath(self.path)))
+
+    # The same size, but modified since.
+    modified = os.stat(self.path).st_mtime + 10
+    self.WriteMedia(MEDIA[::-1])
+    os.utime(self.path, (modified, modified))
+    self.Insert()
+    self.assertNotEquals(self.client.upload_session_store.keys[-1],
+                         first_key)
+    self.assertEquals(self.server.sessions['/session/2'], MEDIA[::-1])
+
+
+if __name__ == '__main__':
+  unittest.main()
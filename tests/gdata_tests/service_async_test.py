@@ -0,0 +1,139 @@
+#!/usr/bin/python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import time
+import unittest
+
+import atom.http_cache
+import gdata
+import gdata.contacts
+import gdata.contacts.service
+import gdata.service
+from gdata import test_data
+import stub_server
+
+
+SLOW_SECONDS = 0.3
+
+
+def EchoBatch(request):
+  """Answers a batch feed with a success for each of its entries."""
+  request_feed = gdata.contacts.ContactsFeedFromString(
+      stub_server.read_body(request))
+  result_feed = gdata.contacts.ContactsFeed()
+  for entry in request_feed.entry:
+    result_feed.entry.append(gdata.contacts.ContactEntry(
+        batch_id=gdata.BatchId(text=entry.batch_id.text),
+        batch_status=gdata.BatchStatus(code='201', reason='Created')))
+  time.sleep(SLOW_SECONDS)
+  stub_server.respond(request, 200, result_feed.ToString())
+
+
+class GetAsyncTest(unittest.TestCase):
+
+  def setUp(self):
+    self.server = stub_server.StubServer(self.Handle)
+    self.client = gdata.contacts.service.ContactsService(
+        server=self.server.host)
+
+  def tearDown(self):
+    self.server.close()
+
+  def Handle(self, request):
+    if request.command == 'POST':
+      EchoBatch(request)
+    elif request.path.startswith('/slow'):
+      time.sleep(SLOW_SECONDS)
+      stub_server.respond(request, 200, test_data.CONTACTS_FEED)
+    elif request.path == '/moved':
+      stub_server.respond(request, 302, headers={
+          'Location': self.server.url('/feed?gsessionid=abc')})
+    elif request.path == '/missing':
+      stub_server.respond(request, 404, 'Not here')
+    elif request.headers.get('If-None-Match') == '"v1"':
+      stub_server.respond(request, 304)
+    else:
+      stub_server.respond(request, 200, test_data.CONTACTS_FEED,
+                          {'ETag': '"v1"'})
+
+  def testGetsRunConcurrently(self):
+    started = time.time()
+    pending = [self.client.GetAsync('/slow/%d' % i,
+                   converter=gdata.contacts.ContactsFeedFromString)
+               for i in range(5)]
+    feeds = [result.get_result() for result in pending]
+    self.assert_(time.time() - started < 3 * SLOW_SECONDS)
+    for feed in feeds:
+      self.assertEquals(feed.entry[0].title.text, 'Fitzgerald')
+    self.assertEquals(len(self.server.requests), 5)
+
+  def testGetResultRaisesConverterErrors(self):
+    def BadConverter(body):
+      raise ValueError('Not a feed')
+    pending = self.client.GetAsync('/feed', converter=BadConverter)
+    self.assertRaises(ValueError, pending.get_result)
+    # The client is still usable afterwards.
+    feed = self.client.GetAsync('/feed',
+        converter=gdata.contacts.ContactsFeedFromString).get_result()
+    self.assertEquals(len(feed.entry), 1)
+
+  def testGetResultRaisesRequestError(self):
+    pending = self.client.GetAsync('/missing')
+    try:
+      pending.get_result()
+      self.fail('No RequestError raised')
+    except gdata.service.RequestError, e:
+      self.assertEquals(e[0]['status'], 404)
+      self.assertEquals(e[0]['body'], 'Not here')
+
+  def testGetResultFollowsRedirects(self):
+    feed = self.client.GetAsync('/moved',
+        converter=gdata.contacts.ContactsFeedFromString).get_result()
+    self.assertEquals(feed.entry[0].title.text, 'Fitzgerald')
+    self.assertEquals([path for command, path, headers
+                       in self.server.requests],
+                      ['/moved', '/feed?gsessionid=abc'])
+
+  def testGetResultConvertsCachedBodyOn304(self):
+    self.client.response_cache = atom.http_cache.ResponseCache()
+    first = self.client.GetAsync('/feed',
+        converter=gdata.contacts.ContactsFeedFromString).get_result()
+    second = self.client.GetAsync('/feed',
+        converter=gdata.contacts.ContactsFeedFromString).get_result()
+    self.assertEquals(self.server.requests[1][2].get('if-none-match'),
+                      '"v1"')
+    self.assertEquals(second.entry[0].title.text, 'Fitzgerald')
+    self.assert_(first is not second)
+    self.assert_(first.entry[0] is not second.entry[0])
+
+  def testExecuteBatchAsyncRunsConcurrently(self):
+    batch_feed = gdata.contacts.ContactsFeed()
+    for i in range(3):
+      batch_feed.AddInsert(gdata.contacts.ContactEntry(),
+                           batch_id_string=str(i))
+    started = time.time()
+    pending = [self.client.ExecuteBatchAsync(batch_feed, '/batch')
+               for i in range(4)]
+    results = [result.get_result() for result in pending]
+    self.assert_(time.time() - started < 3 * SLOW_SECONDS)
+    for result in results:
+      self.assertEquals([entry.batch_id.text for entry in result.entry],
+                        ['0', '1', '2'])
+      self.assertEquals([entry.batch_status.code for entry in result.entry],
+                        ['201', '201', '201'])
+
+
+if __name__ == '__main__':
+  unittest.main()
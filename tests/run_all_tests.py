@@ -0,0 +1,35 @@
+#!/usr/bin/python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Runs every *_test.py module under this directory."""
+
+
+import os
+import sys
+import unittest
+
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def suite():
+  return unittest.defaultTestLoader.discover(TESTS_DIR, pattern='*_test.py',
+                                             top_level_dir=TESTS_DIR)
+
+
+if __name__ == '__main__':
+  sys.path.insert(0, os.path.dirname(TESTS_DIR))
+  sys.path.insert(0, TESTS_DIR)
+  result = unittest.TextTestRunner(verbosity=1).run(suite())
+  sys.exit(not result.wasSuccessful())
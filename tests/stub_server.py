@@ -0,0 +1,101 @@
+#!/usr/bin/python
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A local HTTP server for tests which need a real socket to talk to.
+
+The test gives StubServer a function which is called with the
+BaseHTTPRequestHandler for each request, and writes the response (or
+drops the connection) itself. Requests are handled on threads of their
+own, with HTTP/1.1 keep-alive, so concurrent and pooled requests can be
+tested.
+"""
+
+
+import BaseHTTPServer
+import SocketServer
+import threading
+import urlparse
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+  daemon_threads = True
+  request_queue_size = 64
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+  protocol_version = 'HTTP/1.1'
+
+  def _Handle(self):
+    # Clients may send the absolute URL, as they would to a proxy.
+    if '://' in self.path:
+      self.path = urlparse.urlunsplit(
+          ('', '') + urlparse.urlsplit(self.path)[2:])
+    self.server.stub.requests.append((self.command, self.path,
+                                      dict(self.headers)))
+    self.server.stub.handle(self)
+
+  do_GET = do_POST = do_PUT = do_DELETE = do_HEAD = _Handle
+
+  def log_message(self, *args):
+    pass
+
+
+class StubServer(object):
+  """Serves requests on localhost with handle, until close is called.
+
+  Attributes:
+    handle: A function which is given each request's handler.
+    requests: A list of the (command, path, headers) of each request.
+  """
+  def __init__(self, handle):
+    self.handle = handle
+    self.requests = []
+    self._server = _Server(('127.0.0.1', 0), _Handler)
+    self._server.stub = self
+    self.host = '127.0.0.1:%d' % self._server.server_address[1]
+    self._thread = threading.Thread(target=self._server.serve_forever,
+                                    kwargs={'poll_interval': 0.05})
+    self._thread.setDaemon(True)
+    self._thread.start()
+
+  def url(self, path):
+    return 'http://%s%s' % (self.host, path)
+
+  def close(self):
+    self._server.shutdown()
+    self._server.server_close()
+
+
+def read_body(request):
+  """Reads the body of a request, with a Content-Length or chunked."""
+  if request.headers.get('Transfer-Encoding') == 'chunked':
+    chunks = []
+    while True:
+      size = int(request.rfile.readline().strip(), 16)
+      chunks.append(request.rfile.read(size))
+      request.rfile.readline()
+      if not size:
+        return ''.join(chunks)
+  return request.rfile.read(int(request.headers.get('Content-Length', 0)))
+
+
+def respond(request, status, body='', headers=None):
+  """Sends a complete response with a Content-Length."""
+  request.send_response(status)
+  for name, value in (headers or {}).items():
+    request.send_header(name, value)
+  request.send_header('Content-Length', str(len(body)))
+  request.end_headers()
+  if request.command != 'HEAD':
+    request.wfile.write(body)